@@ -3,7 +3,16 @@ import time
 
 
 class Camera:
-    def __init__(self, position, forward, up, fov, aspect):
+    """
+    FPS style camera.
+
+    The view and projection matrices are cached and only rebuilt after the camera changed:
+    move(), rotate() and update_vectors() as well as assigning position, fov, aspect, near or far
+    mark them dirty. Changing position in place element by element (cam.position[0] = 1) doesn't,
+    assign a new array or call mark_dirty() after.
+    """
+    def __init__(self, position, forward, up, fov, aspect, near=0.01, far=1000.0):
+        self._dirty = True
         self.position = np.array(position, dtype=float)
         #The direction the camera is facing example [0,0,-1] means looking down the negative z axis
         self.forward = self._normalize(np.array(forward, dtype=float))
@@ -22,7 +31,9 @@ class Camera:
             # we divide by f later so bigger f means smaller projected values
             # for fun you can change the near plane to see how it affects the projection
             # doubling near  double the f and when later we divide by f the projected values become doubled on screen
-        near=1.0
+        # The pipeline clips triangles at this depth (pipeline.ScreenMapping) and culls objects beyond far
+        self.near = near
+        self.far = far
             # The bigger the fov angle means the bigger the fustrum wall becomes at the near plane
             # The points occopy less of the screen when fov is larger because the x and y values are divided by a larger f value
             # making the cube appear smaller
@@ -39,12 +50,142 @@ class Camera:
         
         self.fov = fov
         self.aspect = aspect
-        self.f =  1 *np.tan(fov / 2)*2
         self._last_debug_print = time.time()
         self._debug_interval = 8.0  # seconds
 
 
     
+    @property
+    def position(self) -> np.ndarray:
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        # move() does position += ..., which ends up here too
+        self._position = np.asarray(value, dtype=float)
+        self._dirty = True
+
+    @property
+    def fov(self) -> float:
+        return self._fov
+
+    @fov.setter
+    def fov(self, value):
+        self._fov = value
+        self.f = 1 * np.tan(value / 2) * 2
+        self._dirty = True
+
+    @property
+    def aspect(self) -> float:
+        return self._aspect
+
+    @aspect.setter
+    def aspect(self, value):
+        self._aspect = value
+        self._dirty = True
+
+    @property
+    def near(self) -> float:
+        return self._near
+
+    @near.setter
+    def near(self, value):
+        self._near = value
+        self._dirty = True
+
+    @property
+    def far(self) -> float:
+        return self._far
+
+    @far.setter
+    def far(self, value):
+        self._far = value
+        self._dirty = True
+
+    def mark_dirty(self):
+        """Force the matrices to be rebuilt, for when the camera was changed behind its back."""
+        self._dirty = True
+
+    def _update_matrices(self):
+        if not self._dirty:
+            return
+        # Same rotation world_to_camera always used, rows of the transpose are right, up and forward
+        self._rotation = np.array([self.right, self.up, self.forward]).T
+
+        view = np.eye(4)
+        view[:3, :3] = self._rotation
+        view[:3, 3] = -self._rotation @ self._position
+        self._view = view
+
+        # Maps camera space to clip space: x and y get the same f/aspect scaling as project_to_screen
+        # once divided by w = z, and z between near and far ends up between -1 and 1
+        near, far = self._near, self._far
+        projection = np.zeros((4, 4))
+        projection[0, 0] = self.f * self._aspect
+        projection[1, 1] = self.f
+        projection[2, 2] = (far + near) / (far - near)
+        projection[2, 3] = -2 * far * near / (far - near)
+        projection[3, 2] = 1
+        self._projection = projection
+
+        self._view_projection = projection @ view
+        self._dirty = False
+
+    @property
+    def rotation_matrix(self) -> np.ndarray:
+        """(3, 3) rotation part of the view matrix."""
+        self._update_matrices()
+        return self._rotation
+
+    @property
+    def view_matrix(self) -> np.ndarray:
+        """(4, 4) world to camera space transform."""
+        self._update_matrices()
+        return self._view
+
+    @property
+    def projection_matrix(self) -> np.ndarray:
+        """(4, 4) camera to clip space transform."""
+        self._update_matrices()
+        return self._projection
+
+    @property
+    def view_projection(self) -> np.ndarray:
+        """(4, 4) projection_matrix @ view_matrix, world to clip space in a single matmul."""
+        self._update_matrices()
+        return self._view_projection
+
+    def frustum_planes(self, extent_x=1.0, extent_y=1.0, near=None, far=None) -> np.ndarray:
+        """
+        The 6 planes of the view frustum in world space as (6, 4) rows (a, b, c, d), normals pointing
+        inwards: a point p is inside a plane when a*x + b*y + c*z + d >= 0. Order: left, right,
+        bottom, top, near, far.
+
+        extent_x/extent_y are how far the visible area reaches in projected (project()) coordinates,
+        e.g. width / (2 * scale) for the pipeline which maps projected coordinates to pixels with a scale.
+        near/far default to the camera's own.
+        """
+        near = self._near if near is None else near
+        far = self._far if far is None else far
+        fx = self.f * self._aspect
+        fy = self.f
+        # In camera space x is visible while |x * fx / z| <= extent_x, i.e. extent_x * z -+ fx * x >= 0
+        camera_planes = np.array([
+            [fx, 0, extent_x, 0],
+            [-fx, 0, extent_x, 0],
+            [0, fy, extent_y, 0],
+            [0, -fy, extent_y, 0],
+            [0, 0, 1, -near],
+            [0, 0, -1, far],
+        ], dtype=float)
+        # n . (view @ p) + d = (view[:3, :3].T @ n) . p + (n . view[:3, 3] + d)
+        view = self.view_matrix
+        planes = np.empty((6, 4))
+        planes[:, :3] = camera_planes[:, :3] @ view[:3, :3]
+        planes[:, 3] = camera_planes[:, :3] @ view[:3, 3] + camera_planes[:, 3]
+        planes /= np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+        return planes
+
     # this normalizes the vector so that it has a length of 1 but keeps its direction the same
     # so if our vector is (3,4,0) it will become (0.6,0.8,0) it now has a maximum length of 1 but points in the same direction
     # if we don't normalize we will get weird results when we move the camera where we move faster the the longer the vector is aka the further we move from the origin
@@ -103,6 +244,7 @@ class Camera:
 
         # Up vector
         self.up = np.cross(self.right, self.forward)
+        self._dirty = True
 
 
     # Returns the forward vector projected onto the horizontal plane (y=0) removes any vertical component
@@ -116,12 +258,44 @@ class Camera:
     # converts a point from world space to camera space
     # we need to convert points to camera space so that we can then project them onto the 2D screen
     #Camera relative position to itself is always (0,0,0)
-    def world_to_camera(self, vertex):
-        v = np.array(vertex) - self.position
+    # Works on a single (3,) point or a whole (N, 3) array at once
+    def world_to_camera(self, points):
+        v = np.asarray(points, dtype=float) - self.position
         # we need to rotate the objects in the world so that they are relative to the camera's orientation
-        # we do this by creating a rotation matrix from the camera's right, up, and
-        rot_matrix = np.array([self.right, self.up, self.forward]).T
-        return rot_matrix @ v
+        # we do this with the cached rotation matrix built from the camera's right, up, and forward vectors
+        # (rot @ v) for every row v is v @ rot.T
+        return v @ self.rotation_matrix.T
+
+    def project(self, points):
+        """
+        Batched perspective projection of (N, 3) world space points with the view_projection matrix.
+        Returns the (N, 3) normalized device coordinates: x and y like project_to_screen, z is -1 at the
+        near plane and 1 at the far plane. Points at z == 0 in camera space come out as inf/nan.
+        """
+        m = self.view_projection
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        clip = points @ m[:, :3].T + m[:, 3]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return clip[:, :3] / clip[:, 3:]
+
+    def screen_ray(self, x, y, screen_size, scale=150):
+        """
+        World space ray through pixel (x, y) of a screen_size surface drawn with the pipeline's scale,
+        as (origin, direction) with a normalized direction. x and y can be arrays for a batch of
+        rays, then origin and direction are (N, 3).
+        """
+        width, height = screen_size
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        # Undo the pixel mapping to get the camera space direction at z = 1
+        camera_dir = np.stack([(x - width / 2) / (self.f * self._aspect * scale),
+                               -(y - height / 2) / (self.f * scale),
+                               np.ones_like(x)], axis=-1)
+        # world_to_camera is rot @ v and rot is orthonormal, so back to world space is rot.T @ v
+        direction = camera_dir @ self.rotation_matrix
+        direction /= np.linalg.norm(direction, axis=-1, keepdims=True)
+        origin = np.broadcast_to(self._position, direction.shape).copy()
+        return origin, direction
 
     def project_to_screen(self, vertex):
         """
@@ -0,0 +1,282 @@
+# benchmark.py
+# Reproducible, headless benchmark of the rendering pipeline. Renders every mesh over the same
+# fixed camera orbit and times each stage separately, so regressions show up as numbers instead
+# of hand written "#195 ms" comments.
+#
+#   python benchmark.py --out baseline.json
+#   python benchmark.py --compare baseline.json          # exits with 1 if anything got slower
+#   python benchmark.py --meshes sphere --sizes 1k,100k,2M --modes zbuffer,tiled
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pygame
+from Camera import Camera
+from renderable_object import RenderableObject
+from pipeline import transform_vertices, face_setup, ScreenMapping, AMBIENT
+from rasterizer import PainterRasterizer, ZBufferRasterizer, TiledRasterizer
+from renderer import orbit_camera
+
+STAGES = ("clear", "transform", "face_setup", "raster", "blit")
+MODES = ("zbuffer", "tiled", "textured", "painter")
+# Default synthetic mesh sizes, in triangles
+SPHERE_SIZES = "1k,10k,100k,500k"
+# A stage or frame time (or the memory peak) this much over the baseline counts as a regression
+REGRESSION_THRESHOLD = 0.10
+# Stage times below this are too noisy to compare
+MIN_COMPARE_MS = 0.5
+
+
+def cube_mesh() -> RenderableObject:
+    """The cube from kept.py."""
+    vertices = np.array([(1, 1, -1), (1, -1, -1), (1, 1, 1), (1, -1, 1),
+                         (-1, 1, -1), (-1, -1, -1), (-1, 1, 1), (-1, -1, 1)], dtype=np.float64)
+    faces = np.array([(0, 2, 6), (0, 6, 4), (3, 7, 6), (3, 6, 2), (7, 5, 4), (7, 4, 6),
+                      (5, 7, 3), (5, 3, 1), (1, 3, 2), (1, 2, 0), (5, 1, 0), (5, 0, 4)])
+    return RenderableObject(vertices, faces, name="cube")
+
+
+def sphere_mesh(triangles: int) -> RenderableObject:
+    """Latitude/longitude sphere with roughly the given number of triangles."""
+    rings = max(2, int(round(np.sqrt(triangles / 4))))
+    segments = 2 * rings
+    theta = np.linspace(0, np.pi, rings + 1)
+    phi = np.linspace(0, 2 * np.pi, segments + 1)
+    t, p = np.meshgrid(theta, phi, indexing="ij")
+    vertices = np.stack([np.sin(t) * np.cos(p), np.cos(t), np.sin(t) * np.sin(p)], axis=-1).reshape(-1, 3)
+
+    # Two triangles per grid quad, except at the poles where one of them would be degenerate
+    i, j = np.meshgrid(np.arange(rings), np.arange(segments), indexing="ij")
+    i, a = i.reshape(-1), (i * (segments + 1) + j).reshape(-1)
+    b = a + segments + 1
+    upper = i > 0
+    lower = i < rings - 1
+    faces = np.concatenate([np.stack([a[upper], a[upper] + 1, b[upper]], axis=1),
+                            np.stack([a[lower] + 1, b[lower] + 1, b[lower]], axis=1)])
+    return RenderableObject(vertices, faces, name=f"sphere_{triangles}")
+
+
+def parse_size(text: str) -> int:
+    """'1k' -> 1000, '2M' -> 2000000."""
+    text = text.strip().lower()
+    factor = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * factor)
+
+
+def load_meshes(names: list[str], sizes: list[int], resources: str) -> list[RenderableObject]:
+    meshes = []
+    for name in names:
+        if name == "fox":
+            path = os.path.join(resources, "foxSitting.obj")
+            texture = os.path.join(resources, "colMap.bytes")
+            if not os.path.exists(path):
+                print(f"Skipping fox, {path} not found")
+                continue
+            obj = RenderableObject.load_new_obj(path, texture_filepath=texture if os.path.exists(texture) else None,
+                                                texture_storage="uint8")
+            obj.name = "fox"
+            meshes.append(obj)
+        elif name == "teapot":
+            path = os.path.join(resources, "utahTeapot.obj")
+            if not os.path.exists(path):
+                print(f"Skipping teapot, {path} not found")
+                continue
+            obj = RenderableObject.load_new_obj(path)
+            obj.name = "teapot"
+            meshes.append(obj)
+        elif name == "cube":
+            meshes.append(cube_mesh())
+        elif name == "sphere":
+            meshes.extend(sphere_mesh(size) for size in sizes)
+        else:
+            raise ValueError(f"Unknown mesh: {name}")
+    return meshes
+
+
+def make_rasterizer(mode: str, workers: int | None):
+    if mode == "painter":
+        return PainterRasterizer()
+    if mode == "zbuffer":
+        return ZBufferRasterizer()
+    if mode == "tiled":
+        return TiledRasterizer(workers=workers)
+    if mode == "textured":
+        return ZBufferRasterizer(textured=True)
+    raise ValueError(f"Unknown mode: {mode}")
+
+
+def render_frame(obj: RenderableObject, cam: Camera, surface: pygame.Surface, rasterizer, timings: dict | None):
+    """Render one frame stage by stage, adding each stage's seconds to timings[stage]."""
+    clock = [time.perf_counter()]
+
+    def lap(stage):
+        now = time.perf_counter()
+        if timings is not None:
+            timings[stage].append(now - clock[0])
+        clock[0] = now
+
+    rasterizer.begin_frame(surface, (0, 0, 0))
+    lap("clear")
+    world_vertices = obj.get_world_vertices()
+    camera_vertices, screen_vertices, behind = transform_vertices(world_vertices, cam, surface.get_size())
+    lap("transform")
+    frame = face_setup(world_vertices, obj.faces, camera_vertices, screen_vertices, behind,
+                       base_colors=obj.get_face_colors(), normals=obj.get_face_normals(), ambient=AMBIENT,
+                       uvs=obj.get_face_uvs(), texture=obj.texture,
+                       screen_mapping=ScreenMapping(cam, surface.get_size()))
+    lap("face_setup")
+    rasterizer.draw(frame)
+    lap("raster")
+    rasterizer.end_frame()
+    lap("blit")
+
+
+def _summary(samples: list[float]) -> dict:
+    ms = np.array(samples) * 1000
+    return {"mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "max_ms": float(ms.max())}
+
+
+def benchmark_mesh(obj: RenderableObject, mode: str, size: tuple[int, int], frames: int, warmup: int,
+                   radius: float, workers: int | None) -> dict:
+    """Time every stage over the fixed orbit, then measure the memory peak of one more frame."""
+    surface = pygame.Surface(size)
+    rasterizer = make_rasterizer(mode, workers)
+    cam = Camera(position=[0, 0, 0], forward=[0, 0, 1], up=[0, 1, 0], fov=np.radians(60), aspect=size[0] / size[1])
+    timings = {stage: [] for stage in STAGES}
+    try:
+        for i in range(warmup + frames):
+            orbit_camera(cam, 2 * np.pi * i / max(frames, 1), radius, 0.3)
+            render_frame(obj, cam, surface, rasterizer, timings if i >= warmup else None)
+
+        # tracemalloc slows NumPy allocations down, so memory gets its own untimed frame
+        tracemalloc.start()
+        render_frame(obj, cam, surface, rasterizer, None)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        if isinstance(rasterizer, TiledRasterizer):
+            rasterizer.close()
+
+    frame_times = np.sum([timings[stage] for stage in STAGES], axis=0)
+    triangles = len(obj.faces)
+    frame = _summary(frame_times)
+    return {
+        "mesh": obj.name,
+        "mode": mode,
+        "triangles": triangles,
+        "frames": frames,
+        "stages": {stage: _summary(timings[stage]) for stage in STAGES},
+        "frame": frame,
+        "fps": 1000 / frame["mean_ms"],
+        "triangles_per_sec": triangles * 1000 / frame["mean_ms"],
+        "pixels_per_sec": rasterizer.stats.pixels_per_second(),
+        "peak_memory_bytes": int(peak),
+    }
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _key(result: dict) -> tuple:
+    return result["mesh"], result["mode"], result["triangles"]
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """Regressions of results against a baseline run, as readable lines. Empty when nothing got worse."""
+    previous = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        label = f"{result['mesh']} ({result['triangles']} tris, {result['mode']})"
+        checks = [("frame p50", old["frame"]["p50_ms"], result["frame"]["p50_ms"])]
+        checks += [(f"{stage} p50", old["stages"][stage]["p50_ms"], result["stages"][stage]["p50_ms"])
+                   for stage in STAGES if stage in old["stages"]]
+        for name, before, after in checks:
+            if before >= MIN_COMPARE_MS and after > before * (1 + threshold):
+                regressions.append(f"{label}: {name} {before:.2f}ms -> {after:.2f}ms (+{(after / before - 1) * 100:.0f}%)")
+        before, after = old["peak_memory_bytes"], result["peak_memory_bytes"]
+        if before > 0 and after > before * (1 + threshold):
+            regressions.append(f"{label}: peak memory {before / 1e6:.1f}MB -> {after / 1e6:.1f}MB "
+                               f"(+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_result(result: dict):
+    stages = "  ".join(f"{stage} {result['stages'][stage]['p50_ms']:7.2f}" for stage in STAGES)
+    print(f"{result['mesh']:>14} {result['triangles']:>8} {result['mode']:>9} | {stages} | "
+          f"frame p50 {result['frame']['p50_ms']:7.2f}ms p95 {result['frame']['p95_ms']:7.2f}ms | "
+          f"{result['triangles_per_sec'] / 1e6:6.2f}M tris/s | peak {result['peak_memory_bytes'] / 1e6:7.1f}MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rendering pipeline stage by stage.")
+    parser.add_argument("--meshes", default="fox,teapot,cube,sphere", help="comma separated: fox, teapot, cube, sphere")
+    parser.add_argument("--sizes", default=SPHERE_SIZES, help="triangle counts of the synthetic spheres, e.g. 1k,100k,2M")
+    parser.add_argument("--modes", default="zbuffer", help=f"comma separated rasterizers: {', '.join(MODES)}")
+    parser.add_argument("--size", default="1280x720", help="resolution as WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, default=30, help="timed frames per mesh and mode")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed frames first")
+    parser.add_argument("--radius", type=float, default=3.0, help="distance of the camera from the origin")
+    parser.add_argument("--workers", type=int, default=None, help="worker count for the tiled mode")
+    parser.add_argument("--resources", default="resources", help="directory with the bundled meshes")
+    parser.add_argument("--out", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="baseline JSON to check the results against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    width, height = (int(x) for x in args.size.lower().split("x"))
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size]
+    modes = [mode for mode in args.modes.split(",") if mode]
+    meshes = load_meshes([name for name in args.meshes.split(",") if name], sizes, args.resources)
+
+    results = []
+    for obj in meshes:
+        for mode in modes:
+            result = benchmark_mesh(obj, mode, (width, height), args.frames, args.warmup, args.radius, args.workers)
+            print_result(result)
+            results.append(result)
+
+    report = {
+        "environment": environment(),
+        "settings": {"size": [width, height], "frames": args.frames, "warmup": args.warmup, "radius": args.radius},
+        "results": results,
+    }
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print("Warning: the baseline was run with different settings, the comparison may be meaningless.")
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.compare}:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
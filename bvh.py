@@ -0,0 +1,239 @@
+# bvh.py
+# Bounding volume hierarchy over the triangles of a mesh, for culling parts of a mesh and ray queries.
+# The tree is stored in flat arrays instead of node objects: a complete binary tree in heap order
+# (children of node i are 2i+1 and 2i+2) where every node covers a contiguous range of tri_order.
+# It is built level by level with a median split along the longest axis of each node, one
+# segmented sort per level for all nodes at once.
+
+import time
+import numpy as np
+from numpy.typing import NDArray
+
+# Leaves hold at most this many triangles
+LEAF_SIZE = 8
+# Prefix of the BVH arrays when they are stored next to the mesh arrays (see mesh_cache)
+ARRAY_PREFIX = "bvh_"
+
+
+def _depth_for(triangles: int, leaf_size: int) -> int:
+    """Levels below the root needed to get leaves of at most leaf_size, without empty leaves."""
+    depth = 0
+    while triangles > leaf_size << depth and 2 << depth <= triangles:
+        depth += 1
+    return depth
+
+
+def _level_starts(triangles: int, level: int) -> NDArray[np.int64]:
+    """Range boundaries of the 2**level nodes of a level. Every split is at a node's median."""
+    return np.arange((1 << level) + 1, dtype=np.int64) * triangles >> level
+
+
+def _ranges_to_indices(starts: np.ndarray, ends: np.ndarray) -> NDArray[np.int64]:
+    """All positions in the ranges [start, end), concatenated."""
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+
+
+def transform_planes(planes: np.ndarray, matrix: np.ndarray) -> NDArray[np.float64]:
+    """
+    World space (K, 4) planes (see Camera.frustum_planes) in the local space of an object with
+    the given 4x4 transform. The normals aren't renormalized, which the BVH tests don't need.
+    """
+    planes = np.asarray(planes, dtype=np.float64)
+    local = np.empty_like(planes)
+    local[:, :3] = planes[:, :3] @ matrix[:3, :3]
+    local[:, 3] = planes[:, :3] @ matrix[:3, 3] + planes[:, 3]
+    return local
+
+
+class BVH:
+    """
+    Flat array BVH of a triangle mesh, in the mesh's local space.
+
+    node_min, node_max (K, 3): bounds of every node
+    node_start, node_end (K,): the range of tri_order every node covers
+    tri_order (M,): face indices, sorted so every node's triangles are next to each other
+
+    Build one with BVH.build(vertices, faces), or get the cached one of a RenderableObject with get_bvh().
+    """
+    ARRAYS = ("node_min", "node_max", "node_start", "node_end", "tri_order")
+
+    def __init__(self, node_min: np.ndarray, node_max: np.ndarray, node_start: np.ndarray,
+                 node_end: np.ndarray, tri_order: np.ndarray, build_seconds: float | None = None):
+        self.node_min: NDArray[np.float64]
+        self.node_min = node_min
+        self.node_max: NDArray[np.float64]
+        self.node_max = node_max
+        self.node_start: NDArray[np.int32]
+        self.node_start = node_start
+        self.node_end: NDArray[np.int32]
+        self.node_end = node_end
+        self.tri_order: NDArray[np.int32]
+        self.tri_order = tri_order
+
+        # Seconds it took to build, None when it was loaded from a cache
+        self.build_seconds = build_seconds
+
+        # A complete tree of depth d has 2**(d+1) - 1 nodes
+        self.depth = max(len(node_min) + 1, 1).bit_length() - 2
+        self.first_leaf = (1 << self.depth) - 1 if len(node_min) else 0
+
+    @staticmethod
+    def build(vertices: np.ndarray, faces: np.ndarray, leaf_size: int = LEAF_SIZE) -> "BVH":
+        """Build the BVH of (N, 3) vertices and (M, 3) faces."""
+        start_time = time.perf_counter()
+        tri = np.asarray(vertices, dtype=np.float64)[np.asarray(faces)]  # (M, 3, 3)
+        count = len(tri)
+        if count == 0:
+            empty = np.zeros((0, 3))
+            return BVH(empty, empty, np.zeros(0, np.int32), np.zeros(0, np.int32), np.zeros(0, np.int32),
+                       time.perf_counter() - start_time)
+        tri_min, tri_max = tri.min(axis=1), tri.max(axis=1)
+        centroid = (tri_min + tri_max) / 2
+        depth = _depth_for(count, leaf_size)
+
+        order = np.arange(count)
+        positions = np.arange(count)
+        for level in range(depth):
+            starts = _level_starts(count, level)
+            node = np.repeat(np.arange(1 << level), np.diff(starts))
+            c = centroid[order]
+            # Split every node along the longest axis of its centroids' bounds
+            low = np.minimum.reduceat(c, starts[:-1])
+            extent = np.maximum.reduceat(c, starts[:-1]) - low
+            axis = np.argmax(extent, axis=1)
+            span = extent[np.arange(len(axis)), axis]
+            span[span == 0] = 1
+            # Sort within every node at once with one key: the node index plus the position along
+            # its axis scaled to [0, 0.5]. The halves of the sorted ranges are the children.
+            key = (c[positions, axis[node]] - low[node, axis[node]]) / span[node] * 0.5 + node
+            order = order[np.argsort(key)]
+
+        nodes = (2 << depth) - 1
+        node_min = np.empty((nodes, 3))
+        node_max = np.empty((nodes, 3))
+        node_start = np.empty(nodes, dtype=np.int32)
+        node_end = np.empty(nodes, dtype=np.int32)
+        for level in range(depth + 1):
+            first = (1 << level) - 1
+            starts = _level_starts(count, level)
+            node_start[first:2 * first + 1] = starts[:-1]
+            node_end[first:2 * first + 1] = starts[1:]
+
+        # Leaf bounds from their triangles, every other node from its two children
+        leaves = slice((1 << depth) - 1, nodes)
+        node_min[leaves] = np.minimum.reduceat(tri_min[order], node_start[leaves])
+        node_max[leaves] = np.maximum.reduceat(tri_max[order], node_start[leaves])
+        for level in range(depth - 1, -1, -1):
+            index = np.arange((1 << level) - 1, (2 << level) - 1)
+            node_min[index] = np.minimum(node_min[2 * index + 1], node_min[2 * index + 2])
+            node_max[index] = np.maximum(node_max[2 * index + 1], node_max[2 * index + 2])
+
+        return BVH(node_min, node_max, node_start, node_end, order.astype(np.int32),
+                   time.perf_counter() - start_time)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the BVH arrays."""
+        return sum(getattr(self, name).nbytes for name in BVH.ARRAYS)
+
+    def summary(self) -> str:
+        built = f", built in {self.build_seconds * 1000:.1f}ms" if self.build_seconds is not None else ""
+        return (f"BVH: {len(self.tri_order)} triangles, {len(self.node_min)} nodes, depth {self.depth}"
+                f"{built}, {self.nbytes / 1024:.1f} KiB")
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """The BVH arrays by name, prefixed so they can be stored with the mesh arrays."""
+        return {ARRAY_PREFIX + name: getattr(self, name) for name in BVH.ARRAYS}
+
+    @staticmethod
+    def has_arrays(arrays: dict[str, np.ndarray]) -> bool:
+        return all(ARRAY_PREFIX + name in arrays for name in BVH.ARRAYS)
+
+    @staticmethod
+    def from_arrays(arrays: dict[str, np.ndarray]) -> "BVH":
+        """The BVH stored in arrays by to_arrays(), without copying them."""
+        return BVH(*(arrays[ARRAY_PREFIX + name] for name in BVH.ARRAYS))
+
+    def frustum_ranges(self, planes: np.ndarray) -> NDArray[np.int64]:
+        """
+        (R, 2) [start, end) ranges of tri_order with the triangles that can be inside the (K, 4)
+        planes (local space, see transform_planes). Nodes entirely inside are taken whole without
+        visiting their children, adjacent ranges are merged.
+        """
+        if len(self.node_min) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        planes = np.asarray(planes, dtype=np.float64)
+        normals, offsets = planes[:, :3], planes[:, 3]
+        abs_normals = np.abs(normals).T
+
+        nodes = np.zeros(1, dtype=np.int64)
+        accepted = []
+        for level in range(self.depth + 1):
+            center = (self.node_min[nodes] + self.node_max[nodes]) / 2
+            extent = (self.node_max[nodes] - self.node_min[nodes]) / 2
+            distance = center @ normals.T + offsets
+            reach = extent @ abs_normals
+            outside = (distance < -reach).any(axis=1)
+            inside = (distance >= reach).all(axis=1)
+            if level == self.depth:
+                accepted.append(nodes[~outside])
+                break
+            accepted.append(nodes[inside])
+            partial = nodes[~outside & ~inside]
+            nodes = np.stack([2 * partial + 1, 2 * partial + 2], axis=1).ravel()
+
+        accepted = np.concatenate(accepted)
+        if len(accepted) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        # Node ranges never overlap, so sorting starts and ends separately keeps them paired
+        starts = np.sort(self.node_start[accepted].astype(np.int64))
+        ends = np.sort(self.node_end[accepted].astype(np.int64))
+        breaks = np.flatnonzero(starts[1:] != ends[:-1])
+        return np.stack([starts[np.r_[0, breaks + 1]], ends[np.r_[breaks, len(ends) - 1]]], axis=1)
+
+    def frustum_faces(self, planes: np.ndarray) -> NDArray[np.int32]:
+        """Face indices of the triangles that can be inside the planes, see frustum_ranges()."""
+        ranges = self.frustum_ranges(planes)
+        return self.tri_order[_ranges_to_indices(ranges[:, 0], ranges[:, 1])]
+
+    def ray_candidates(self, origins: np.ndarray, directions: np.ndarray, max_t: float = np.inf
+                       ) -> tuple[NDArray[np.int64], NDArray[np.int32]]:
+        """
+        Triangles whose leaf box is hit by any of the rays, for all rays at once.
+
+        Args:
+            origins, directions: (R, 3) or (3,) local space rays, directions don't have to be normalized
+            max_t: ignore boxes further along the rays than this (in units of direction)
+
+        Returns:
+            ray_index (P,), face_index (P,): pairs of a ray and a triangle it may hit
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        if len(self.node_min) == 0 or len(origins) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_dir = 1.0 / directions
+
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+        for level in range(self.depth + 1):
+            # Slab test of every (ray, node) pair. A 0 * inf NaN means the ray lies in a slab's
+            # boundary plane, fmin/fmax ignore those axes.
+            o, inv = origins[rays], inv_dir[rays]
+            with np.errstate(invalid="ignore"):
+                t1 = (self.node_min[nodes] - o) * inv
+                t2 = (self.node_max[nodes] - o) * inv
+            t_near = np.fmax.reduce(np.fmin(t1, t2), axis=1)
+            t_far = np.fmin.reduce(np.fmax(t1, t2), axis=1)
+            hit = (t_near <= t_far) & (t_far >= 0) & (t_near <= max_t)
+            rays, nodes = rays[hit], nodes[hit]
+            if level < self.depth:
+                rays = np.repeat(rays, 2)
+                nodes = np.stack([2 * nodes + 1, 2 * nodes + 2], axis=1).ravel()
+
+        starts, ends = self.node_start[nodes], self.node_end[nodes]
+        positions = _ranges_to_indices(starts.astype(np.int64), ends.astype(np.int64))
+        return np.repeat(rays, ends - starts), self.tri_order[positions]
@@ -0,0 +1,233 @@
+# instancing.py
+# Drawing one mesh many times. Copies go through transform_vertices and face_setup together as one
+# big mesh, in batches, so the cost grows with the total triangle count instead of with Python calls.
+
+import numpy as np
+from numpy.typing import NDArray
+from Camera import Camera
+from transform import Transform, TransformArray
+from pipeline import transform_vertices, face_setup, face_normals, FrameFaces, ScreenMapping, SKY_LIGHT, AMBIENT
+from raycast import RayHits, raycast_triangles, keep_nearest
+
+# Copies are set up in batches of about this many faces. One batch for everything would be a single
+# call, but past a few 10k faces the arrays stop fitting in cache and bigger batches get slower.
+BATCH_FACES = 1 << 16
+
+# Cached entries that have to be rebuilt when the matrices change
+_MATRIX_DEPENDENT = ("spheres", "sphere", "aabb", "inverse")
+# Cached entries that have to be rebuilt when the object's mesh changes
+_MESH_DEPENDENT = ("local_normals", "spheres", "sphere", "aabb")
+
+
+class InstancedObject:
+    """
+    One RenderableObject placed with a (K, 4, 4) stack of transform matrices, one per copy.
+
+    The object's own transform is ignored, the matrices map its local vertices to world space.
+    Assign a new array to matrices (or call invalidate_cache() after writing into it) to move copies.
+    matrices can also be a transform.TransformArray, its changes are picked up automatically.
+    So is assigning new vertices or faces to obj. After writing into obj's arrays in place, call
+    obj.invalidate_cache() and invalidate_cache() here, or the copies keep the old bounds and normals.
+    Has get_bounding_sphere()/get_aabb() covering every copy, so it can be culled like an object,
+    and raycast() so it can be picked like one.
+    """
+    def __init__(self, obj, matrices: np.ndarray | TransformArray):
+        self.obj = obj
+        self._cache = {}
+        self._mesh = (obj.vertices, obj.faces)  # the arrays the mesh dependent entries were made from
+        self.matrices = matrices
+
+    @staticmethod
+    def from_transforms(obj, transforms: list[Transform]) -> "InstancedObject":
+        return InstancedObject(obj, np.array([t.get_matrix() for t in transforms]).reshape(-1, 4, 4))
+
+    @property
+    def matrices(self) -> NDArray[np.float64]:
+        return self._matrix_cache()["matrices"]
+
+    @matrices.setter
+    def matrices(self, value):
+        self.invalidate_cache()
+        if isinstance(value, TransformArray):
+            self._transforms = value
+            self._transforms_version = None
+        else:
+            self._transforms = None
+            self._cache["matrices"] = np.asarray(value, dtype=np.float64).reshape(-1, 4, 4)
+
+    @property
+    def name(self) -> str:
+        return f"{self.obj.name} x{len(self)}"
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def invalidate_cache(self):
+        """Drop everything derived from the matrices or the mesh, it will be rebuilt on next access."""
+        for key in _MATRIX_DEPENDENT + _MESH_DEPENDENT:
+            self._cache.pop(key, None)
+
+    def _matrix_cache(self) -> dict:
+        """The cache, after picking up changes of the TransformArray and new vertices or faces of obj."""
+        if self.obj.vertices is not self._mesh[0] or self.obj.faces is not self._mesh[1]:
+            for key in _MESH_DEPENDENT:
+                self._cache.pop(key, None)
+            self._mesh = (self.obj.vertices, self.obj.faces)
+        if self._transforms is not None and self._transforms.version != self._transforms_version:
+            self.invalidate_cache()
+            self._cache["matrices"] = self._transforms.get_matrices()
+            self._transforms_version = self._transforms.version
+        return self._cache
+
+    def get_local_normals(self) -> NDArray[np.float64]:
+        """(M, 3) face normals of the mesh before any transform."""
+        cache = self._matrix_cache()
+        if "local_normals" not in cache:
+            cache["local_normals"] = face_normals(self.obj.vertices, self.obj.faces)
+        return cache["local_normals"]
+
+    def get_bounding_spheres(self) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """World space (centers (K, 3), radii (K,)) of every copy."""
+        cache = self._matrix_cache()
+        if "spheres" not in cache:
+            _, _, center, radius = self.obj.get_local_bounds()
+            matrices = cache["matrices"]
+            rotation = matrices[:, :3, :3]
+            centers = rotation @ center + matrices[:, :3, 3]
+            # The radius grows with the biggest scale of any axis, per copy
+            radii = radius * np.linalg.norm(rotation, axis=1).max(axis=1)
+            cache["spheres"] = (centers, radii)
+        return cache["spheres"]
+
+    def get_bounding_sphere(self) -> tuple[NDArray[np.float64], float]:
+        """A sphere around all copies, centered on the box around their spheres."""
+        cache = self._matrix_cache()
+        if "sphere" not in cache:
+            centers, radii = self.get_bounding_spheres()
+            if len(centers) == 0:
+                cache["sphere"] = (np.zeros(3), 0.0)
+            else:
+                middle = ((centers - radii[:, None]).min(axis=0) + (centers + radii[:, None]).max(axis=0)) / 2
+                cache["sphere"] = (middle, float((np.linalg.norm(centers - middle, axis=1) + radii).max()))
+        return cache["sphere"]
+
+    def get_aabb(self) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """World space (min, max) of a box containing every copy."""
+        cache = self._matrix_cache()
+        if "aabb" not in cache:
+            matrices = cache["matrices"]
+            if len(matrices) == 0:
+                cache["aabb"] = (np.zeros(3), np.zeros(3))
+            else:
+                low, high, _, _ = self.obj.get_local_bounds()
+                rotation = matrices[:, :3, :3]
+                centers = rotation @ ((low + high) / 2) + matrices[:, :3, 3]
+                extents = np.abs(rotation) @ ((high - low) / 2)
+                cache["aabb"] = ((centers - extents).min(axis=0), (centers + extents).max(axis=0))
+        return cache["aabb"]
+
+    def get_inverse_matrices(self) -> NDArray[np.float64]:
+        """(K, 4, 4) world to local matrices of every copy."""
+        cache = self._matrix_cache()
+        if "inverse" not in cache:
+            cache["inverse"] = np.linalg.inv(cache["matrices"])
+        return cache["inverse"]
+
+    def raycast_batch(self, origins: np.ndarray, directions: np.ndarray) -> RayHits:
+        """
+        Nearest hit of every one of (R, 3) world space rays over all copies, see raycast.RayHits.
+        face_index counts through the copies like instanced_frame_faces(): copy = face_index // len(obj.faces).
+        Only (ray, copy) pairs whose ray passes through the copy's bounding sphere are tested, in
+        the copy's local space and against the mesh's BVH if it was built.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        hits = RayHits(len(origins))
+        if len(self) == 0 or len(origins) == 0:
+            return hits
+
+        centers, radii = self.get_bounding_spheres()
+        to_center = centers[None] - origins[:, None]  # (R, K, 3)
+        lengths = np.einsum("ij,ij->i", directions, directions)
+        along = np.einsum("rkj,rj->rk", to_center, directions) / np.where(lengths == 0, 1, lengths)[:, None]
+        closest = to_center - along[..., None] * directions[:, None]
+        rays, copies = np.nonzero(np.einsum("rkj,rkj->rk", closest, closest) <= radii * radii)
+        if len(rays) == 0:
+            return hits
+
+        # Every (ray, copy) pair becomes one local space ray, t is the same in both spaces
+        inverse = self.get_inverse_matrices()[copies]
+        local_origins = np.einsum("pij,pj->pi", inverse[:, :3, :3], origins[rays]) + inverse[:, :3, 3]
+        local_directions = np.einsum("pij,pj->pi", inverse[:, :3, :3], directions[rays])
+        local = raycast_triangles(local_origins, local_directions, self.obj.get_triangle_edges(), self.obj._cache.get("bvh"))
+        found = local.hit
+        face_index = copies[found] * len(self.obj.faces) + local.face_index[found]
+        keep_nearest(hits, rays[found], face_index, local.t[found],
+                     local.barycentric[found, 1], local.barycentric[found, 2])
+        return hits
+
+    def raycast(self, ray: tuple[np.ndarray, np.ndarray]) -> tuple[float, int, NDArray[np.float64]] | None:
+        """
+        Nearest hit of a single world space (origin, direction) ray over all copies:
+        (t, face_index, barycentric) or None, copy = face_index // len(obj.faces).
+        """
+        hits = self.raycast_batch(*ray)
+        if not hits.hit[0]:
+            return None
+        return float(hits.t[0]), int(hits.face_index[0]), hits.barycentric[0]
+
+    def visible_instances(self, planes: np.ndarray) -> NDArray[np.int64]:
+        """Indices of the copies whose bounding sphere is (partly) inside the planes."""
+        centers, radii = self.get_bounding_spheres()
+        distance = centers @ planes[:, :3].T + planes[:, 3]
+        return np.flatnonzero((distance >= -radii[:, None]).all(axis=1))
+
+
+def instance_batches(instances: InstancedObject, planes: np.ndarray | None = None,
+                     batch_faces: int = BATCH_FACES) -> list[NDArray[np.int64]]:
+    """
+    Indices of the copies to set up together, about batch_faces faces per batch. Copies outside
+    planes (e.g. pipeline.screen_frustum()) are left out.
+    """
+    visible = np.arange(len(instances)) if planes is None else instances.visible_instances(planes)
+    per_batch = max(1, batch_faces // max(len(instances.obj.faces), 1))
+    return [visible[start:start + per_batch] for start in range(0, len(visible), per_batch)]
+
+
+def instanced_frame_faces(instances: InstancedObject, copies: np.ndarray, cam: Camera, screen_size: tuple[int, int],
+                          scale: float = 150, light_dir: np.ndarray = SKY_LIGHT, ambient: float = AMBIENT) -> FrameFaces:
+    """
+    Transform, project and set up the faces of the given copies (see instance_batches()) in one pass.
+
+    The returned face_index counts through all copies one mesh after another:
+    copy = face_index // len(obj.faces), with the indices of instances.matrices.
+    """
+    obj = instances.obj
+    copies = np.asarray(copies, dtype=np.int64)
+    matrices = instances.matrices[copies]
+    vertices, faces = obj.vertices, obj.faces
+    count = len(matrices)
+
+    # (K, N, 3) world vertices of every copy, flattened into one mesh
+    rotation = matrices[:, :3, :3]
+    world_vertices = (vertices @ rotation.transpose(0, 2, 1) + matrices[:, None, :3, 3]).reshape(-1, 3)
+    all_faces = (faces[None] + (np.arange(count, dtype=faces.dtype) * len(vertices))[:, None, None]).reshape(-1, 3)
+
+    # Normals go through the inverse transpose of every copy's matrix, which is cheaper than
+    # recomputing them from the world vertices and right for non-uniform scales too
+    normals = (instances.get_local_normals() @ np.linalg.inv(rotation)).reshape(-1, 3)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths != 0)
+
+    camera_vertices, screen_vertices, behind = transform_vertices(world_vertices, cam, screen_size, scale)
+    uvs = obj.get_face_uvs()
+    frame = face_setup(world_vertices, all_faces, camera_vertices, screen_vertices, behind,
+                       base_colors=np.tile(obj.get_face_colors(), (count, 1)), normals=normals,
+                       light_dir=light_dir, ambient=ambient,
+                       uvs=np.tile(uvs, (count, 1, 1)) if uvs is not None else None, texture=obj.texture,
+                       screen_mapping=ScreenMapping(cam, screen_size, scale))
+
+    # Back to the numbering of all copies, not just these
+    copy, face = np.divmod(frame.face_index, max(len(faces), 1))
+    frame.face_index = copies[copy] * len(faces) + face
+    return frame
@@ -5,6 +5,9 @@ from Camera import Camera
 from renderable_object import RenderableObject
 from texture import Texture, sample
 from profiler import Profiler, enabled_profiler
+from scene import Scene, Node, draw_objects
+from rasterizer import PainterRasterizer, ZBufferRasterizer, TiledRasterizer
+from raycast import pick
 # ========================
 #  Initialization
 # ========================
@@ -62,8 +65,12 @@ cam = Camera(
     aspect=1280/720
 )
 
-fox = RenderableObject.load_new_obj("resources/foxSitting.obj", texture_filepath="resources/colMap.bytes")
-tpot =RenderableObject.load_new_obj("resources/utahTeapot.obj")
+fox = RenderableObject.load_new_obj("resources/foxSitting.obj", texture_filepath="resources/colMap.bytes", use_cache=True,
+                                   texture_storage="uint8", build_bvh=True, build_lods=True)
+tpot =RenderableObject.load_new_obj("resources/utahTeapot.obj", use_cache=True, build_bvh=True, build_lods=True)
+scene = Scene()
+scene.add(Node("fox", renderable=fox))
+scene.add(Node("teapot", renderable=tpot, visible=False))  # set visible to draw the teapot too
 AMBIENT = 0.2
 SCALE = 150
 
@@ -185,166 +192,13 @@ def draw_cube(surface, cube_vertices, cube_faces, cube_face_colors, cube_pos, ca
                                                   (v3[0], v3[1])])
 
 
-@Profiler.timed("draw_fox")
-def draw_fox(surface,fox,cam):
-    scale = 150
-    # Convert all cube vertices to camera space
-    camera_vertices = []
-    fox_vertices = []
-    for v in fox.vertices:
-        v_world = np.array(v) 
-        fox_vertices.append(v_world)
-        v_cam = cam.world_to_camera(v_world)
-        camera_vertices.append(v_cam)
-
-    # Project camera-space vertices to 2D screen coordinates
-    projected_vertices = []
-    for v_cam in camera_vertices:
-        # Skip vertices behind camera
-        if v_cam[2] <= 0:
-            projected_vertices.append(None)  # mark as not visible
-            continue
-
-        # Perspective projection 
-        x_proj = (v_cam[0] / v_cam[2]) * cam.f * cam.aspect
-        y_proj = (v_cam[1] / v_cam[2]) * cam.f
-
-        # Map to screen pixels
-        screen_x = int(x_proj * scale + surface.get_width() / 2)
-        screen_y = int(-y_proj * scale + surface.get_height() / 2)
-        projected_vertices.append((screen_x, screen_y, v_cam[2]))
-
-    # Compute face depth for painter's algorithm
-    faces_with_depth = []
-
-    
-    for face_index, (face,uvface) in enumerate(zip(fox.faces, fox.uv_faces)):
-        idx1, idx2, idx3 = face
-        m1,m2,m3 = uvface
-        c1,c2,c3 = fox.uv_coords[m1],fox.uv_coords[m2],fox.uv_coords[m3]
-        average_uv =  (c1 + c2 + c3) / 3.0
-        face_color = sample(fox.texture, average_uv)
-        rgb = np.floor(face_color * 255).astype(int)
-        face_color = tuple(rgb)
-        n = triangle_normal(fox_vertices[idx1], fox_vertices[idx2], fox_vertices[idx3])
-        n = n / np.linalg.norm(n)
-        # Skip face if any vertex is behind camera
-        if (projected_vertices[idx1] is None or
-            projected_vertices[idx2] is None or
-            projected_vertices[idx3] is None):
-            continue
+@Profiler.timed("draw_scene")
+def draw_scene(surface,scene,cam,rasterizer):
+    # One path for every object: world matrices are only recomputed for nodes that moved,
+    # then everything is culled at once and what's left goes through the batched pipeline stages
+    scene.update()
+    draw_objects(scene.renderables(), cam, rasterizer, surface.get_size(), SCALE, AMBIENT)
 
-        z_avg = (projected_vertices[idx1][2] +
-                 projected_vertices[idx2][2] +
-                 projected_vertices[idx3][2]) / 3.0
-        faces_with_depth.append((z_avg, face_index, face,face_color,n))
-
-    # Sort faces back-to-front
-    faces_with_depth.sort(key=lambda x: x[0], reverse=True)
-
-    # Draw visible faces
-    for _, face_index, face, face_color,xy in faces_with_depth:
-        idx1, idx2, idx3 = face
-        v1, v2, v3 = projected_vertices[idx1], projected_vertices[idx2], projected_vertices[idx3]
-
-        
-
-        # Average color of the triangle's texture coordinates
-        
-        # Simple back-face culling based on camera-space normal
-        u = np.array([v2[i] - v1[i] for i in range(3)])
-        v = np.array([v3[i] - v1[i] for i in range(3)])
-        n = np.cross(u, v)
-
-        if n[2] > 0:    
-            continue  # facing away from camera
-        sky = np.array([0,1,0])
-        sky = sky 
-        dotn = np.dot(xy,sky )
-        brightness = max(0, dotn)
-        ambient = 0.2
-        shadedcolor = np.clip(np.array(face_color) * (brightness+ambient), 0, 255).astype(int)
-        face_color = tuple(shadedcolor) 
-        pygame.draw.polygon(surface,face_color, [(v1[0], v1[1]),
-                                                  (v2[0], v2[1]),
-                                                    (v3[0], v3[1])])
-
-@Profiler.timed("draw_pot")
-def draw_pot(surface,tpot,cam):
-    scale = 150
-    camera_vertices = []
-    tpot_vertices = []
-    Profiler.profile_accumulate_start("transform_vertices")
-    for v in tpot.vertices:
-        v_world = np.array(v) 
-        v_cam = cam.world_to_camera(v_world)
-        camera_vertices.append(v_cam)
-        tpot_vertices.append(v_world)
-    projected_vertices = []
-    Profiler.profile_accumulate_end("transform_vertices")
-    
-    Profiler.profile_accumulate_start("project_vertices")
-    for v_cam in camera_vertices:
-        if v_cam[2] <= 0:
-            projected_vertices.append(None)  
-            continue
-        x_proj = (v_cam[0] / v_cam[2]) * cam.f * cam.aspect
-        y_proj = (v_cam[1] / v_cam[2]) * cam.f
-        screen_x = int(x_proj * scale + surface.get_width() / 2)
-        screen_y = int(-y_proj * scale + surface.get_height() / 2)
-        projected_vertices.append((screen_x, screen_y, v_cam[2]))
-    Profiler.profile_accumulate_end("project_vertices")
-    
-    
-    #195 ms
-    Profiler.profile_accumulate_start("compute_face_depth")
-    faces_with_depth = []
-    for face_index, face in enumerate(tpot.faces):
-        idx1, idx2, idx3 = face
-        n = triangle_normal(tpot_vertices[idx1], tpot_vertices[idx2], tpot_vertices[idx3])
-        n = n / np.linalg.norm(n)
-        if (projected_vertices[idx1] is None or
-            projected_vertices[idx2] is None or
-            projected_vertices[idx3] is None):
-            continue
-        z_avg = (projected_vertices[idx1][2] +
-                 projected_vertices[idx2][2] +
-                 projected_vertices[idx3][2]) / 3.0
-        faces_with_depth.append((z_avg, face_index, face,n))
-    Profiler.profile_accumulate_end("compute_face_depth")
-
-
-    Profiler.profile_accumulate_start("sort_faces")
-    faces_with_depth.sort(key=lambda x: x[0], reverse=True)
-    Profiler.profile_accumulate_end("sort_faces")
-    
-    
-    #225 ms
-    Profiler.profile_accumulate_start("draw_faces")
-    for _, face_index, face,xy in faces_with_depth:
-        idx1, idx2, idx3 = face
-        v1, v2, v3 = projected_vertices[idx1], projected_vertices[idx2], projected_vertices[idx3]
-        u = np.array([v2[i] - v1[i] for i in range(3)])
-        v = np.array([v3[i] - v1[i] for i in range(3)])
-        n = np.cross(u, v)
-        if n[2] > 0:
-            continue 
-        sky = np.array([0,1,0])
-        sky = sky// np.linalg.norm(sky)
-        dotn = np.dot(xy,sky )
-        brightness = max(0, dotn)
-        ambient = 0.2
-        face_color = WHITE
-        
-        shadedcolor = np.clip(np.array(face_color) * (brightness+ambient), 0, 255).astype(int)
-        face_color = tuple(shadedcolor)
-        Profiler.profile_accumulate_end("draw_faces")
-        Profiler.profile_accumulate_start("draw_polygon")
-        pygame.draw.polygon(surface, face_color, [(v1[0], v1[1]),
-                                                  (v2[0], v2[1]),
-                                                  (v3[0], v3[1])])
-        Profiler.profile_accumulate_end("draw_polygon")
-    
 
 # ========================
 #  Main Loop
@@ -355,6 +209,12 @@ cube_pos = np.array([0.0, 0.0, 5.0])
 second_cube_pos = np.array([0, 0, 5.0])
 move_speed = 2.0  # units per second
 use_perspective = True
+# R cycles between the painter's algorithm, the z-buffer rasterizer, the tile-parallel z-buffer
+# and the z-buffer with per-pixel texturing
+rasterizers = {"painter": PainterRasterizer(), "zbuffer": ZBufferRasterizer(), "tiled": TiledRasterizer(),
+               "textured": ZBufferRasterizer(textured=True)}
+raster_modes = list(rasterizers)
+raster_mode = "painter"
 paused = False
 framecount = 0
 pygame.event.set_grab(True)
@@ -370,11 +230,30 @@ while running:
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_p:  # toggle projection
                 use_perspective = not use_perspective
+            elif event.key == pygame.K_r:  # cycle rasterizer
+                raster_mode = raster_modes[(raster_modes.index(raster_mode) + 1) % len(raster_modes)]
+                print(f"Rasterizer: {raster_mode}")
+            elif event.key == pygame.K_t:  # start/stop capturing a trace, open it in chrome://tracing or Perfetto
+                if Profiler.is_tracing():
+                    count = Profiler.save_trace("trace.json")
+                    print(f"Saved {count} trace events to trace.json")
+                else:
+                    Profiler.start_trace()
+                    print("Capturing trace, press T again to save it")
             elif event.key == pygame.K_SPACE:
                 paused = not paused
                 pygame.event.set_grab(False)
                 pygame.mouse.set_visible(True)
                 pygame.mouse.get_rel()
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            # Pick what's under the crosshair while the mouse is grabbed, under the cursor while paused
+            x, y = event.pos if paused else (screen.get_width() / 2, screen.get_height() / 2)
+            hit = pick(scene.renderables(), cam.screen_ray(x, y, screen.get_size(), SCALE))
+            if hit is None:
+                print("Picked nothing")
+            else:
+                obj, distance, face, barycentric = hit
+                print(f"Picked {obj.name} face {face} at distance {distance:.3f}, barycentric {barycentric}")
     keys = pygame.key.get_pressed()
     if not paused:
         pygame.event.set_grab(True)
@@ -422,6 +301,14 @@ while running:
         text = font.render("PAUSED", True, (255, 255, 255))
         screen.blit(text, (200, 200))
     else:
+        # Draw the scene first, the z-buffer rasterizer overwrites the whole screen when it blits
+        rasterizer = rasterizers[raster_mode]
+        rasterizer.begin_frame(screen, BLUE)
+        #draw_cube(screen, cube_vertices, cube_faces, cube_face_colors, cube_pos, cam)
+        draw_scene(screen,scene,cam,rasterizer)
+        #draw_cube(screen,angle,cube_vertices ,second_cube_pos,use_perspective=True)  # draw orthographic version for comparison
+        rasterizer.end_frame()
+
         np.set_printoptions(precision=3, suppress=True) 
         font = pygame.font.SysFont(None, 24)  # 24px default font
 
@@ -434,12 +321,12 @@ while running:
         screen.blit(text_surface, (10, 10))  # top-left corner
         screen.blit(text_surface_position, (10, 35))  
         
-        #draw_cube(screen, cube_vertices, cube_faces, cube_face_colors, cube_pos, cam)
-        draw_fox(screen,fox,cam)
-        #draw_pot(screen,tpot,cam)
-        #draw_cube(screen,angle,cube_vertices ,second_cube_pos,use_perspective=True)  # draw orthographic version for comparison
         if framecount % 30 == 0:  # every 120 frames (~2 seconds at 60 FPS)
             Profiler.profile_accumulate_report(intervals=30)
+            print(f"{raster_mode}: {rasterizer.stats.summary()}")
+            rasterizer.stats.reset()
     pygame.display.flip()
+    Profiler.end_frame()
 
+rasterizers["tiled"].close()
 pygame.quit()
@@ -0,0 +1,227 @@
+# lod.py
+# Level of detail: simplified versions of a mesh made with quadric error edge collapses, and
+# picking one per frame from how big the object is on screen.
+#
+# The collapses are half-edge collapses (one end of the edge moves onto the other), so every level
+# reuses the original vertices and only has its own faces / uv_faces. Collapses are done in passes
+# of many edges at once: the cheapest edges that don't share a vertex, checked so no face flips.
+# Boundary and uv seam vertices never move, which keeps the outline and the uv_faces intact.
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Every level has about this fraction of the faces of the one before
+LOD_RATIO = 0.5
+# No levels with fewer faces than this
+LOD_MIN_FACES = 64
+# Screen pixels per triangle the selection aims for
+LOD_PIXELS_PER_TRIANGLE = 4.0
+# Prefix of the level arrays when they are stored next to the mesh arrays (see mesh_cache)
+ARRAY_PREFIX = "lod"
+
+
+def _scatter_add(index: np.ndarray, values: np.ndarray, count: int) -> NDArray[np.float64]:
+    """Sum the (K, C) rows of values into (count, C) rows by index, one bincount per column."""
+    return np.stack([np.bincount(index, weights=values[:, c], minlength=count) for c in range(values.shape[1])], axis=1)
+
+
+def vertex_quadrics(vertices: np.ndarray, faces: np.ndarray) -> NDArray[np.float64]:
+    """(N, 16) flattened 4x4 error quadrics: every vertex sums the area weighted planes of its faces."""
+    tri = vertices[faces]
+    n = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    double_area = np.linalg.norm(n, axis=1)
+    n = np.divide(n, double_area[:, None], out=np.zeros_like(n), where=double_area[:, None] != 0)
+    planes = np.concatenate([n, -np.einsum("ij,ij->i", n, tri[:, 0])[:, None]], axis=1)
+    face_quadrics = (planes[:, :, None] * planes[:, None, :]).reshape(-1, 16) * (double_area / 2)[:, None]
+    return _scatter_add(faces.ravel(), np.repeat(face_quadrics, 3, axis=0), len(vertices))
+
+
+def _locked_vertices(faces: np.ndarray, uv_faces: np.ndarray | None, count: int) -> NDArray[np.bool_]:
+    """Vertices on an open boundary or a uv seam (more than one uv index), those are never removed."""
+    edges = np.sort(np.stack([faces, np.roll(faces, -1, axis=1)], axis=2).reshape(-1, 2), axis=1)
+    unique_edges, uses = np.unique(edges, axis=0, return_counts=True)
+    locked = np.zeros(count, dtype=bool)
+    locked[unique_edges[uses != 2].ravel()] = True
+    if uv_faces is not None:
+        pairs = np.unique(np.stack([faces.ravel(), uv_faces.ravel()], axis=1), axis=0)
+        locked |= np.bincount(pairs[:, 0], minlength=count) > 1
+    return locked
+
+
+def _common_neighbors(src: np.ndarray, dst: np.ndarray, edge_keys: np.ndarray, neighbor_start: np.ndarray,
+                      neighbors: np.ndarray, count: int) -> NDArray[np.int64]:
+    """How many vertices are connected to both ends of every (src, dst) edge."""
+    degree = neighbor_start[src + 1] - neighbor_start[src]
+    edge = np.repeat(np.arange(len(src)), degree)
+    offsets = np.arange(degree.sum()) - np.repeat(np.cumsum(degree) - degree, degree)
+    w = neighbors[neighbor_start[src][edge] + offsets]
+    shared = np.isin(dst[edge] * count + w, edge_keys)
+    return np.bincount(edge[shared], minlength=len(src))
+
+
+def _collapse_pass(vertices: np.ndarray, faces: np.ndarray, uv_faces: np.ndarray | None, quadrics: np.ndarray,
+                   target_faces: int) -> tuple[np.ndarray, np.ndarray | None, int]:
+    """One round of independent collapses, returns the new faces, uv_faces and how many edges collapsed."""
+    count = len(vertices)
+    locked = _locked_vertices(faces, uv_faces, count)
+
+    # Every half-edge src -> dst of every face, collapsing src onto dst. The face and the corner of
+    # dst in it tell which of dst's uv indices src's corners should take over.
+    corner = np.tile(np.arange(3), len(faces))
+    face = np.repeat(np.arange(len(faces)), 3)
+    src = faces.ravel()
+    dst = faces[face, (corner + 1) % 3]
+    dst_corner = (corner + 1) % 3
+    movable = ~locked[src]
+    src, dst, face, dst_corner = src[movable], dst[movable], face[movable], dst_corner[movable]
+    if len(src) == 0:
+        return faces, uv_faces, 0
+
+    # Error of moving src onto dst under both their quadrics
+    position = np.concatenate([vertices[dst], np.ones((len(dst), 1))], axis=1)
+    q = (quadrics[src] + quadrics[dst]).reshape(-1, 4, 4)
+    cost = np.einsum("ki,kij,kj->k", position, q, position)
+    order = np.argsort(cost, kind="stable")
+    src, dst, face, dst_corner = src[order], dst[order], face[order], dst_corner[order]
+
+    # Keep an edge only if it's the cheapest one at both its ends, so no two collapses share a vertex
+    rank = np.arange(len(src))
+    best = np.full(count, len(src))
+    np.minimum.at(best, src, rank)
+    np.minimum.at(best, dst, rank)
+    chosen = (best[src] == rank) & (best[dst] == rank)
+    src, dst, face, dst_corner = src[chosen], dst[chosen], face[chosen], dst_corner[chosen]
+
+    # Link condition: an interior edge whose ends share more than the 2 opposite vertices would pinch the surface
+    undirected = np.unique(np.sort(np.stack([faces, np.roll(faces, -1, axis=1)], axis=2).reshape(-1, 2), axis=1), axis=0)
+    both = np.concatenate([undirected, undirected[:, ::-1]])
+    both = both[np.lexsort((both[:, 1], both[:, 0]))]
+    neighbor_start = np.searchsorted(both[:, 0], np.arange(count + 1))
+    manifold = _common_neighbors(src, dst, both[:, 0] * count + both[:, 1], neighbor_start, both[:, 1], count) == 2
+    src, dst, face, dst_corner = src[manifold], dst[manifold], face[manifold], dst_corner[manifold]
+
+    # Every collapse removes about 2 faces, don't go far below the target
+    needed = max(1, (len(faces) - target_faces + 1) // 2)
+    src, dst, face, dst_corner = src[:needed], dst[:needed], face[:needed], dst_corner[:needed]
+
+    # Drop collapses that would flip a face, until none do
+    old_normals = np.cross(vertices[faces[:, 1]] - vertices[faces[:, 0]], vertices[faces[:, 2]] - vertices[faces[:, 0]])
+    while len(src) > 0:
+        remap = np.arange(count)
+        remap[src] = dst
+        new_faces = remap[faces]
+        changed = np.flatnonzero((new_faces != faces).any(axis=1))
+        nf = new_faces[changed]
+        degenerate = (nf[:, 0] == nf[:, 1]) | (nf[:, 1] == nf[:, 2]) | (nf[:, 0] == nf[:, 2])
+        new_normals = np.cross(vertices[nf[:, 1]] - vertices[nf[:, 0]], vertices[nf[:, 2]] - vertices[nf[:, 0]])
+        flipped = ~degenerate & (np.einsum("ij,ij->i", new_normals, old_normals[changed]) <= 0)
+        if not flipped.any():
+            break
+        bad = np.isin(src, faces[changed[flipped]])
+        src, dst, face, dst_corner = src[~bad], dst[~bad], face[~bad], dst_corner[~bad]
+    if len(src) == 0:
+        return faces, uv_faces, 0
+
+    remap = np.arange(count)
+    remap[src] = dst
+    new_faces = remap[faces]
+    if uv_faces is not None:
+        # src isn't on a seam so all its corners share one uv, they take dst's uv from the edge's face
+        uv_remap = np.full(count, -1)
+        uv_remap[src] = uv_faces[face, dst_corner]
+        moved = uv_remap[faces] >= 0
+        uv_faces = np.where(moved, uv_remap[faces], uv_faces)
+    quadrics[dst] += quadrics[src]
+
+    keep = (new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2]) & (new_faces[:, 0] != new_faces[:, 2])
+    return new_faces[keep], uv_faces[keep] if uv_faces is not None else None, len(src)
+
+
+def simplify(vertices: np.ndarray, faces: np.ndarray, uv_faces: np.ndarray | None = None,
+             target_faces: int = LOD_MIN_FACES, quadrics: np.ndarray | None = None
+             ) -> tuple[NDArray[np.int32], NDArray[np.int32] | None]:
+    """
+    Collapse edges of a mesh until it has about target_faces faces, or nothing can be collapsed.
+    Returns the new faces and uv_faces, indexing the same vertices and uv coordinates.
+    quadrics (see vertex_quadrics()) are updated in place when given, to keep simplifying from there.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    uv_faces = np.asarray(uv_faces, dtype=np.int64) if uv_faces is not None and len(uv_faces) == len(faces) else None
+    if quadrics is None:
+        quadrics = vertex_quadrics(vertices, faces)
+    while len(faces) > target_faces:
+        faces, uv_faces, collapsed = _collapse_pass(vertices, faces, uv_faces, quadrics, target_faces)
+        if collapsed == 0:
+            break
+    return faces.astype(np.int32), uv_faces.astype(np.int32) if uv_faces is not None else None
+
+
+def build_lod_chain(vertices: np.ndarray, faces: np.ndarray, uv_faces: np.ndarray | None = None,
+                    ratio: float = LOD_RATIO, min_faces: int = LOD_MIN_FACES
+                    ) -> list[tuple[NDArray[np.int32], NDArray[np.int32] | None]]:
+    """
+    (faces, uv_faces) of every simplified level, finest first, the full mesh not included.
+    Every level continues from the one before, stopping at min_faces or once a level barely shrinks.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    quadrics = vertex_quadrics(vertices, np.asarray(faces))
+    levels = []
+    while True:
+        target = int(len(faces) * ratio)
+        if target < min_faces:
+            break
+        new_faces, new_uv_faces = simplify(vertices, faces, uv_faces, target, quadrics)
+        if len(new_faces) > len(faces) * (1 + ratio) / 2:
+            break
+        levels.append((new_faces, new_uv_faces))
+        faces, uv_faces = new_faces, new_uv_faces
+    return levels
+
+
+def levels_to_arrays(levels: list[tuple[np.ndarray, np.ndarray | None]]) -> dict[str, np.ndarray]:
+    """
+    The levels of build_lod_chain() as "lod_count", "lod1_faces", "lod1_uv_faces", ... arrays, to store
+    with the mesh arrays. The count is stored even when it's 0, so small meshes don't look uncached.
+    """
+    arrays = {f"{ARRAY_PREFIX}_count": np.array([len(levels)], dtype=np.int64)}
+    for i, (faces, uv_faces) in enumerate(levels, start=1):
+        arrays[f"{ARRAY_PREFIX}{i}_faces"] = faces
+        arrays[f"{ARRAY_PREFIX}{i}_uv_faces"] = uv_faces if uv_faces is not None else np.zeros((0, 3), dtype=np.int32)
+    return arrays
+
+
+def has_arrays(arrays: dict[str, np.ndarray]) -> bool:
+    return f"{ARRAY_PREFIX}_count" in arrays
+
+
+def levels_from_arrays(arrays: dict[str, np.ndarray]) -> list[tuple[np.ndarray, np.ndarray]]:
+    """The levels stored by levels_to_arrays(), without copying them."""
+    return [(arrays[f"{ARRAY_PREFIX}{i}_faces"], arrays[f"{ARRAY_PREFIX}{i}_uv_faces"])
+            for i in range(1, int(arrays[f"{ARRAY_PREFIX}_count"][0]) + 1)]
+
+
+def projected_area(center: np.ndarray, radius: float, cam, scale: float = 150) -> float:
+    """
+    Pixels covered by a world space bounding sphere on screen (an ellipse, x is scaled by the aspect
+    like in pipeline.ScreenMapping), inf when the camera is inside or close to it.
+    """
+    depth = cam.world_to_camera(center)[2]
+    if depth <= radius:
+        return np.inf
+    radius_y = radius * cam.f * scale / depth
+    return np.pi * radius_y * radius_y * cam.aspect
+
+
+def select_level(face_counts: list[int], area_px: float,
+                 pixels_per_triangle: float = LOD_PIXELS_PER_TRIANGLE) -> int:
+    """
+    Index into face_counts (finest first) of the coarsest level that still has about one
+    triangle per pixels_per_triangle pixels of the projected_area().
+    """
+    wanted = area_px / pixels_per_triangle
+    level = 0
+    for i, faces in enumerate(face_counts):
+        if faces >= wanted:
+            level = i
+    return level
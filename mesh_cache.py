@@ -0,0 +1,156 @@
+# mesh_cache.py
+# Compact binary container for already cleaned mesh arrays, so startup doesn't have to re-parse
+# and re-clean OBJ files. Arrays are stored raw and opened with np.memmap, loading is near zero-copy.
+#
+# Layout:
+#   8 bytes   magic
+#   8 bytes   header length, little endian uint64
+#   header    JSON: source file key, load parameters and dtype/shape/offset of every array
+#   data      raw C-order array bytes, every array starts on an ALIGNMENT boundary
+
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b"RMESH\x00\x01\x00"
+ALIGNMENT = 64
+CACHE_EXTENSION = ".rmesh"
+
+
+def cache_path_for(source_path: str) -> str:
+    """Where the cache of a source file lives: right next to it."""
+    return source_path + CACHE_EXTENSION
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_key(source_path: str, with_hash: bool = True) -> dict:
+    """What a cache is keyed on: size, mtime and content hash of the source file."""
+    stat = os.stat(source_path)
+    key = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        key["sha1"] = _file_hash(source_path)
+    return key
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save(path: str, arrays: dict[str, np.ndarray], source_path: str | None = None, params: dict | None = None):
+    """
+    Write arrays to a cache file. If source_path is given the cache is keyed on it and load()
+    will reject the cache once the source changes. params are stored and must match on load as well.
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    entries = {}
+    offset = 0
+    for name, a in arrays.items():
+        entries[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset = _align(offset + a.nbytes)
+
+    header = {
+        "source": source_key(source_path) if source_path is not None else None,
+        "params": params or {},
+        "arrays": entries,
+    }
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    header_bytes += b" " * (data_start - len(MAGIC) - 8 - len(header_bytes))
+
+    # Write to a temporary file and swap it in, so a crash never leaves a half written cache behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, a in arrays.items():
+            f.seek(data_start + entries[name]["offset"])
+            f.write(a.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def _read_header(path: str) -> tuple[dict, int] | None:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    return header, len(MAGIC) + 8 + length
+
+
+def is_valid(header: dict, source_path: str | None, params: dict | None) -> bool:
+    """A cache is valid if it was made with the same params from an unchanged source file."""
+    if header["params"] != (params or {}):
+        return False
+    if source_path is None:
+        return True
+    stored = header["source"]
+    if stored is None:
+        return False
+    current = source_key(source_path, with_hash=False)
+    if stored["size"] != current["size"]:
+        return False
+    if stored["mtime_ns"] == current["mtime_ns"]:
+        return True
+    # Touched but maybe not changed, the hash decides
+    return stored["sha1"] == _file_hash(source_path)
+
+
+def _refresh_mtime(path: str, header: dict, data_start: int, source_path: str):
+    """
+    Store the source's current mtime in a cache that is_valid() accepted by its hash, so the next
+    load doesn't hash the source again. The header is rewritten in place, in its padding.
+    """
+    mtime_ns = os.stat(source_path).st_mtime_ns
+    if header["source"]["mtime_ns"] == mtime_ns:
+        return
+    header["source"]["mtime_ns"] = mtime_ns
+    header_bytes = json.dumps(header).encode()
+    space = data_start - len(MAGIC) - 8
+    if len(header_bytes) > space:
+        return  # Doesn't fit, the hash keeps deciding
+    try:
+        with open(path, "r+b") as f:
+            f.seek(len(MAGIC) + 8)
+            f.write(header_bytes + b" " * (space - len(header_bytes)))
+    except OSError:
+        pass  # A read-only cache still works, it just gets hashed every time
+
+
+def load(path: str, source_path: str | None = None, params: dict | None = None) -> dict[str, np.ndarray] | None:
+    """
+    Open a cache file and return its arrays as read-only views into a memory map.
+    Returns None when the file is missing, corrupt or stale.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        result = _read_header(path)
+        if result is None:
+            return None
+        header, data_start = result
+        if not is_valid(header, source_path, params):
+            return None
+        if source_path is not None:
+            _refresh_mtime(path, header, data_start, source_path)
+        mm = np.memmap(path, dtype=np.uint8, mode="r")
+        arrays = {}
+        for name, entry in header["arrays"].items():
+            dtype = np.dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            start = data_start + entry["offset"]
+            count = int(np.prod(shape, dtype=np.int64))
+            arrays[name] = mm[start:start + count * dtype.itemsize].view(dtype).reshape(shape)
+        return arrays
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
@@ -0,0 +1,168 @@
+# mesh_optimize.py
+# Load time cleanup of the index data: weld vertices that are (nearly) the same point, drop
+# vertices no face uses and faces that are there twice, then put faces and vertices in a
+# spatial (Morton) order so vertices[faces] reads memory mostly front to back.
+# Only faces / vertices change, uv_faces and normal_faces index their own arrays and keep their seams.
+
+import time
+import numpy as np
+from numpy.typing import NDArray
+
+# Vertices closer than this are welded into one (the mesh is normalized to [-1, 1] at load)
+WELD_EPSILON = 1e-6
+# Bits per axis of the Morton codes
+MORTON_BITS = 10
+# Large primes for hashing grid cells, as in Teschner et al. "Optimized Spatial Hashing"
+_HASH_PRIMES = np.array([73856093, 19349663, 83492791], dtype=np.int64)
+
+
+def _cell_hash(cells: np.ndarray) -> NDArray[np.int64]:
+    """One int64 per (K, 3) grid cell. Different cells can share a hash, callers check distances anyway."""
+    h = cells * _HASH_PRIMES
+    return h[:, 0] ^ h[:, 1] ^ h[:, 2]
+
+
+def weld_map(vertices: np.ndarray, epsilon: float = WELD_EPSILON) -> NDArray[np.int64]:
+    """
+    (N,) index of the vertex every vertex is welded into: the lowest index within epsilon of it,
+    following chains so the result points at vertices that map to themselves.
+
+    Neighbors are found with a hash grid of 2 * epsilon sized cells. Anything within epsilon of a
+    vertex is in its own cell or the next one on the side of the cell the vertex is in, per axis,
+    so 8 cells are searched per vertex.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    count = len(vertices)
+    weld = np.arange(count)
+    if count == 0:
+        return weld
+    scaled = vertices / (2 * epsilon)
+    cells = np.floor(scaled).astype(np.int64)
+    side = np.where(scaled - cells < 0.5, -1, 1)
+    keys = _cell_hash(cells)
+    order = np.argsort(keys, kind="stable")
+    cell_keys, cell_start, cell_count = np.unique(keys[order], return_index=True, return_counts=True)
+
+    for offset in np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)]):
+        neighbor_keys = _cell_hash(cells + side * offset)
+        cell = np.minimum(np.searchsorted(cell_keys, neighbor_keys), len(cell_keys) - 1)
+        found = np.where(cell_keys[cell] == neighbor_keys, cell_count[cell], 0)
+        i = np.repeat(np.arange(count), found)
+        j = order[np.arange(found.sum()) - np.repeat(np.cumsum(found) - found - cell_start[cell], found)]
+        close = (j < i) & (np.einsum("ij,ij->i", vertices[i] - vertices[j], vertices[i] - vertices[j]) <= epsilon * epsilon)
+        np.minimum.at(weld, i[close], j[close])
+
+    # Point every vertex at the end of its chain
+    while True:
+        next_weld = weld[weld]
+        if np.array_equal(next_weld, weld):
+            return weld
+        weld = next_weld
+
+
+def _canonical_faces(faces: np.ndarray) -> NDArray[np.int64]:
+    """Faces rotated so the smallest index comes first, keeping the winding. Same triangle, same row."""
+    first = np.argmin(faces, axis=1)
+    return faces[np.arange(len(faces))[:, None], (first[:, None] + np.arange(3)) % 3]
+
+
+def _follow_faces(index_faces: np.ndarray | None, count: int, keep: np.ndarray, order: np.ndarray):
+    """Per face index data (uv_faces, normal_faces) with the kept faces in their new order, anything else as it was."""
+    if index_faces is None or len(index_faces) != count or count == 0:
+        return index_faces
+    return np.asarray(index_faces)[keep][order].astype(np.int32)
+
+
+def morton_codes(points: np.ndarray, bits: int = MORTON_BITS) -> NDArray[np.int64]:
+    """Z-order codes of (K, 3) points, quantized to bits per axis within their bounding box."""
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+    low, high = points.min(axis=0), points.max(axis=0)
+    span = np.where(high > low, high - low, 1)
+    q = ((points - low) / span * ((1 << bits) - 1)).astype(np.int64)
+    codes = np.zeros(len(points), dtype=np.int64)
+    for bit in range(bits):
+        for axis in range(3):
+            codes |= ((q[:, axis] >> bit) & 1) << (3 * bit + axis)
+    return codes
+
+
+def time_gather(vertices: np.ndarray, faces: np.ndarray, repeats: int = 5, number: int = 4) -> float:
+    """Seconds the per-frame vertices[faces] gather takes: the best of repeats averages over number runs."""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            vertices[faces]
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+class OptimizeStats:
+    """What optimize_mesh() did, and how long the vertices[faces] gather took before and after."""
+    def __init__(self, vertices_before: int, vertices_after: int, faces_before: int, faces_after: int,
+                 gather_before: float, gather_after: float, seconds: float):
+        self.vertices_before = vertices_before
+        self.vertices_after = vertices_after
+        self.faces_before = faces_before
+        self.faces_after = faces_after
+        self.gather_before = gather_before
+        self.gather_after = gather_after
+        # Seconds the optimization itself took, without the gather timings
+        self.seconds = seconds
+
+    @property
+    def gather_speedup(self) -> float:
+        return self.gather_before / self.gather_after if self.gather_after > 0 else np.inf
+
+    def summary(self) -> str:
+        return (f"Mesh optimize: {self.vertices_before} -> {self.vertices_after} vertices, "
+                f"{self.faces_before} -> {self.faces_after} faces in {self.seconds * 1000:.1f}ms, "
+                f"gather {self.gather_before * 1000:.3f}ms -> {self.gather_after * 1000:.3f}ms "
+                f"({self.gather_speedup:.2f}x)")
+
+
+def optimize_mesh(vertices: np.ndarray, faces: np.ndarray, uv_faces: np.ndarray | None = None,
+                  normal_faces: np.ndarray | None = None, epsilon: float = WELD_EPSILON
+                  ) -> tuple[NDArray[np.float64], NDArray[np.int32], NDArray[np.int32] | None,
+                             NDArray[np.int32] | None, OptimizeStats]:
+    """
+    Weld, deduplicate and reorder a mesh. uv_faces and normal_faces (per face, or empty/None)
+    follow their faces. Returns (vertices, faces, uv_faces, normal_faces, stats).
+
+    Faces that collapse to a line or point after welding are dropped, so are repeats of a face
+    with the same winding (the other winding is kept, it's the back side).
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    gather_before = time_gather(vertices, np.asarray(faces))
+    start_time = time.perf_counter()
+    faces = np.asarray(faces, dtype=np.int64)
+
+    # Weld, then drop degenerate and repeated faces
+    welded = weld_map(vertices, epsilon)[faces]
+    keep = (welded[:, 0] != welded[:, 1]) & (welded[:, 1] != welded[:, 2]) & (welded[:, 0] != welded[:, 2])
+    _, first = np.unique(_canonical_faces(welded), axis=0, return_index=True)
+    unique = np.zeros(len(faces), dtype=bool)
+    unique[first] = True
+    keep &= unique
+    welded = welded[keep]
+
+    # Faces along a Morton curve through their centroids, vertices in the order the faces first use them.
+    # Vertices no face uses are left out.
+    face_order = np.argsort(morton_codes(vertices[welded].mean(axis=1)), kind="stable")
+    welded = welded[face_order]
+    used, first_use = np.unique(welded.ravel(), return_index=True)
+    vertex_order = used[np.argsort(first_use, kind="stable")]
+    new_index = np.empty(len(vertices), dtype=np.int64)
+    new_index[vertex_order] = np.arange(len(vertex_order))
+
+    new_vertices = np.ascontiguousarray(vertices[vertex_order])
+    new_faces = new_index[welded].astype(np.int32)
+    new_uv_faces = _follow_faces(uv_faces, len(faces), keep, face_order)
+    new_normal_faces = _follow_faces(normal_faces, len(faces), keep, face_order)
+    seconds = time.perf_counter() - start_time
+
+    stats = OptimizeStats(len(vertices), len(new_vertices), len(faces), len(new_faces),
+                          gather_before, time_gather(new_vertices, new_faces), seconds)
+    return new_vertices, new_faces, new_uv_faces, new_normal_faces, stats
@@ -0,0 +1,220 @@
+# obj_loader.py
+# Bulk OBJ parser. Instead of splitting and converting every line in Python, the file is read once
+# as bytes, the lines are sorted by record type with NumPy and every block of records is tokenized
+# and converted to numbers in one go.
+# The output matches what RenderableObject.parse_face + the old line-by-line loader produced.
+
+import warnings
+import numpy as np
+from numpy.typing import NDArray
+
+_NEWLINE = ord("\n")
+_SLASH = ord("/")
+
+# Lookup table: is this byte whitespace (the same set str.split() splits on for ascii)
+_IS_SPACE = np.zeros(256, dtype=bool)
+_IS_SPACE[[ord(c) for c in " \t\r\n\v\f"]] = True
+
+
+class _Records:
+    """The records of one type with their keyword blanked out, tokenized. Every line ends in a newline."""
+    def __init__(self, buf: bytes):
+        self.buf = buf
+        data = np.frombuffer(buf, dtype=np.uint8)
+        is_space = _IS_SPACE[data]
+        self.token_start = np.flatnonzero(~is_space & np.r_[True, is_space[:-1]])
+        line_end = np.flatnonzero(data == _NEWLINE)
+        self.line_count = len(line_end)
+        # Tokens before each line end, minus the ones before the previous line end
+        self.tokens_per_line = np.diff(np.searchsorted(self.token_start, line_end), prepend=0)
+
+    def text(self) -> str:
+        return self.buf.decode("ascii", errors="replace")
+
+
+# Keywords we read, the longer ones first so "vt" isn't mistaken for "v"
+_KEYWORDS = (b"vt", b"vn", b"v", b"f")
+
+
+def _split_records(raw: bytes) -> dict[bytes, _Records]:
+    """
+    Sort the lines of an OBJ file by their keyword (v, vt, vn, f) and blank the keyword out.
+
+    Lines of the same type usually come in long runs, so every run is sliced out of the file in
+    one piece. The keywords can be blanked with a plain replace since none of their letters can
+    show up in the numbers of their own record type.
+    """
+    if not raw.endswith(b"\n"):
+        raw += b"\n"
+    data = np.frombuffer(raw, dtype=np.uint8)
+    line_end = np.flatnonzero(data == _NEWLINE) + 1  # exclusive, keeps the newline
+    line_start = np.r_[0, line_end[:-1]]
+
+    # Lines may be indented, find the first non whitespace byte of every line
+    first = line_start
+    if np.any(_IS_SPACE[data[line_start]] & (data[line_start] != _NEWLINE)):
+        non_space = np.flatnonzero(~_IS_SPACE[data])
+        nearest = np.minimum(np.searchsorted(non_space, line_start), len(non_space) - 1)
+        first = np.minimum(non_space[nearest], line_end - 1)
+
+    padded = np.r_[data, np.full(3, _NEWLINE, dtype=np.uint8)]
+    c0, c1, c2 = padded[first], padded[first + 1], padded[first + 2]
+    kind = np.full(len(line_start), -1, dtype=np.int64)
+    kind[(c0 == ord("v")) & (c1 == ord("t")) & _IS_SPACE[c2]] = 0
+    kind[(c0 == ord("v")) & (c1 == ord("n")) & _IS_SPACE[c2]] = 1
+    kind[(c0 == ord("v")) & _IS_SPACE[c1]] = 2
+    kind[(c0 == ord("f")) & _IS_SPACE[c1]] = 3
+
+    # Runs of consecutive lines with the same kind
+    run_start = np.flatnonzero(np.r_[True, kind[1:] != kind[:-1]])
+    run_end = np.r_[run_start[1:], len(kind)]
+    chunks: dict[bytes, list[bytes]] = {keyword: [] for keyword in _KEYWORDS}
+    for start, end in zip(run_start.tolist(), run_end.tolist()):
+        k = kind[start]
+        if k < 0:
+            continue
+        keyword = _KEYWORDS[k]
+        chunks[keyword].append(raw[line_start[start]:line_end[end - 1]].replace(keyword, b" " * len(keyword)))
+    return {keyword: _Records(b"".join(parts)) for keyword, parts in chunks.items()}
+
+
+def _parse_floats(records: _Records, columns: int) -> NDArray[np.float64]:
+    """Convert records of whitespace separated numbers to a (lines, columns) array, extra columns are dropped."""
+    if records.line_count == 0:
+        return np.zeros((0, columns))
+    if np.all(records.tokens_per_line >= columns):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                values = np.fromstring(records.text(), dtype=np.float64, sep=" ")
+        except ValueError:
+            values = None
+        if values is not None and len(values) == len(records.token_start):
+            line_offset = np.cumsum(records.tokens_per_line) - records.tokens_per_line
+            return values[line_offset[:, None] + np.arange(columns)]
+    # Something that isn't a number (e.g. a trailing comment) or a short record, go line by line
+    return np.array([line.split()[:columns] for line in records.text().splitlines()], dtype=np.float64)
+
+
+# Stands in for a missing face field (e.g. the uv of v//vn), far outside any real index
+_MISSING = -(2 ** 62)
+
+
+def _parse_face_tokens(records: _Records) -> tuple[NDArray[np.int64], _Records]:
+    """
+    Split the face tokens (v, v/vt, v//vn or v/vt/vn) into a (tokens, 3) array of 1-based v/vt/vn
+    indices, _MISSING where a field is absent so it can't be confused with an index of 0.
+    """
+    # Empty fields get the placeholder, after this every token has 0, 1 or 2 slashes and no empty fields
+    missing = str(_MISSING).encode()
+    buf = records.buf.replace(b"//", b"/" + missing + b"/")
+    for space in (b" ", b"\t", b"\r", b"\n", b"\v", b"\f"):
+        buf = buf.replace(b"/" + space, b"/" + missing + space)
+    if buf != records.buf:
+        records = _Records(buf)
+
+    # Count the slashes of every token
+    slash = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == _SLASH)
+    slashes = np.diff(np.searchsorted(slash, np.r_[records.token_start, len(buf)]))
+    if np.any(slashes > 2):
+        raise Exception("Face vertex with more than 3 fields (v/vt/vn) found!")
+
+    values = np.fromstring(buf.replace(b"/", b" ").decode("ascii"), dtype=np.int64, sep=" ")
+    field_count = slashes + 1
+    if len(values) != field_count.sum():
+        raise ValueError("Invalid face record in OBJ file")
+    offset = np.cumsum(field_count) - field_count
+
+    fields = np.full((len(slashes), 3), _MISSING, dtype=np.int64)
+    fields[:, 0] = values[offset]
+    fields[slashes >= 1, 1] = values[offset[slashes >= 1] + 1]
+    fields[slashes == 2, 2] = values[offset[slashes == 2] + 2]
+    return fields, records
+
+
+def parse_faces(records: _Records, reverse_faces: bool = False
+                ) -> tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.int64]]:
+    """
+    Decode `f` records and fan triangulate them.
+
+    Returns (faces, uv_faces, normal_faces), all (T, 3) zero-based. Like parse_face a polygon only
+    contributes uv/normal triangles if every one of its corners has that index.
+    """
+    if np.any(records.tokens_per_line < 3):
+        raise Exception("Cannot build tri if less than 3 points are present!")
+    if records.line_count == 0:
+        empty = np.zeros((0, 3), dtype=np.int64)
+        return empty, empty.copy(), empty.copy()
+
+    fields, records = _parse_face_tokens(records)
+    missing = fields == _MISSING
+    indices = np.where(missing, 0, fields) - 1
+
+    # Does every corner of the polygon have a uv / normal index
+    counts = records.tokens_per_line
+    starts = np.cumsum(counts) - counts
+    has_uv = np.logical_and.reduceat(~missing[:, 1], starts)
+    has_normal = np.logical_and.reduceat(~missing[:, 2], starts)
+
+    # Fan triangulation: polygon p with n corners becomes (0, i + 1, i + 2) for i in range(n - 2)
+    tri_count = counts - 2
+    tri_polygon = np.repeat(np.arange(len(counts)), tri_count)
+    i = np.arange(tri_count.sum()) - np.repeat(np.cumsum(tri_count) - tri_count, tri_count)
+    base = starts[tri_polygon]
+    corners = np.stack([base, base + i + 1, base + i + 2], axis=1)
+    if reverse_faces:
+        corners = corners[:, ::-1]
+
+    faces = indices[corners, 0]
+    uv_faces = indices[corners[has_uv[tri_polygon]], 1]
+    normal_faces = indices[corners[has_normal[tri_polygon]], 2]
+    return faces, uv_faces, normal_faces
+
+
+def generate_missing_normals(vertices: np.ndarray, faces: np.ndarray, normals: np.ndarray, normal_faces: np.ndarray
+                             ) -> tuple[NDArray[np.float64], NDArray[np.int64]]:
+    """
+    Triangles whose normal index is 0 in the file (-1 after conversion) get a flat face normal appended
+    to normals. Then every normal index is validated.
+    """
+    normals = normals.reshape(-1, 3)
+    normal_faces = normal_faces.copy()
+    # Pairs up triangles and normal triangles by position, like zip()
+    paired = min(len(faces), len(normal_faces))
+    rows = np.flatnonzero((normal_faces[:paired] == -1).any(axis=1))
+    if len(rows) > 0:
+        tri = vertices[faces[rows]]
+        n = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+        lengths = np.linalg.norm(n, axis=1, keepdims=True)
+        n = np.divide(n, lengths, out=n.copy(), where=lengths != 0)
+        # NOTE updated normals will all have the same index.
+        # This is because they will all be facing the same direction.
+        # This has the effect of doing flat shading.
+        new_index = len(normals) + np.arange(len(rows))
+        normals = np.concatenate([normals, n])
+        normal_faces[rows] = np.where(normal_faces[rows] == -1, new_index[:, None], normal_faces[rows])
+
+    bad = (normal_faces < 0) | (normal_faces >= len(normals))
+    if np.any(bad):
+        if normal_faces.reshape(-1)[np.argmax(bad.reshape(-1))] == -1:
+            raise Exception("Not yet generated")
+        raise Exception("Normal pointing to invalid index")
+    return normals, normal_faces
+
+
+def parse_obj(filepath: str, reverse_faces: bool = False):
+    """
+    Parse an OBJ file.
+
+    Returns (vertices, texcoords, normals, faces, uv_faces, normal_faces) as arrays.
+    """
+    with open(filepath, "rb") as file:
+        raw = file.read()
+
+    records = _split_records(raw)
+    vertices = _parse_floats(records[b"v"], 3)
+    texcoords = _parse_floats(records[b"vt"], 2)
+    normals = _parse_floats(records[b"vn"], 3)
+    faces, uv_faces, normal_faces = parse_faces(records[b"f"], reverse_faces)
+    normals, normal_faces = generate_missing_normals(vertices, faces, normals, normal_faces)
+    return vertices, texcoords, normals, faces, uv_faces, normal_faces
@@ -0,0 +1,323 @@
+# pipeline.py
+# Batched stages of the rendering pipeline. Everything in here works on a whole
+# mesh at once with NumPy instead of looping over vertices/faces in Python.
+
+import numpy as np
+from numpy.typing import NDArray
+from Camera import Camera
+
+
+class ScreenMapping:
+    """
+    How camera space points end up in pixel coordinates for one camera, surface size and scale.
+    transform_vertices maps every vertex with it and face_setup the new corners of triangles
+    clipped at the near plane, which is the camera's near unless given. It has to stay a bit in
+    front of the camera so 1/z stays finite.
+    """
+    def __init__(self, cam: Camera, screen_size: tuple[int, int], scale: float = 150, near: float | None = None):
+        self.f = cam.f
+        self.aspect = cam.aspect
+        self.scale = scale
+        self.center_x = screen_size[0] / 2
+        self.center_y = screen_size[1] / 2
+        self.near = cam.near if near is None else near
+
+    def __call__(self, camera_points: np.ndarray, z: np.ndarray | None = None) -> NDArray[np.float64]:
+        """(..., 3) camera space points to (..., 2) pixel coordinates, z overrides the depth divided by."""
+        if z is None:
+            z = camera_points[..., 2]
+        screen = np.empty(camera_points.shape[:-1] + (2,), dtype=np.float64)
+        screen[..., 0] = (camera_points[..., 0] / z) * self.f * self.aspect * self.scale + self.center_x
+        screen[..., 1] = -(camera_points[..., 1] / z) * self.f * self.scale + self.center_y
+        return screen
+
+
+def transform_vertices(vertices: np.ndarray, cam: Camera, screen_size: tuple[int, int], scale: float = 150
+                       ) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.bool_]]:
+    """
+    Transform and project a whole (N, 3) array of world space vertices in one pass.
+
+    Args:
+        vertices: (N, 3) world space vertices, e.g. RenderableObject.vertices
+        cam: the Camera to view the vertices from
+        screen_size: (width, height) of the target surface in pixels
+        scale: scaling factor from projected coordinates to pixels
+
+    Returns:
+        camera_vertices (N, 3): vertices in camera space, z is the depth
+        screen_vertices (N, 2): pixel coordinates, only meaningful where behind is False
+        behind (N,): True for vertices at or behind the camera (z <= 0)
+    """
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+
+    # One batched call, the camera keeps its rotation matrix cached between frames
+    camera_vertices = cam.world_to_camera(v)
+
+    z = camera_vertices[:, 2]
+    behind = z <= 0
+    # Vertices behind the camera get a dummy depth so the divide stays clean,
+    # their screen position is masked out by `behind` anyway.
+    safe_z = np.where(behind, 1.0, z)
+    screen_vertices = ScreenMapping(cam, screen_size, scale)(camera_vertices, safe_z)
+
+    return camera_vertices, screen_vertices, behind
+
+
+def screen_frustum(cam: Camera, screen_size: tuple[int, int], scale: float = 150) -> NDArray[np.float64]:
+    """
+    World space frustum planes (see Camera.frustum_planes) of what transform_vertices puts on a
+    screen_size surface, with the camera's near plane (where face_setup clips) and far plane.
+    """
+    width, height = screen_size
+    return cam.frustum_planes(width / (2 * scale), height / (2 * scale))
+
+
+def objects_in_frustum(objects: list, planes: np.ndarray) -> NDArray[np.bool_]:
+    """
+    Which RenderableObjects can be (partly) inside the frustum, tested against all of them at once.
+    Bounding spheres go first, the AABBs of the objects that pass get a second, tighter test.
+    Objects that end up False are guaranteed to be entirely outside.
+    """
+    if len(objects) == 0:
+        return np.zeros(0, dtype=bool)
+    normals, offsets = planes[:, :3], planes[:, 3]
+
+    spheres = [obj.get_bounding_sphere() for obj in objects]
+    centers = np.array([center for center, _ in spheres])
+    radii = np.array([radius for _, radius in spheres])
+    visible = (centers @ normals.T + offsets >= -radii[:, None]).all(axis=1)
+
+    candidates = np.flatnonzero(visible)
+    if len(candidates) > 0:
+        boxes = np.array([obj.get_aabb() for obj in (objects[i] for i in candidates)])  # (K, 2, 3)
+        box_center = boxes.mean(axis=1)
+        box_extent = (boxes[:, 1] - boxes[:, 0]) / 2
+        # Distance of the corner furthest along each plane normal
+        reach = box_extent @ np.abs(normals).T
+        visible[candidates] = (box_center @ normals.T + offsets >= -reach).all(axis=1)
+    return visible
+
+
+def object_in_frustum(obj, planes: np.ndarray) -> bool:
+    return bool(objects_in_frustum([obj], planes)[0])
+
+
+# Light comes straight down from the sky
+SKY_LIGHT = np.array([0.0, 1.0, 0.0])
+AMBIENT = 0.2
+
+
+class FrameFaces:
+    """
+    The per-frame output of face setup, ready to be consumed by a rasterizer.
+
+    Only faces that survived culling are kept, and they are already sorted back-to-front
+    (farthest first) so a painter's rasterizer can simply draw them in order.
+    All attributes are arrays with one row per visible triangle, except texture.
+    Faces cut by the near plane become one or two smaller triangles, so the same face_index
+    can show up more than once. uvs and texture are only set for textured objects, for per-pixel texturing.
+    """
+    def __init__(self, face_index: np.ndarray, screen: np.ndarray, depth: np.ndarray,
+                 sort_key: np.ndarray, normals: np.ndarray, colors: np.ndarray,
+                 light: np.ndarray | None = None, uvs: np.ndarray | None = None, texture=None,
+                 bary: np.ndarray | None = None):
+        self.face_index: NDArray[np.int64]  # (K,) index into the source object's faces
+        self.face_index = face_index
+
+        self.screen: NDArray[np.float64]  # (K, 3, 2) pixel coordinates of each corner
+        self.screen = screen
+
+        self.depth: NDArray[np.float64]  # (K, 3) camera space z of each corner
+        self.depth = depth
+
+        self.sort_key: NDArray[np.float64]  # (K,) average camera space z
+        self.sort_key = sort_key
+
+        self.normals: NDArray[np.float64]  # (K, 3) normalized world space face normals
+        self.normals = normals
+
+        self.colors: NDArray[np.uint8]  # (K, 3) lit face colors
+        self.colors = colors
+
+        self.light: NDArray[np.float64]  # (K,) brightness the face colors were lit with (diffuse + ambient)
+        self.light = light if light is not None else np.ones(len(face_index))
+
+        self.uvs: NDArray[np.float64] | None  # (K, 3, 2) uv of each corner
+        self.uvs = uvs
+
+        self.texture = texture  # Texture the uvs point into
+
+        # (K, 3, 3) weights of the source face's corners for each corner, None when nothing was clipped
+        self.bary: NDArray[np.float64] | None
+        self.bary = bary
+
+    def __len__(self):
+        return len(self.face_index)
+
+
+def face_normals(vertices: np.ndarray, faces: np.ndarray) -> NDArray[np.float64]:
+    """Normalized (M, 3) normals for every face, following the faces' winding."""
+    tri = vertices[faces]  # (M, 3, 3)
+    n = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    lengths = np.linalg.norm(n, axis=1, keepdims=True)
+    return np.divide(n, lengths, out=np.zeros_like(n), where=lengths != 0)
+
+
+def _edge_points(z: np.ndarray, start: np.ndarray, end: np.ndarray, near: float) -> NDArray[np.float64]:
+    """(T, 3) barycentric weights of where the edges start -> end of (T, 3) corner depths cross z = near."""
+    rows = np.arange(len(z))
+    z_start = z[rows, start]
+    t = (near - z_start) / (z[rows, end] - z_start)
+    weights = np.zeros((len(z), 3), dtype=np.float64)
+    weights[rows, start] = 1 - t
+    weights[rows, end] += t
+    return weights
+
+
+def clip_near(depth: np.ndarray, near: float
+              ) -> tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.float64]]:
+    """
+    Clip a batch of triangles against the z = near plane, all at once.
+
+    Triangles are grouped by how many corners are in front of the plane: all three are kept as they
+    are, none are dropped, two become a quad that is split into two triangles and one becomes a
+    smaller triangle. New triangles keep the winding of the one they came from.
+
+    Args:
+        depth: (M, 3) camera space z of every triangle corner
+        near: depth of the clipping plane
+
+    Returns:
+        whole (W,): triangles entirely in front of the plane
+        clipped (C,): source triangle of every new triangle
+        bary (C, 3, 3): every new corner as weights of its source triangle's corners
+    """
+    inside = depth >= near
+    count = inside.sum(axis=1)
+    whole = np.flatnonzero(count == 3)
+    eye = np.eye(3)
+
+    # One corner behind: corners o, a, b become the quad a, b, P(b->o), P(o->a)
+    one = np.flatnonzero(count == 2)
+    o = np.argmin(inside[one], axis=1)
+    a, b = (o + 1) % 3, (o + 2) % 3
+    p_oa = _edge_points(depth[one], o, a, near)
+    p_bo = _edge_points(depth[one], b, o, near)
+    quad_1 = np.stack([p_oa, eye[a], eye[b]], axis=1)
+    quad_2 = np.stack([p_oa, eye[b], p_bo], axis=1)
+
+    # Two corners behind: corners i, a, b become the triangle i, P(i->a), P(b->i)
+    two = np.flatnonzero(count == 1)
+    i = np.argmax(inside[two], axis=1)
+    a, b = (i + 1) % 3, (i + 2) % 3
+    tip = np.stack([eye[i], _edge_points(depth[two], i, a, near), _edge_points(depth[two], b, i, near)], axis=1)
+
+    clipped = np.concatenate([one, one, two])
+    bary = np.concatenate([quad_1, quad_2, tip])
+    return whole, clipped, bary
+
+
+def face_setup(vertices: np.ndarray, faces: np.ndarray, camera_vertices: np.ndarray,
+               screen_vertices: np.ndarray, behind: np.ndarray, base_colors=(255, 255, 255),
+               normals: np.ndarray | None = None, light_dir: np.ndarray = SKY_LIGHT, ambient: float = AMBIENT,
+               uvs: np.ndarray | None = None, texture=None, screen_mapping: ScreenMapping | None = None
+               ) -> FrameFaces:
+    """
+    Set up every face of a mesh for rasterization at once.
+
+    Computes world normals, z-average sort keys, the screen space back-face mask and
+    diffuse + ambient shading for all faces with array ops, then drops faces that are
+    behind the camera or facing away from it.
+
+    With a screen_mapping, faces that cross the near plane are clipped (see clip_near) and
+    their visible part is kept. Without one they are dropped whole, like faces behind the camera.
+
+    Args:
+        vertices: (N, 3) world space vertices
+        faces: (M, 3) vertex indices per face
+        camera_vertices, screen_vertices, behind: output of transform_vertices()
+        base_colors: (M, 3) per-face colors or a single (3,) color for every face, 0-255
+        normals: optional precomputed (M, 3) world space face normals, e.g. RenderableObject.get_face_normals()
+        light_dir: direction towards the light
+        ambient: ambient term added to the diffuse brightness
+        uvs: optional (M, 3, 2) uv of every face corner, e.g. RenderableObject.get_face_uvs()
+        texture: the Texture the uvs point into, passed on to the rasterizer
+        screen_mapping: the ScreenMapping transform_vertices used, to project clipped corners
+
+    Returns:
+        FrameFaces with the visible faces sorted back-to-front.
+    """
+    faces = np.asarray(faces)
+    if len(faces) == 0:
+        return FrameFaces(np.zeros(0, dtype=np.int64), np.zeros((0, 3, 2)), np.zeros((0, 3)),
+                          np.zeros(0), np.zeros((0, 3)), np.zeros((0, 3), dtype=np.uint8))
+
+    bary = None
+    if screen_mapping is None:
+        # Faces with any vertex behind the camera can't be projected
+        face_index = np.flatnonzero(~behind[faces].any(axis=1))
+        tri_screen = screen_vertices[faces[face_index]]  # (T, 3, 2)
+        depth = camera_vertices[faces[face_index], 2]  # (T, 3)
+    else:
+        tri_depth = camera_vertices[faces, 2]
+        whole, clipped, clipped_bary = clip_near(tri_depth, screen_mapping.near)
+        face_index = whole
+        tri_screen = screen_vertices[faces[whole]]
+        depth = tri_depth[whole]
+        if len(clipped) > 0:
+            # New corners are blends of the source corners in camera space, projected on their own
+            clipped_camera = clipped_bary @ camera_vertices[faces[clipped]]  # (C, 3, 3)
+            face_index = np.concatenate([whole, clipped])
+            tri_screen = np.concatenate([tri_screen, screen_mapping(clipped_camera)])
+            depth = np.concatenate([depth, clipped_camera[..., 2]])
+            bary = np.concatenate([np.broadcast_to(np.eye(3), (len(whole), 3, 3)), clipped_bary])
+
+    # Back-face culling using the winding of the projected triangle (z of the cross product)
+    e1 = tri_screen[:, 1] - tri_screen[:, 0]
+    e2 = tri_screen[:, 2] - tri_screen[:, 0]
+    n_z = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+    front = np.flatnonzero(n_z <= 0)
+    face_index, tri_screen, depth = face_index[front], tri_screen[front], depth[front]
+    if bary is not None:
+        bary = bary[front]
+
+    if normals is None:
+        normals = face_normals(vertices, faces[face_index])
+    else:
+        normals = normals[face_index]
+    sort_key = depth.mean(axis=1)
+
+    # Diffuse + ambient lighting
+    light = np.maximum(0, normals @ np.asarray(light_dir, dtype=np.float64)) + ambient
+    # Pick the visible rows before converting, per-face colors can be a lot bigger than what's left
+    base = np.asarray(base_colors)
+    if base.ndim == 2:
+        base = base[face_index]
+    colors = np.clip(base.astype(np.float64) * light[:, None], 0, 255).astype(np.uint8)
+
+    # Painter's order, farthest first. Stable so equal depths keep their face order.
+    order = np.argsort(-sort_key, kind="stable")
+    face_index = face_index[order]
+    if bary is not None:
+        bary = bary[order]
+    if uvs is not None:
+        uvs = uvs[face_index]
+        if bary is not None:
+            uvs = bary @ uvs
+    return FrameFaces(face_index, tri_screen[order], depth[order], sort_key[order],
+                      normals[order], colors[order], light[order], uvs, texture, bary)
+
+
+def object_frame_faces(obj, cam: Camera, screen_size: tuple[int, int], scale: float = 150,
+                       light_dir: np.ndarray = SKY_LIGHT, ambient: float = AMBIENT) -> FrameFaces:
+    """
+    Run the transform/project and face setup stages for a RenderableObject, using its cached per-face data.
+    Objects with levels of detail draw the one picked for this view, face_index then refers to that level's faces.
+    """
+    obj = obj.lod_for(cam, screen_size, scale)
+    world_vertices = obj.get_world_vertices()
+    camera_vertices, screen_vertices, behind = transform_vertices(world_vertices, cam, screen_size, scale)
+    return face_setup(world_vertices, obj.faces, camera_vertices, screen_vertices, behind,
+                      base_colors=obj.get_face_colors(), normals=obj.get_face_normals(),
+                      light_dir=light_dir, ambient=ambient, uvs=obj.get_face_uvs(), texture=obj.texture,
+                      screen_mapping=ScreenMapping(cam, screen_size, scale))
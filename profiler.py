@@ -1,68 +1,408 @@
 # profiler.py
+# Hierarchical profiler. Named scopes nest into a tree following the call stack (one stack per
+# thread), and every scope adds its time per frame to a fixed-size ring buffer, so reports can
+# show percentiles of frame times instead of only averages.
+#
+#   with Profiler.scope("face_setup"):
+#       ...
+#   Profiler.end_frame()  # once per frame
+#
+# profile_accumulate_start/end and timed record into the same tree.
+#
+# For spikes that averages hide, a trace records every begin/end as a timestamped event per
+# thread and saves them for a timeline viewer (chrome://tracing, Perfetto or speedscope.app):
+#
+#   Profiler.start_trace()
+#   ... N frames ...
+#   Profiler.save_trace("trace.json")
 
+import json
+import os
+import threading
 import time
+from collections import deque
+import numpy as np
 
-# Accumulates total time spent in named segments
-_profile_accumulators = {}
-# keep track of our named profilers
-_profile_timers = {}
+# Frames of history kept per scope for the percentiles
+FRAME_HISTORY = 240
+# Most trace events kept in memory, older ones are dropped once the buffer is full
+TRACE_BUFFER = 1_000_000
+TRACE_FORMATS = ("chrome", "speedscope")
 
 enabled_profiler = True
 
+
+class _ScopeNode:
+    """
+    One scope in the tree: accumulated time since the last report plus per-frame history.
+    Scopes of several threads (e.g. the tiled rasterizer's workers) can share a node, so its
+    totals are only changed while holding _tree_lock.
+    """
+    __slots__ = ("name", "parent", "children", "total", "count", "frame_time",
+                 "history", "history_pos", "history_len")
+
+    def __init__(self, name: str, parent: "_ScopeNode | None"):
+        self.name = name
+        self.parent = parent
+        self.children: dict[str, _ScopeNode] = {}
+        self.total = 0.0  # seconds since the last report
+        self.count = 0  # calls since the last report
+        self.frame_time = 0.0  # seconds in the current frame
+        self.history = np.zeros(FRAME_HISTORY)  # seconds per frame, ring buffer
+        self.history_pos = 0
+        self.history_len = 0
+
+    def child(self, name: str) -> "_ScopeNode":
+        node = self.children.get(name)
+        if node is None:
+            with _tree_lock:
+                node = self.children.setdefault(name, _ScopeNode(name, self))
+        return node
+
+    def push_frame(self):
+        """Store the current frame's time in the ring buffer and start a new frame, for the whole subtree."""
+        self.history[self.history_pos] = self.frame_time
+        self.history_pos = (self.history_pos + 1) % FRAME_HISTORY
+        self.history_len = min(self.history_len + 1, FRAME_HISTORY)
+        self.frame_time = 0.0
+        for child in list(self.children.values()):
+            child.push_frame()
+
+    def frame_samples(self) -> np.ndarray:
+        """Seconds spent in this scope for each recorded frame, oldest first."""
+        if self.history_len < FRAME_HISTORY:
+            return self.history[:self.history_len].copy()
+        return np.roll(self.history, -self.history_pos)
+
+    def frame_percentiles(self) -> dict[str, float] | None:
+        samples = self.frame_samples()
+        if len(samples) == 0:
+            return None
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {"p50": p50, "p95": p95, "p99": p99, "max": samples.max(), "frames": len(samples)}
+
+    def path(self) -> str:
+        if self.parent is None or self.parent.parent is None:
+            return self.name
+        return self.parent.path() + "/" + self.name
+
+
+_tree_lock = threading.Lock()
+# Root of the scope tree, its history holds the total frame times
+_root = _ScopeNode("frame", None)
+_last_frame_end: float | None = None
+# Open scopes of every thread, as a list of (node, start time)
+_thread_state = threading.local()
+
+# Trace events while a trace is being captured: (phase, name, thread id, time in seconds)
+# phase is "B" begin, "E" end or "F" end of frame. deque.append is thread safe.
+_trace_events: deque | None = None
+_thread_names: dict[int, str] = {}
+
+
+def _open_scopes() -> list:
+    stack = getattr(_thread_state, "stack", None)
+    if stack is None:
+        stack = _thread_state.stack = [(_root, 0.0)]
+    return stack
+
+
+def _trace(phase: str, name: str, timestamp: float):
+    ident = threading.get_ident()
+    if ident not in _thread_names:
+        _thread_names[ident] = threading.current_thread().name
+    events = _trace_events
+    if events is not None:
+        events.append((phase, name, ident, timestamp))
+
+
+def _begin(name: str):
+    stack = _open_scopes()
+    node = stack[-1][0].child(name)
+    start = time.perf_counter()
+    if _trace_events is not None:
+        _trace("B", name, start)
+    stack.append((node, start))
+
+
+def _end(name: str):
+    now = time.perf_counter()
+    stack = _open_scopes()
+    # Find the scope being closed, normally it's on top. Scopes opened inside it that were never
+    # closed get closed along with it, an end without a matching start is ignored.
+    for depth in range(len(stack) - 1, 0, -1):
+        if stack[depth][0].name == name:
+            break
+    else:
+        return
+    while len(stack) > depth:
+        node, start = stack.pop()
+        if _trace_events is not None:
+            _trace("E", node.name, now)
+        elapsed = now - start
+        with _tree_lock:
+            node.total += elapsed
+            node.count += 1
+            node.frame_time += elapsed
+
+
+class _Scope:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        _begin(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _end(self.name)
+        return False
+
+
+class _NullScope:
+    """What Profiler.scope hands out while profiling is off, does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+def _balanced_events(events: list) -> list:
+    """
+    Per thread, drop ends whose begin fell out of the bounded buffer and close scopes that were
+    still open when the trace stopped, so viewers get properly nested events.
+    """
+    if not events:
+        return []
+    last_time = max(event[3] for event in events)
+    open_scopes: dict[int, list[str]] = {}
+    balanced = []
+    for event in events:
+        phase, name, ident, _ = event
+        stack = open_scopes.setdefault(ident, [])
+        if phase == "B":
+            stack.append(name)
+        elif phase == "E":
+            if not stack or stack[-1] != name:
+                continue
+            stack.pop()
+        balanced.append(event)
+    for ident, stack in open_scopes.items():
+        for name in reversed(stack):
+            balanced.append(("E", name, ident, last_time))
+    return balanced
+
+
+def _chrome_trace(events: list) -> dict:
+    pid = os.getpid()
+    trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": name}}
+             for ident, name in _thread_names.items()]
+    for phase, name, ident, timestamp in events:
+        event = {"name": name, "ph": phase, "ts": timestamp * 1e6, "pid": pid, "tid": ident}
+        if phase == "F":
+            # Frame boundaries as instant events spanning the whole process
+            event["ph"] = "i"
+            event["s"] = "p"
+        trace.append(event)
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def _speedscope_trace(events: list, name: str) -> dict:
+    # speedscope has one evented profile per thread, scopes are shared frames referenced by index
+    frame_index: dict[str, int] = {}
+    profiles: dict[int, list] = {}
+    for phase, scope, ident, timestamp in events:
+        if phase == "F":
+            continue
+        if scope not in frame_index:
+            frame_index[scope] = len(frame_index)
+        profiles.setdefault(ident, []).append(
+            {"type": "O" if phase == "B" else "C", "frame": frame_index[scope], "at": timestamp * 1000})
+    start = min((e[3] for e in events), default=0) * 1000
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "profiler.py",
+        "shared": {"frames": [{"name": scope} for scope in frame_index]},
+        "profiles": [{
+            "type": "evented",
+            "name": _thread_names.get(ident, str(ident)),
+            "unit": "milliseconds",
+            "startValue": start,
+            "endValue": thread_events[-1]["at"],
+            "events": thread_events,
+        } for ident, thread_events in profiles.items()],
+    }
+
+
+def _report_order(item):
+    # Normal entries first (alphabetical), then those starting with "f:"
+    return item[0].startswith("f:"), item[0]
+
+
 class Profiler:
+    @staticmethod
+    def set_enabled(enabled: bool):
+        """Turn profiling on or off. `from profiler import enabled_profiler` only copies the flag, use this to change it."""
+        global enabled_profiler
+        enabled_profiler = enabled
+
+    @staticmethod
+    def scope(name: str):
+        """
+        Context manager timing the enclosed block as a child of the scope it's opened in.
+        While profiling is off this returns a shared do-nothing scope, so it costs one check.
+        """
+        if not enabled_profiler:
+            return _NULL_SCOPE
+        return _Scope(name)
+
     @staticmethod
     def profile_accumulate_start(name: str):
         if enabled_profiler:
-            if name not in _profile_accumulators:
-                _profile_accumulators[name] = [0.0, 0, None]  # [total_time, count, start_time]
-            _profile_accumulators[name][2] = time.perf_counter()  # Reset start time
+            _begin(name)
 
     @staticmethod
     def profile_accumulate_end(name: str):
         if enabled_profiler:
-            if name not in _profile_accumulators or _profile_accumulators[name][2] is None:
-                return  # ignore unmatched end
-            start = _profile_accumulators[name][2]
-            elapsed = time.perf_counter() - start
-            _profile_accumulators[name][0] += elapsed
-            _profile_accumulators[name][1] += 1
-            _profile_accumulators[name][2] = None  # clear start
+            _end(name)
+
+    @staticmethod
+    def end_frame():
+        """Close the current frame: every scope's time this frame goes into its ring buffer."""
+        global _last_frame_end
+        if not enabled_profiler:
+            return
+        now = time.perf_counter()
+        if _trace_events is not None:
+            _trace("F", "frame", now)
+        with _tree_lock:
+            if _last_frame_end is not None:
+                _root.frame_time = now - _last_frame_end
+                _root.push_frame()
+            else:
+                # No frame start to measure the first frame from, but its scopes are known
+                for child in list(_root.children.values()):
+                    child.push_frame()
+        _last_frame_end = now
+
+    @staticmethod
+    def frame_stats() -> dict[str, dict[str, float]]:
+        """p50/p95/p99/max seconds per frame of every scope by path ("frame" is the whole frame)."""
+        stats = {}
+        nodes = [_root]
+        while nodes:
+            node = nodes.pop()
+            percentiles = node.frame_percentiles()
+            if percentiles is not None:
+                stats[node.path()] = percentiles
+            nodes.extend(node.children.values())
+        return stats
+
+    @staticmethod
+    def reset():
+        """Forget every scope and all frame history."""
+        global _last_frame_end
+        with _tree_lock:
+            _root.children.clear()
+            _root.history[:] = 0
+            _root.history_pos = _root.history_len = 0
+            _last_frame_end = None
+
+    @staticmethod
+    def start_trace(max_events: int = TRACE_BUFFER):
+        """Start recording begin/end events for a trace, keeping at most the newest max_events."""
+        global _trace_events
+        _trace_events = deque(maxlen=max_events)
+
+    @staticmethod
+    def stop_trace() -> list:
+        """Stop recording and return the captured events."""
+        global _trace_events
+        events, _trace_events = _trace_events, None
+        return list(events) if events is not None else []
+
+    @staticmethod
+    def is_tracing() -> bool:
+        return _trace_events is not None
+
+    @staticmethod
+    def save_trace(path: str, format: str | None = None, events: list | None = None) -> int:
+        """
+        Write a trace to path and stop recording, unless events are passed in.
+        format is "chrome" (Trace Event JSON for chrome://tracing / Perfetto) or "speedscope",
+        by default speedscope for *.speedscope.json and chrome for anything else.
+        Returns the number of events written.
+        """
+        if events is None:
+            events = Profiler.stop_trace()
+        if format is None:
+            format = "speedscope" if path.endswith(".speedscope.json") else "chrome"
+        if format not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format: {format}, expected one of {TRACE_FORMATS}")
+        events = _balanced_events(events)
+        data = _chrome_trace(events) if format == "chrome" else _speedscope_trace(events, os.path.basename(path))
+        with open(path, "w") as f:
+            json.dump(data, f)
+        return len(events)
 
     @staticmethod
     def profile_accumulate_report(intervals=1):
+        """
+        Print the scope tree with the time per interval (e.g. per frame when called every `intervals`
+        frames) and, once end_frame() is being called, the percentiles of the per-frame times.
+        Accumulated totals start over after a report, the frame history is kept.
+        """
         if enabled_profiler:
             print("\n////////==== Report Start ====\\\\\\\\\\\\\\\\")
-            grand_total = sum(total for total, count, _ in _profile_accumulators.values())
-
-            # Sort keys: normal entries first (alphabetical), then those starting with "f:"
-            sorted_items = sorted(_profile_accumulators.items(), key=lambda x: (x[0].startswith("f:"), x[0]))
+            frame = _root.frame_percentiles()
+            if frame is not None:
+                print(f"frame: p50 {frame['p50']*1000:.2f}ms  p95 {frame['p95']*1000:.2f}ms  "
+                      f"p99 {frame['p99']*1000:.2f}ms  max {frame['max']*1000:.2f}ms  over {frame['frames']} frames")
+            Profiler._report_children(_root, intervals, 0)
+            print("\\\\\\\\\\\\\\\\==== Report End   ====////////")
 
-            for name, (total, count, _) in sorted_items:
-                if count == 0:
-                    continue
+    @staticmethod
+    def _report_children(node: _ScopeNode, intervals, depth: int):
+        indent = "  " * depth
+        for name, child in sorted(list(node.children.items()), key=_report_order):
+            with _tree_lock:
+                total, count = child.total, child.count
+                child.total = 0.0
+                child.count = 0
+            if count > 0:
                 total_ms = total * 1000
                 avg_ms = (total / (count / intervals)) * 1000
-                print(f"{total_ms/intervals:8.2f}ms — {name}: {total_ms/intervals:.3f}ms total over {count/intervals} calls (avg {avg_ms/intervals:.3f}ms)")
-
-            _profile_accumulators.clear()
-            print("\\\\\\\\\\\\\\\\==== Report End   ====////////")
+                line = (f"{indent}{total_ms/intervals:8.2f}ms — {name}: {total_ms/intervals:.3f}ms total over "
+                        f"{count/intervals} calls (avg {avg_ms/intervals:.3f}ms)")
+                percentiles = child.frame_percentiles()
+                if percentiles is not None:
+                    line += (f" | per frame p50 {percentiles['p50']*1000:.3f}ms p95 {percentiles['p95']*1000:.3f}ms"
+                             f" p99 {percentiles['p99']*1000:.3f}ms max {percentiles['max']*1000:.3f}ms")
+                print(line)
+            Profiler._report_children(child, intervals, depth + 1)
 
     @staticmethod
     def timed(name=""):
         def wrapper(fn):
+            label = name or fn.__name__
+
             def inner(*args, **kwargs):
-                if enabled_profiler:
-                    label = name or fn.__name__
-                    start = time.perf_counter()
-                    result = fn(*args, **kwargs)
-                    elapsed = time.perf_counter() - start
-                    if label not in _profile_accumulators:
-                        _profile_accumulators[label] = [0.0, 0, None]
-                    _profile_accumulators[label][0] += elapsed
-                    _profile_accumulators[label][1] += 1
-                    return result
-                else:
+                if not enabled_profiler:
+                    return fn(*args, **kwargs)
+                _begin(label)
+                try:
                     return fn(*args, **kwargs)
+                finally:
+                    _end(label)
             return inner
         return wrapper
 
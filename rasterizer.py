@@ -0,0 +1,466 @@
+# rasterizer.py
+# Rasterizers turn the FrameFaces produced by pipeline.face_setup into pixels.
+# Both share the same begin_frame / draw / end_frame interface so they can be swapped
+# at runtime and benchmarked against each other.
+
+import os
+import time
+import numpy as np
+import pygame
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from numpy.typing import NDArray
+from pipeline import FrameFaces
+from profiler import Profiler
+from texture import Texture, sample_lod, lod_from_footprint
+
+# Triangles with a bounding box bigger than this get split into several tiles of this size
+MAX_TILE = 128
+# Upper bound on the number of pixels evaluated in one bulk pass, keeps the temporaries small
+FRAGMENT_BUDGET = 1 << 20
+# Size of the screen tiles the TiledRasterizer hands out to its workers
+SCREEN_TILE = 128
+
+
+class RasterStats:
+    """Running totals of what a rasterizer did, for throughput numbers. Call reset() to start over."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.draws = 0
+        self.triangles = 0
+        self.fragments = 0  # covered pixels before the depth test, overdraw included
+        self.pixels = 0  # pixels actually written (and shaded)
+        self.seconds = 0.0  # time spent in draw()
+
+    def add(self, triangles: int, fragments: int, pixels: int, seconds: float):
+        self.draws += 1
+        self.triangles += triangles
+        self.fragments += fragments
+        self.pixels += pixels
+        self.seconds += seconds
+
+    def pixels_per_second(self) -> float:
+        return self.pixels / self.seconds if self.seconds > 0 else 0.0
+
+    def fragments_per_second(self) -> float:
+        return self.fragments / self.seconds if self.seconds > 0 else 0.0
+
+    def triangles_per_second(self) -> float:
+        return self.triangles / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.triangles_per_second() / 1e6:.3f}M triangles/s, {self.fragments_per_second() / 1e6:.2f}M fragments/s, "
+                f"{self.pixels_per_second() / 1e6:.2f}M pixels/s")
+
+
+class TextureShader:
+    """
+    Per-pixel texturing for the z-buffer rasterizers.
+
+    uvs are interpolated perspective-correctly (u/z and v/z are linear in screen space, like 1/z),
+    every triangle samples from one mip level picked from its uv and screen area, and the texel
+    is lit with the face's light. Only pixels that passed the depth test are ever shaded.
+    """
+    def __init__(self, texture: Texture, uv_over_z: np.ndarray, lod: np.ndarray, light: np.ndarray,
+                 filter: str = "bilinear"):
+        self.texture = texture
+        self.uv_over_z = uv_over_z  # (K, 3, 2) corner uvs divided by the corner's camera z
+        self.lod = lod  # (K,) mip level of each triangle
+        self.light = light  # (K,)
+        self.filter = filter
+
+    @staticmethod
+    def from_frame(frame: FrameFaces, filter: str = "bilinear") -> "TextureShader":
+        uvs = frame.uvs
+        e1, e2 = uvs[:, 1] - uvs[:, 0], uvs[:, 2] - uvs[:, 0]
+        uv_area = 0.5 * (e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0])
+        s1, s2 = frame.screen[:, 1] - frame.screen[:, 0], frame.screen[:, 2] - frame.screen[:, 0]
+        pixel_area = 0.5 * (s1[:, 0] * s2[:, 1] - s1[:, 1] * s2[:, 0])
+        lod = lod_from_footprint(frame.texture, uv_area, pixel_area)
+        return TextureShader(frame.texture, uvs / frame.depth[..., None], lod, frame.light, filter)
+
+    def subset(self, tri: np.ndarray) -> "TextureShader":
+        """The shader for a subset of the triangles, e.g. the ones binned into one screen tile."""
+        return TextureShader(self.texture, self.uv_over_z[tri], self.lod[tri], self.light[tri], self.filter)
+
+    def shade(self, t: np.ndarray, b0: np.ndarray, b1: np.ndarray, b2: np.ndarray, frag_inv_z: np.ndarray
+              ) -> NDArray[np.uint8]:
+        """Colors of fragments of triangles t with screen space barycentrics b0, b1, b2 and interpolated 1/z."""
+        uv_over_z = np.take(self.uv_over_z, t, axis=0)
+        uv = (b0[:, None] * uv_over_z[:, 0] + b1[:, None] * uv_over_z[:, 1] + b2[:, None] * uv_over_z[:, 2])
+        uv /= frag_inv_z[:, None]
+        texel = sample_lod(self.texture, uv, np.take(self.lod, t), self.filter)
+        texel *= (255 * np.take(self.light, t)).astype(np.float32)[:, None]
+        return np.minimum(texel, 255).astype(np.uint8)
+
+
+class PainterRasterizer:
+    """
+    The original path: draws the back-to-front sorted faces one pygame.draw.polygon call at a time.
+    Wrong for intersecting geometry and slow for big meshes, but simple.
+    """
+    def __init__(self):
+        self.surface: pygame.Surface | None = None
+        self.stats = RasterStats()  # pygame doesn't tell how many pixels it filled, only triangles are counted
+
+    def begin_frame(self, surface: pygame.Surface, background=None):
+        self.surface = surface
+        if background is not None:
+            surface.fill(background)
+
+    def draw(self, frame: FrameFaces):
+        start = time.perf_counter()
+        for tri, color in zip(frame.screen.astype(np.int64).tolist(), frame.colors.tolist()):
+            pygame.draw.polygon(self.surface, color, tri)
+        self.stats.add(len(frame), 0, 0, time.perf_counter() - start)
+
+    def end_frame(self):
+        pass
+
+
+class ZBufferRasterizer:
+    """
+    Rasterizes into a NumPy color buffer plus a depth buffer and blits the result once per frame.
+
+    Triangles are split into bounding-box tiles and the barycentric edge functions for every pixel
+    of many tiles are evaluated in one go. The depth buffer stores 1/z (0 is infinitely far away)
+    since 1/z interpolates linearly in screen space.
+
+    With textured=True faces that come with uvs and a texture are textured per pixel (see TextureShader)
+    instead of drawn in their flat face color, texture_filter is "bilinear" or "trilinear".
+    """
+    def __init__(self, width: int = 0, height: int = 0, textured: bool = False, texture_filter: str = "bilinear"):
+        self.color: NDArray[np.uint8]  # (H, W, 3)
+        self.depth: NDArray[np.float32]  # (H, W) 1/z, 0 means empty
+        self.surface: pygame.Surface | None = None
+        self.textured = textured
+        self.texture_filter = texture_filter
+        self.stats = RasterStats()
+        self._allocate(width, height)
+
+    def _allocate(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.color = np.zeros((height, width, 3), dtype=np.uint8)
+        self.depth = np.zeros((height, width), dtype=np.float32)
+
+    def clear(self, background=(0, 0, 0)):
+        self.color[:] = background
+        self.depth[:] = 0
+
+    def begin_frame(self, surface: pygame.Surface | None = None, background=(0, 0, 0), size: tuple[int, int] | None = None):
+        """Start a new frame. Pass a surface to blit to in end_frame(), or just a size to render offscreen."""
+        self.surface = surface
+        if surface is not None:
+            size = surface.get_size()
+        if size is not None and size != (self.width, self.height):
+            self._allocate(*size)
+        self.clear(background)
+
+    def _shader(self, frame: FrameFaces) -> TextureShader | None:
+        if self.textured and frame.uvs is not None and frame.texture is not None and len(frame) > 0:
+            return TextureShader.from_frame(frame, self.texture_filter)
+        return None
+
+    def draw(self, frame: FrameFaces):
+        start = time.perf_counter()
+        fragments, pixels = rasterize_region(self.color, self.depth, 0, 0, frame.screen, frame.depth, frame.colors,
+                                             self._shader(frame))
+        self.stats.add(len(frame), fragments, pixels, time.perf_counter() - start)
+
+    def end_frame(self):
+        if self.surface is not None:
+            # surfarray uses (W, H) order
+            pygame.surfarray.blit_array(self.surface, self.color.swapaxes(0, 1))
+
+
+def _next_pow2(x: np.ndarray) -> np.ndarray:
+    return (1 << np.ceil(np.log2(np.maximum(x, 1))).astype(np.int64)).astype(np.int64)
+
+
+def bounding_tiles(screen: np.ndarray, x0: int, y0: int, x1: int, y1: int, tile: int = MAX_TILE):
+    """
+    Split the pixel bounding box of every triangle, clipped to [x0, x1) x [y0, y1), into tiles
+    of at most tile x tile pixels.
+
+    Returns (tri, tx0, ty0, tx1, ty1): the triangle of each tile and its inclusive pixel bounds.
+    """
+    # A pixel is covered when its center (i + 0.5) is inside, so only these can ever be hit
+    bx0 = np.maximum(np.ceil(screen[..., 0].min(axis=1) - 0.5), x0)
+    by0 = np.maximum(np.ceil(screen[..., 1].min(axis=1) - 0.5), y0)
+    bx1 = np.minimum(np.floor(screen[..., 0].max(axis=1) - 0.5), x1 - 1)
+    by1 = np.minimum(np.floor(screen[..., 1].max(axis=1) - 0.5), y1 - 1)
+    keep = (bx1 >= bx0) & (by1 >= by0)
+    tri = np.flatnonzero(keep)
+    bx0, by0 = bx0[keep].astype(np.int64), by0[keep].astype(np.int64)
+    bx1, by1 = bx1[keep].astype(np.int64), by1[keep].astype(np.int64)
+
+    # Number of tiles along each axis, most triangles are smaller than a tile and get exactly one
+    nx = (bx1 - bx0) // tile + 1
+    ny = (by1 - by0) // tile + 1
+    count = nx * ny
+    item_tri = np.repeat(np.arange(len(tri)), count)
+    local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    tx0 = bx0[item_tri] + (local % nx[item_tri]) * tile
+    ty0 = by0[item_tri] + (local // nx[item_tri]) * tile
+    tx1 = np.minimum(tx0 + tile - 1, bx1[item_tri])
+    ty1 = np.minimum(ty0 + tile - 1, by1[item_tri])
+    return tri[item_tri], tx0, ty0, tx1, ty1
+
+
+def rasterize_region(color: np.ndarray, depth: np.ndarray, x0: int, y0: int,
+                     screen: np.ndarray, vertex_z: np.ndarray, face_colors: np.ndarray,
+                     shader: TextureShader | None = None) -> tuple[int, int]:
+    """
+    Z-buffer rasterize triangles into a region of the framebuffer.
+
+    Args:
+        color: (h, w, 3) uint8 view of the region's color buffer
+        depth: (h, w) view of the region's 1/z depth buffer
+        x0, y0: screen position of the region's top-left pixel
+        screen: (K, 3, 2) pixel coordinates of each triangle corner in full-screen space
+        vertex_z: (K, 3) camera space z of each corner, must be > 0
+        face_colors: (K, 3) flat color of each triangle
+        shader: optional TextureShader for the same K triangles, shades the pixels instead of face_colors
+
+    Returns:
+        (fragments, pixels): how many covered pixels were evaluated and how many were written
+    """
+    if len(screen) == 0:
+        return 0, 0
+    h, w = depth.shape
+    tri, tx0, ty0, tx1, ty1 = bounding_tiles(screen, x0, y0, x0 + w, y0 + h)
+    if len(tri) == 0:
+        return 0, 0
+
+    inv_z = 1.0 / vertex_z
+
+    # Group tiles by power of two size so every group can be evaluated on one (n, S, S) grid
+    size = _next_pow2(np.maximum(tx1 - tx0, ty1 - ty0) + 1)
+    fragments = pixels = 0
+    for S in np.unique(size):
+        group = np.flatnonzero(size == S)
+        per_pass = max(1, FRAGMENT_BUDGET // (S * S))
+        for start in range(0, len(group), per_pass):
+            items = group[start:start + per_pass]
+            counts = _rasterize_tiles(color, depth, x0, y0, int(S),
+                                      tri[items], tx0[items], ty0[items], tx1[items], ty1[items],
+                                      screen, inv_z, face_colors, shader)
+            fragments += counts[0]
+            pixels += counts[1]
+    return fragments, pixels
+
+
+def _rasterize_tiles(color, depth, x0, y0, S, tri, tx0, ty0, tx1, ty1, screen, inv_z, face_colors, shader):
+    """Evaluate the edge functions of a batch of S x S tiles at once, depth test and shade the result."""
+    offsets = np.arange(S)
+    px = tx0[:, None, None] + offsets[None, None, :]  # (n, 1, S)
+    py = ty0[:, None, None] + offsets[None, :, None]  # (n, S, 1)
+    in_tile = (px <= tx1[:, None, None]) & (py <= ty1[:, None, None])  # (n, S, S)
+
+    v = screen[tri]  # (n, 3, 2)
+    cx = px + 0.5
+    cy = py + 0.5
+    x_0, y_0 = v[:, 0, 0, None, None], v[:, 0, 1, None, None]
+    x_1, y_1 = v[:, 1, 0, None, None], v[:, 1, 1, None, None]
+    x_2, y_2 = v[:, 2, 0, None, None], v[:, 2, 1, None, None]
+
+    # Edge functions, each one is the signed double area of the sub triangle opposite a corner
+    w0 = (x_2 - x_1) * (cy - y_1) - (y_2 - y_1) * (cx - x_1)
+    w1 = (x_0 - x_2) * (cy - y_2) - (y_0 - y_2) * (cx - x_2)
+    w2 = (x_1 - x_0) * (cy - y_0) - (y_1 - y_0) * (cx - x_0)
+    area = (w0 + w1 + w2)[:, :1, :1]
+
+    # Accept both windings, inside means every edge function has the sign of the area
+    sign = np.sign(area)
+    inside = in_tile & (w0 * sign >= 0) & (w1 * sign >= 0) & (w2 * sign >= 0) & (area != 0)
+
+    # Flat indices into the (n, S, S) grids gather a lot quicker than (k, iy, ix) triples
+    flat = np.flatnonzero(inside)
+    if len(flat) == 0:
+        return 0, 0
+    k, pixel = np.divmod(flat, S * S)
+    iy, ix = np.divmod(pixel, S)
+    a = area.reshape(-1)[k]
+    b0 = w0.reshape(-1)[flat] / a
+    b1 = w1.reshape(-1)[flat] / a
+    b2 = 1.0 - b0 - b1
+    t = tri[k]
+    frag_inv_z = b0 * inv_z[t, 0] + b1 * inv_z[t, 1] + b2 * inv_z[t, 2]
+    row = ty0[k] + iy - y0
+    col = tx0[k] + ix - x0
+
+    # Visibility first, so only the fragments that end up on screen get shaded
+    kept = _resolve(depth, row, col, frag_inv_z)
+    row, col = row[kept], col[kept]
+    if shader is None:
+        color[row, col] = face_colors[t[kept]]
+    else:
+        color[row, col] = shader.shade(t[kept], b0[kept], b1[kept], b2[kept], frag_inv_z[kept])
+    return len(k), len(kept)
+
+
+def _resolve(depth, row, col, frag_inv_z) -> NDArray[np.int64]:
+    """
+    Keep the nearest fragment per pixel, write its depth if it passes the depth test and return
+    the indices of the fragments that did.
+    depth may be a non-contiguous view (a screen tile), so it is indexed by row/col.
+    """
+    pixel = row * depth.shape[1] + col
+    order = np.lexsort((-frag_inv_z, pixel))
+    pixel_sorted = pixel[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pixel_sorted[1:] != pixel_sorted[:-1]
+    nearest = order[first]
+
+    passed = nearest[frag_inv_z[nearest] > depth[row[nearest], col[nearest]]]
+    depth[row[passed], col[passed]] = frag_inv_z[passed]
+    return passed
+
+
+def bin_triangles(screen: np.ndarray, width: int, height: int, tile: int = SCREEN_TILE
+                  ) -> list[tuple[int, int, NDArray[np.int64]]]:
+    """
+    Assign every triangle to the screen tiles its bounding box overlaps.
+
+    Returns a list of (x0, y0, triangle_indices) for every tile that has at least one triangle,
+    triangle indices keep their original (draw) order.
+    """
+    if len(screen) == 0:
+        return []
+    tiles_x = (width + tile - 1) // tile
+    tiles_y = (height + tile - 1) // tile
+    tx0 = np.clip(np.floor(screen[..., 0].min(axis=1)) // tile, 0, tiles_x - 1).astype(np.int64)
+    ty0 = np.clip(np.floor(screen[..., 1].min(axis=1)) // tile, 0, tiles_y - 1).astype(np.int64)
+    tx1 = np.clip(np.floor(screen[..., 0].max(axis=1)) // tile, 0, tiles_x - 1).astype(np.int64)
+    ty1 = np.clip(np.floor(screen[..., 1].max(axis=1)) // tile, 0, tiles_y - 1).astype(np.int64)
+
+    # Drop triangles that are entirely off screen
+    on_screen = ((screen[..., 0].max(axis=1) >= 0) & (screen[..., 0].min(axis=1) < width) &
+                 (screen[..., 1].max(axis=1) >= 0) & (screen[..., 1].min(axis=1) < height))
+    tri = np.flatnonzero(on_screen)
+    tx0, ty0, tx1, ty1 = tx0[tri], ty0[tri], tx1[tri], ty1[tri]
+
+    # Expand every triangle into one (tile, triangle) pair per overlapped tile
+    nx = tx1 - tx0 + 1
+    ny = ty1 - ty0 + 1
+    count = nx * ny
+    pair_tri = np.repeat(np.arange(len(tri)), count)
+    local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    tile_x = tx0[pair_tri] + local % nx[pair_tri]
+    tile_y = ty0[pair_tri] + local // nx[pair_tri]
+    tile_id = tile_y * tiles_x + tile_x
+
+    order = np.argsort(tile_id, kind="stable")
+    tile_id = tile_id[order]
+    pair_tri = tri[pair_tri[order]]
+    ids, starts = np.unique(tile_id, return_index=True)
+    return [(int(i % tiles_x) * tile, int(i // tiles_x) * tile, chunk)
+            for i, chunk in zip(ids, np.split(pair_tri, starts[1:]))]
+
+
+# Shared memory blocks a process pool worker has already attached to, by name
+_attached_buffers: dict[str, shared_memory.SharedMemory] = {}
+
+
+def _attach(name: str, keep: tuple[str, ...] = ()) -> shared_memory.SharedMemory:
+    if name not in _attached_buffers:
+        # The rasterizer reallocated (resize), let go of the buffers it no longer uses
+        for old in [n for n in _attached_buffers if n not in keep]:
+            _attached_buffers.pop(old).close()
+        _attached_buffers[name] = shared_memory.SharedMemory(name=name)
+    return _attached_buffers[name]
+
+
+def _rasterize_tile(*args):
+    """Thread pool entry point, the scope shows every worker thread's tiles in a trace."""
+    with Profiler.scope("tile"):
+        return rasterize_region(*args)
+
+
+def _rasterize_shared_tile(color_name, depth_name, width, height, x0, y0, x1, y1, screen, vertex_z, face_colors,
+                           shader=None):
+    """Process pool entry point: rasterize one tile straight into the shared framebuffer."""
+    keep = (color_name, depth_name)
+    color = np.ndarray((height, width, 3), dtype=np.uint8, buffer=_attach(color_name, keep).buf)
+    depth = np.ndarray((height, width), dtype=np.float32, buffer=_attach(depth_name, keep).buf)
+    return rasterize_region(color[y0:y1, x0:x1], depth[y0:y1, x0:x1], x0, y0, screen, vertex_z, face_colors, shader)
+
+
+class TiledRasterizer(ZBufferRasterizer):
+    """
+    Z-buffer rasterizer that bins triangles into screen tiles and rasterizes the tiles in parallel.
+
+    Every tile only writes its own slice of the framebuffer so no locking is needed.
+    The default backend is a thread pool, most of the work happens inside NumPy which releases
+    the GIL on big arrays. backend="process" uses a process pool writing into a framebuffer in
+    shared memory instead, for when the GIL turns out to be the bottleneck. Call close() when done
+    with a process backed rasterizer so the shared memory gets released.
+    Textured drawing works with both backends, but the process backend pickles the texture for
+    every tile, so it's really only worth it for flat shading.
+    """
+    def __init__(self, width: int = 0, height: int = 0, workers: int | None = None,
+                 tile: int = SCREEN_TILE, backend: str = "thread", textured: bool = False,
+                 texture_filter: str = "bilinear"):
+        if backend not in ("thread", "process"):
+            raise ValueError("backend must be 'thread' or 'process'")
+        self.backend = backend
+        self.tile = tile
+        self.workers = workers or os.cpu_count() or 1
+        self._shared: list[shared_memory.SharedMemory] = []
+        if backend == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        super().__init__(width, height, textured, texture_filter)
+
+    def _allocate(self, width: int, height: int):
+        if self.backend == "thread":
+            return super()._allocate(width, height)
+        self._release_shared()
+        self.width = width
+        self.height = height
+        color_shm = shared_memory.SharedMemory(create=True, size=max(1, height * width * 3))
+        depth_shm = shared_memory.SharedMemory(create=True, size=max(1, height * width * 4))
+        self._shared = [color_shm, depth_shm]
+        self.color = np.ndarray((height, width, 3), dtype=np.uint8, buffer=color_shm.buf)
+        self.depth = np.ndarray((height, width), dtype=np.float32, buffer=depth_shm.buf)
+
+    def _release_shared(self):
+        # Drop our views before closing, the buffers can't be released while they are exported
+        self.color = np.zeros((0, 0, 3), dtype=np.uint8)
+        self.depth = np.zeros((0, 0), dtype=np.float32)
+        for shm in self._shared:
+            shm.close()
+            shm.unlink()
+        self._shared = []
+
+    def draw(self, frame: FrameFaces):
+        start = time.perf_counter()
+        shader = self._shader(frame)
+        bins = bin_triangles(frame.screen, self.width, self.height, self.tile)
+        futures = []
+        for x0, y0, tri in bins:
+            x1 = min(x0 + self.tile, self.width)
+            y1 = min(y0 + self.tile, self.height)
+            args = (frame.screen[tri], frame.depth[tri], frame.colors[tri], shader.subset(tri) if shader else None)
+            if self.backend == "thread":
+                futures.append(self._pool.submit(_rasterize_tile, self.color[y0:y1, x0:x1],
+                                                 self.depth[y0:y1, x0:x1], x0, y0, *args))
+            else:
+                futures.append(self._pool.submit(_rasterize_shared_tile, self._shared[0].name, self._shared[1].name,
+                                                 self.width, self.height, x0, y0, x1, y1, *args))
+        # Wait for this draw to finish so the next one can't race it on the same tiles
+        fragments = pixels = 0
+        for future in futures:
+            counts = future.result()
+            fragments += counts[0]
+            pixels += counts[1]
+        self.stats.add(len(frame), fragments, pixels, time.perf_counter() - start)
+
+    def close(self):
+        self._pool.shutdown()
+        if self.backend == "process":
+            self._release_shared()
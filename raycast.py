@@ -0,0 +1,140 @@
+# raycast.py
+# Ray / triangle queries for picking. Möller–Trumbore over whole arrays of (ray, triangle) pairs,
+# the pairs come from a BVH (see bvh.BVH.ray_candidates) or are simply every triangle for every ray.
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Rays closer to parallel with a triangle than this count as a miss, hits closer than this are ignored
+EPSILON = 1e-9
+# Upper bound of (ray, triangle) pairs tested at once without a BVH, keeps the temporaries small
+MAX_PAIRS = 1 << 20
+
+
+class RayHits:
+    """
+    Nearest hit of every ray in a batch. Rays that missed have hit False, t inf and face_index -1.
+
+    t is measured in units of the ray direction, so with normalized directions it's the distance.
+    barycentric are the weights of the face's 3 corners at the hit point.
+    """
+    def __init__(self, count: int):
+        self.hit: NDArray[np.bool_]  # (R,)
+        self.hit = np.zeros(count, dtype=bool)
+
+        self.t: NDArray[np.float64]  # (R,)
+        self.t = np.full(count, np.inf)
+
+        self.face_index: NDArray[np.int64]  # (R,)
+        self.face_index = np.full(count, -1, dtype=np.int64)
+
+        self.barycentric: NDArray[np.float64]  # (R, 3)
+        self.barycentric = np.zeros((count, 3))
+
+    def __len__(self):
+        return len(self.t)
+
+    def points(self, origins: np.ndarray, directions: np.ndarray) -> NDArray[np.float64]:
+        """(R, 3) hit positions along the given rays, inf for misses."""
+        with np.errstate(invalid="ignore"):
+            return np.asarray(origins) + self.t[:, None] * np.asarray(directions)
+
+
+def triangle_edges(vertices: np.ndarray, faces: np.ndarray) -> tuple[NDArray[np.float64], ...]:
+    """(corner0, edge1, edge2), each (M, 3): the per-triangle data Möller–Trumbore needs, worth caching."""
+    tri = np.asarray(vertices, dtype=np.float64)[np.asarray(faces)]
+    return tri[:, 0].copy(), tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0]
+
+
+def intersect(origins: np.ndarray, directions: np.ndarray, corner0: np.ndarray, edge1: np.ndarray,
+              edge2: np.ndarray) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Möller–Trumbore for (P,) pairs of rays and triangles at once, all arguments are (P, 3).
+    Triangles are hit from both sides. Returns t, u, v with t = inf where the pair misses.
+    """
+    p = np.cross(directions, edge2)
+    det = np.einsum("ij,ij->i", edge1, p)
+    parallel = np.abs(det) < EPSILON
+    inv_det = 1.0 / np.where(parallel, 1.0, det)
+    s = origins - corner0
+    u = np.einsum("ij,ij->i", s, p) * inv_det
+    q = np.cross(s, edge1)
+    v = np.einsum("ij,ij->i", directions, q) * inv_det
+    t = np.einsum("ij,ij->i", edge2, q) * inv_det
+    hit = ~parallel & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > EPSILON)
+    return np.where(hit, t, np.inf), u, v
+
+
+def keep_nearest(hits: RayHits, ray_index: np.ndarray, face_index: np.ndarray,
+                 t: np.ndarray, u: np.ndarray, v: np.ndarray):
+    """
+    Merge (ray, face) candidate pairs into hits. For every ray the pair with the smallest t
+    replaces what hits has for it if it is closer, so hits can be filled from several meshes
+    or batches in any order. Pairs with an infinite t (misses) are ignored.
+
+    ray_index indexes the rows of hits, face_index is stored as is, u and v are the
+    barycentric weights of the second and third corner. All arrays are (P,).
+    """
+    found = np.isfinite(t)
+    ray_index, face_index, t, u, v = ray_index[found], face_index[found], t[found], u[found], v[found]
+    if len(t) == 0:
+        return
+    order = np.lexsort((t, ray_index))
+    rays, first = np.unique(ray_index[order], return_index=True)
+    nearest = order[first]
+    closer = t[nearest] < hits.t[rays]
+    rays, nearest = rays[closer], nearest[closer]
+    hits.hit[rays] = True
+    hits.t[rays] = t[nearest]
+    hits.face_index[rays] = face_index[nearest]
+    hits.barycentric[rays] = np.stack([1 - u[nearest] - v[nearest], u[nearest], v[nearest]], axis=1)
+
+
+def raycast_triangles(origins: np.ndarray, directions: np.ndarray, edges: tuple[np.ndarray, ...],
+                      bvh=None) -> RayHits:
+    """
+    Nearest hit of every (R, 3) ray against a mesh's triangle_edges(), both in the same space.
+    With a BVH only the triangles in leaves a ray passes through are tested, without one every
+    triangle is tested against every ray, MAX_PAIRS at a time.
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    corner0, edge1, edge2 = edges
+    hits = RayHits(len(origins))
+    triangles = len(corner0)
+    if triangles == 0 or len(origins) == 0:
+        return hits
+
+    if bvh is not None:
+        ray_index, face_index = bvh.ray_candidates(origins, directions)
+        t, u, v = intersect(origins[ray_index], directions[ray_index],
+                            corner0[face_index], edge1[face_index], edge2[face_index])
+        keep_nearest(hits, ray_index, face_index, t, u, v)
+        return hits
+
+    rays_per_chunk = max(1, MAX_PAIRS // triangles)
+    for start in range(0, len(origins), rays_per_chunk):
+        rays = np.arange(start, min(start + rays_per_chunk, len(origins)))
+        ray_index = np.repeat(rays, triangles)
+        face_index = np.tile(np.arange(triangles), len(rays))
+        t, u, v = intersect(origins[ray_index], directions[ray_index],
+                            corner0[face_index], edge1[face_index], edge2[face_index])
+        keep_nearest(hits, ray_index, face_index, t, u, v)
+    return hits
+
+
+def pick(objects: list, ray: tuple[np.ndarray, np.ndarray]):
+    """
+    The nearest hit of a single (origin, direction) ray, e.g. Camera.screen_ray(), over a list of
+    RenderableObjects and InstancedObjects: (object, t, face_index, barycentric), or None if the ray
+    hits nothing. For an InstancedObject face_index also tells the copy, see InstancedObject.raycast().
+    Objects that can't be ray cast are skipped.
+    """
+    best = None
+    for obj in objects:
+        if not hasattr(obj, "raycast"):
+            continue
+        hit = obj.raycast(ray)
+        if hit is not None and (best is None or hit[0] < best[1]):
+            best = (obj, *hit)
+    return best
@@ -2,7 +2,19 @@
 
 import numpy as np
 from numpy.typing import NDArray
-from texture import Texture
+from texture import Texture, sample
+from transform import Transform
+from pipeline import face_normals
+from obj_loader import parse_obj
+from bvh import BVH
+import lod
+from mesh_optimize import optimize_mesh, OptimizeStats, WELD_EPSILON
+from raycast import RayHits, triangle_edges, raycast_triangles
+import mesh_cache
+
+
+# Cached entries that have to be rebuilt when the transform changes
+_TRANSFORM_DEPENDENT = ("world_vertices", "face_normals", "bounding_sphere", "aabb")
 
 
 class RenderableObject:
@@ -14,36 +26,49 @@ class RenderableObject:
     Modifications are allowed though for ease of access, such as the transform variable.
     This is because it pertains to the object. But be aware that reusing this instance will have the effects
     apply to all other duplicates of this object as well.
+
+    Per-face data that doesn't depend on the view (base colors, world space face normals,
+    world space vertices and the bounding sphere / AABB) is computed once and cached. The cache is dropped whenever vertices,
+    faces, uv data or texture are reassigned. Reassigning the transform, or modifying it in place, only drops
+    the world space entries.
+    If you write into one of the arrays directly call invalidate_cache() yourself.
     """
-    def __init__(self, vertices: np.ndarray, faces: np.ndarray, normalize=True, name="UnnamedObject", uv_faces=[], texcoords=[], normals=[], normal_faces=[], texture_obj=None):
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray, normalize=True, name="UnnamedObject", uv_faces=[], texcoords=[], normals=[], normal_faces=[], texture_obj=None, transform=None, clean=True, copy=True):
+        self._cache = {}
+        self._cache_transform_version = None
+
+        # copy=False keeps arrays that already have the right dtype as they are, e.g. memory maps from the mesh cache
+        as_array = np.array if copy else np.asarray
+
         self.vertices: NDArray[np.float64]  # (N, 3) float64
-        self.vertices = np.array(vertices, dtype=np.float64)
+        self.vertices = as_array(vertices, dtype=np.float64)
 
         self.faces: NDArray[np.int32]  # (M, 3) int32
-        self.faces = np.array(faces, dtype=np.int32)
+        self.faces = as_array(faces, dtype=np.int32)
         
         self.uv_faces: NDArray[np.int32]  # (M, 3) int32
-        self.uv_faces = np.array(uv_faces, dtype=np.int32)
+        self.uv_faces = as_array(uv_faces, dtype=np.int32)
 
         self.uv_coords: NDArray[np.float64]  # (K, 2) float64
-        self.uv_coords = np.array(texcoords, dtype=np.float64)
+        self.uv_coords = as_array(texcoords, dtype=np.float64)
         
         self.normals: NDArray[np.float64]  # (N, 3) float64
-        self.normals = np.array(normals, dtype=np.float64)
+        self.normals = as_array(normals, dtype=np.float64)
         
         self.normal_faces: NDArray[np.int32]  # (M, 3) int32
-        self.normal_faces = np.array(normal_faces, dtype=np.int32)
-        
-        self.uv_coords: NDArray[np.float64]  # (K, 2) float64
-        self.uv_coords = np.array(texcoords, dtype=np.float64)
+        self.normal_faces = as_array(normal_faces, dtype=np.int32)
         
         self.texture: Texture | None
         self.texture = texture_obj
 
+        self.transform: Transform
+        self.transform = transform if transform is not None else Transform()
+
         self.name = name
         
         self.__has_warned_degenerate_triangles = False
-        self.remove_degenerate_triangles()
+        if clean:
+            self.remove_degenerate_triangles()
 
         if normalize:
             # At startup we conver the verticies to values between -1 and 1.
@@ -53,6 +78,248 @@ class RenderableObject:
         
         
     
+    # Reassigning any of these drops the cached per-face data
+    @property
+    def vertices(self) -> NDArray[np.float64]:
+        return self._vertices
+
+    @vertices.setter
+    def vertices(self, value):
+        self._vertices = value
+        self.invalidate_cache()
+
+    @property
+    def faces(self) -> NDArray[np.int32]:
+        return self._faces
+
+    @faces.setter
+    def faces(self, value):
+        self._faces = value
+        self.invalidate_cache()
+
+    @property
+    def uv_faces(self) -> NDArray[np.int32]:
+        return self._uv_faces
+
+    @uv_faces.setter
+    def uv_faces(self, value):
+        self._uv_faces = value
+        self.invalidate_cache()
+
+    @property
+    def uv_coords(self) -> NDArray[np.float64]:
+        return self._uv_coords
+
+    @uv_coords.setter
+    def uv_coords(self, value):
+        self._uv_coords = value
+        self.invalidate_cache()
+
+    @property
+    def texture(self) -> Texture | None:
+        return self._texture
+
+    @texture.setter
+    def texture(self, value):
+        self._texture = value
+        self.invalidate_cache()
+
+    @property
+    def transform(self) -> Transform:
+        return self._transform
+
+    @transform.setter
+    def transform(self, value):
+        # Only what depends on the transform goes, local space data (BVH, levels of detail, colors) stays
+        self._transform = value
+        self._cache_transform_version = None
+
+    def invalidate_cache(self):
+        """Drop all cached per-face data, it will be rebuilt on next access."""
+        self._cache.clear()
+
+    def _transform_cache(self) -> dict:
+        """The cache, minus anything derived from an outdated transform."""
+        if self._cache_transform_version != self._transform.version:
+            for key in _TRANSFORM_DEPENDENT:
+                self._cache.pop(key, None)
+            self._cache_transform_version = self._transform.version
+        return self._cache
+
+    def get_world_vertices(self) -> NDArray[np.float64]:
+        """(N, 3) vertices with the transform applied."""
+        cache = self._transform_cache()
+        if "world_vertices" not in cache:
+            matrix = self._transform.get_matrix()
+            if np.array_equal(matrix, np.eye(4)):
+                cache["world_vertices"] = self._vertices
+            else:
+                cache["world_vertices"] = self._vertices @ matrix[:3, :3].T + matrix[:3, 3]
+        return cache["world_vertices"]
+
+    def get_local_bounds(self) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64], float]:
+        """
+        (aabb_min, aabb_max, sphere_center, sphere_radius) of the vertices before the transform.
+        The sphere is centered on the AABB, which is close enough for culling and a lot cheaper.
+        """
+        if "local_bounds" not in self._cache:
+            if len(self._vertices) == 0:
+                low = high = np.zeros(3)
+            else:
+                low, high = self._vertices.min(axis=0), self._vertices.max(axis=0)
+            center = (low + high) / 2
+            radius = float(np.sqrt(((self._vertices - center) ** 2).sum(axis=1).max())) if len(self._vertices) else 0.0
+            self._cache["local_bounds"] = (low, high, center, radius)
+        return self._cache["local_bounds"]
+
+    def get_bounding_sphere(self) -> tuple[NDArray[np.float64], float]:
+        """World space (center, radius) of a sphere containing the object."""
+        cache = self._transform_cache()
+        if "bounding_sphere" not in cache:
+            _, _, center, radius = self.get_local_bounds()
+            matrix = self._transform.get_matrix()
+            # The radius grows with the biggest scale of any axis
+            stretch = np.linalg.norm(matrix[:3, :3], axis=0).max()
+            cache["bounding_sphere"] = (matrix[:3, :3] @ center + matrix[:3, 3], float(radius * stretch))
+        return cache["bounding_sphere"]
+
+    def get_aabb(self) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """World space (min, max) corners of an axis aligned box containing the object."""
+        cache = self._transform_cache()
+        if "aabb" not in cache:
+            low, high, _, _ = self.get_local_bounds()
+            matrix = self._transform.get_matrix()
+            # Box of the transformed box: the center moves, the half extents get the absolute matrix
+            center = matrix[:3, :3] @ ((low + high) / 2) + matrix[:3, 3]
+            extent = np.abs(matrix[:3, :3]) @ ((high - low) / 2)
+            cache["aabb"] = (center - extent, center + extent)
+        return cache["aabb"]
+
+    def get_bvh(self) -> BVH:
+        """BVH over the faces in local space, built on first use. Queries in world space need bvh.transform_planes."""
+        if "bvh" not in self._cache:
+            self._cache["bvh"] = BVH.build(self._vertices, self._faces)
+        return self._cache["bvh"]
+
+    def get_lod_levels(self) -> list[tuple[NDArray[np.int32], NDArray[np.int32]]]:
+        """
+        (faces, uv_faces) of every simplified level of detail, finest first, made on first use (see lod.py).
+        The levels index the same vertices and uv coordinates as the full mesh, which is level 0.
+        """
+        if "lod_levels" not in self._cache:
+            uv_faces = self._uv_faces if len(self._uv_faces) == len(self._faces) else None
+            levels = lod.build_lod_chain(self._vertices, self._faces, uv_faces)
+            self._cache["lod_levels"] = [(faces, uv if uv is not None else np.zeros((0, 3), dtype=np.int32))
+                                         for faces, uv in levels]
+        return self._cache["lod_levels"]
+
+    def get_lod(self, level: int) -> "RenderableObject":
+        """
+        Level of detail level as an object sharing this one's vertices, uvs, texture and transform,
+        so it draws like this object with fewer faces. Level 0 is the object itself.
+        """
+        if level == 0:
+            return self
+        objects = self._cache.setdefault("lod_objects", {})
+        if level not in objects:
+            faces, uv_faces = self.get_lod_levels()[level - 1]
+            objects[level] = RenderableObject(self._vertices, faces, normalize=False, name=f"{self.name} LOD{level}",
+                                              uv_faces=uv_faces, texcoords=self._uv_coords, texture_obj=self._texture,
+                                              transform=self._transform, clean=False, copy=False)
+        level_object = objects[level]
+        # The transform may have been replaced since, e.g. by a scene Node
+        if level_object.transform is not self._transform:
+            level_object.transform = self._transform
+        return level_object
+
+    def lod_for(self, cam, screen_size: tuple[int, int], scale: float = 150) -> "RenderableObject":
+        """
+        The level of detail to draw this frame, from how big the bounding sphere is on screen.
+        Objects whose levels haven't been made (get_lod_levels(), or build_lods when loading) are always drawn whole.
+        """
+        levels = self._cache.get("lod_levels")
+        if not levels:
+            return self
+        center, radius = self.get_bounding_sphere()
+        face_counts = [len(self._faces)] + [len(faces) for faces, _ in levels]
+        return self.get_lod(lod.select_level(face_counts, lod.projected_area(center, radius, cam, scale)))
+
+    def get_triangle_edges(self) -> tuple[NDArray[np.float64], ...]:
+        """Local space (corner0, edge1, edge2) of every face, precomputed for raycasts."""
+        if "triangle_edges" not in self._cache:
+            self._cache["triangle_edges"] = triangle_edges(self._vertices, self._faces)
+        return self._cache["triangle_edges"]
+
+    def raycast_batch(self, origins: np.ndarray, directions: np.ndarray) -> RayHits:
+        """
+        Nearest hit of every one of (R, 3) world space rays at once, see raycast.RayHits.
+        Rays that miss the bounding sphere are skipped, the rest are tested in local space
+        against the BVH leaves they pass through if the BVH was built, or else against every face.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        hits = RayHits(len(origins))
+
+        center, radius = self.get_bounding_sphere()
+        to_center = center - origins
+        lengths = np.einsum("ij,ij->i", directions, directions)
+        along = np.einsum("ij,ij->i", to_center, directions) / np.where(lengths == 0, 1, lengths)
+        closest = to_center - along[:, None] * directions
+        rays = np.flatnonzero(np.einsum("ij,ij->i", closest, closest) <= radius * radius)
+        if len(rays) == 0:
+            return hits
+
+        # t doesn't change when origin and direction go through the same affine transform
+        inverse = np.linalg.inv(self._transform.get_matrix())
+        local_origins = origins[rays] @ inverse[:3, :3].T + inverse[:3, 3]
+        local_directions = directions[rays] @ inverse[:3, :3].T
+        local = raycast_triangles(local_origins, local_directions, self.get_triangle_edges(), self._cache.get("bvh"))
+        hits.hit[rays] = local.hit
+        hits.t[rays] = local.t
+        hits.face_index[rays] = local.face_index
+        hits.barycentric[rays] = local.barycentric
+        return hits
+
+    def raycast(self, ray: tuple[np.ndarray, np.ndarray]) -> tuple[float, int, NDArray[np.float64]] | None:
+        """
+        Nearest hit of a single world space (origin, direction) ray, e.g. Camera.screen_ray():
+        (t, face_index, barycentric) or None if the ray misses.
+        """
+        hits = self.raycast_batch(*ray)
+        if not hits.hit[0]:
+            return None
+        return float(hits.t[0]), int(hits.face_index[0]), hits.barycentric[0]
+
+    def get_face_normals(self) -> NDArray[np.float64]:
+        """(M, 3) normalized world space normal of every face."""
+        cache = self._transform_cache()
+        if "face_normals" not in cache:
+            cache["face_normals"] = face_normals(self.get_world_vertices(), self._faces)
+        return cache["face_normals"]
+
+    def get_face_colors(self) -> NDArray[np.uint8]:
+        """
+        (M, 3) base color of every face, 0-255.
+        Textured objects sample the texture at each face's average uv, everything else is white.
+        """
+        if "face_colors" not in self._cache:
+            if self._texture is not None and len(self._uv_faces) == len(self._faces) and len(self._faces) > 0:
+                average_uv = self._uv_coords[self._uv_faces].mean(axis=1)
+                colors = sample(self._texture, average_uv, as_uint8=True)
+            else:
+                colors = np.full((len(self._faces), 3), 255, dtype=np.uint8)
+            self._cache["face_colors"] = colors
+        return self._cache["face_colors"]
+
+    def get_face_uvs(self) -> NDArray[np.float64] | None:
+        """(M, 3, 2) uv of every face corner, None unless the object is textured and every face has uvs."""
+        if "face_uvs" not in self._cache:
+            uvs = None
+            if self._texture is not None and len(self._uv_faces) == len(self._faces) and len(self._faces) > 0:
+                uvs = np.asarray(self._uv_coords, dtype=np.float64)[self._uv_faces]
+            self._cache["face_uvs"] = uvs
+        return self._cache["face_uvs"]
+
     def remove_degenerate_triangles(self, eps=1e-12):
         """
         Removes degenerate faces (zero/near-zero area) and their correlated
@@ -88,6 +355,20 @@ class RenderableObject:
         if len(self.normal_faces) == len(valid_mask):
             self.normal_faces = self.normal_faces[valid_mask]
 
+    def optimize(self, epsilon: float = WELD_EPSILON) -> OptimizeStats:
+        """
+        Weld vertices closer than epsilon, drop unused vertices and repeated faces, and reorder
+        faces and vertices along a Morton curve for cache friendly gathers (see mesh_optimize.py).
+        Returns the before/after counts and gather timings.
+        """
+        vertices, faces, uv_faces, normal_faces, stats = optimize_mesh(
+            self._vertices, self._faces, self._uv_faces, self.normal_faces, epsilon)
+        self.vertices = vertices
+        self.faces = faces
+        self.uv_faces = uv_faces
+        self.normal_faces = normal_faces
+        return stats
+
     def normalize(self):
         v = np.array(self.vertices)  # Shape: (N, 3)
         min_vals = v.min(axis=0)
@@ -96,8 +377,8 @@ class RenderableObject:
         scale = (max_vals - min_vals).max() / 2
         self.vertices = (v - center) / scale
     
-    def load_texture(self, filepath: str):
-        self.texture = Texture(filepath)
+    def load_texture(self, filepath: str, storage: str = "float32"):
+        self.texture = Texture(filepath, storage=storage)
 
     @staticmethod
     def parse_face(point_arr: list[str], reverse_faces: bool) -> tuple[list[tuple[int,int,int]],
@@ -154,78 +435,98 @@ class RenderableObject:
 
         return faces, uv_faces, normal_faces
 
+    # The arrays that make up the mesh, as stored in the mesh cache
+    MESH_ARRAYS = ("vertices", "faces", "uv_faces", "uv_coords", "normals", "normal_faces")
+
+    def get_arrays(self) -> dict[str, np.ndarray]:
+        """The mesh data arrays by name, plus the BVH and level of detail arrays if they were built."""
+        arrays = {name: getattr(self, name) for name in RenderableObject.MESH_ARRAYS}
+        if "bvh" in self._cache:
+            arrays.update(self._cache["bvh"].to_arrays())
+        if "lod_levels" in self._cache:
+            arrays.update(lod.levels_to_arrays(self._cache["lod_levels"]))
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays: dict[str, np.ndarray], name="UnnamedObject", texture_obj=None) -> "RenderableObject":
+        """
+        Build an object from already cleaned and normalized arrays (see get_arrays()) without copying them.
+        """
+        renderable_object = RenderableObject(
+            arrays["vertices"],
+            arrays["faces"],
+            normalize=False,
+            name=name,
+            uv_faces=arrays["uv_faces"],
+            texcoords=arrays["uv_coords"],
+            normals=arrays["normals"],
+            normal_faces=arrays["normal_faces"],
+            texture_obj=texture_obj,
+            clean=False,
+            copy=False
+        )
+        if BVH.has_arrays(arrays):
+            renderable_object._cache["bvh"] = BVH.from_arrays(arrays)
+        if lod.has_arrays(arrays):
+            renderable_object._cache["lod_levels"] = lod.levels_from_arrays(arrays)
+        return renderable_object
+
+    def save_cache(self, path: str, source_path: str | None = None, params: dict | None = None):
+        """Write the mesh arrays to a binary mesh cache, see mesh_cache.save()."""
+        mesh_cache.save(path, self.get_arrays(), source_path, params)
+
     @staticmethod
-    def load_new_obj(filepath: str, reverse_faces=False, texture_filepath: str|None=None):
+    def load_new_obj(filepath: str, reverse_faces=False, texture_filepath: str|None=None, use_cache=False,
+                     texture_storage: str = "float32", build_bvh=False, build_lods=False, optimize=False):
         """
         Load an OBJ file and optionally reverse triangle winding.
+        The file is parsed in bulk by obj_loader.parse_obj.
 
         Args:
             filepath (str): Path to the OBJ file.
             reverse_faces (bool): If True, reverse the order of vertices in each face.
+            use_cache (bool): If True, the cleaned and normalized mesh is loaded from a binary cache next to
+                the OBJ file (memory mapped). The cache is (re)generated whenever the OBJ file changed.
+            texture_storage (str): "float32" or "uint8", how the texture pixels are kept in memory (see Texture).
+            build_bvh (bool): If True, the BVH (see get_bvh()) is built right away, and stored in the cache too.
+            build_lods (bool): If True, the levels of detail (see get_lod_levels()) are made right away and
+                stored in the cache too. Objects with levels draw a simpler one when they're small on screen.
+            optimize (bool): If True, the mesh is welded, deduplicated and reordered (see optimize()) after
+                loading, and what that did is printed. The cache stores the optimized mesh.
         """
-        vertices = []
-        texcoords = []
-        normals = []
-        triangles = []
-        all_uv_faces = []
-        all_normal_faces = []
-
-        with open(filepath) as file:
-            for line in file:
-                if line.startswith('#') or not line.strip():
-                    continue
-                parts = line.strip().split()
-                if parts[0] == 'v':
-                    vertices.append(tuple(map(float, parts[1:4])))
-                elif parts[0] == 'vt':
-                    texcoords.append(tuple(map(float, parts[1:3])))
-                elif parts[0] == 'vn':
-                    normals.append(tuple(map(float, parts[1:4])))
-                elif parts[0] == 'f':
-                    faces, uv_faces, normal_faces = RenderableObject.parse_face(parts[1:], reverse_faces)
-                    triangles.extend(faces)
-                    if uv_faces is not None:
-                        all_uv_faces.extend(uv_faces)
-                    if normal_faces is not None:
-                        all_normal_faces.extend(normal_faces)
-            
-            for idx, (face_idx, normal_idx) in enumerate(zip(triangles, all_normal_faces)):
-                if -1 in normal_idx:
-                    v0, v1, v2 = (np.array(vertices[i]) for i in face_idx)
-                    n = np.cross(v1 - v0, v2 - v0)
-                    norm_len = np.linalg.norm(n)
-                    if norm_len != 0:
-                        n /= norm_len
-                    normals.append(tuple(n))
-                    new_n_idx = len(normals) - 1
-                    # NOTE updated normals will all have the same index.
-                    # This is because they will all be facing the same direction.
-                    # This has the effect of doing flat shading.
-                    updated_normal_idx = tuple(new_n_idx if i == -1 else i for i in normal_idx)
-                    all_normal_faces[idx] = updated_normal_idx
-
-                            
-            for index_tri in all_normal_faces:
-                for index in index_tri:
-                    if index == -1:
-                        raise Exception("Not yet generated")
-                    if index >= len(normals) or index < 0:
-                        raise Exception("Normal pointing to invalid index")
-        
         texture_obj: Texture|None = None
         if texture_filepath is not None:
-            texture_obj = Texture(texture_filepath)
+            texture_obj = Texture(texture_filepath, storage=texture_storage)
+
+        cache_path = mesh_cache.cache_path_for(filepath)
+        cache_params = {"reverse_faces": bool(reverse_faces), "optimize": bool(optimize)}
+        if use_cache:
+            arrays = mesh_cache.load(cache_path, filepath, cache_params)
+            # A cache without a BVH or levels is still fine, they're built and the cache rewritten below
+            if arrays is not None and (not build_bvh or BVH.has_arrays(arrays)) and (not build_lods or lod.has_arrays(arrays)):
+                return RenderableObject.from_arrays(arrays, name=filepath, texture_obj=texture_obj)
+
+        vertices, texcoords, normals, triangles, all_uv_faces, all_normal_faces = parse_obj(filepath, reverse_faces)
 
         renderable_object = RenderableObject(
-            np.array(vertices),
-            np.array(triangles),
+            vertices,
+            triangles,
             name=filepath,
             uv_faces=all_uv_faces,
-            texcoords=np.array(texcoords),
+            texcoords=texcoords,
             texture_obj=texture_obj,
-            normals=np.array(normals),
+            normals=normals,
             normal_faces=all_normal_faces
         )
+
+        if optimize:
+            print(renderable_object.optimize().summary())
+        if build_bvh:
+            renderable_object.get_bvh()
+        if build_lods:
+            renderable_object.get_lod_levels()
+        if use_cache:
+            renderable_object.save_cache(cache_path, filepath, cache_params)
         
         return renderable_object
 
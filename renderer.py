@@ -0,0 +1,160 @@
+# renderer.py
+# Headless entry point: renders a scene straight to NumPy arrays without opening a window,
+# so it can run on display-less servers and be driven from code or the command line.
+#
+#   python renderer.py resources/foxSitting.obj --texture resources/colMap.bytes --frames 120 --out frames/
+
+import argparse
+import os
+import time
+import numpy as np
+import pygame
+from numpy.typing import NDArray
+from Camera import Camera
+from profiler import Profiler
+from renderable_object import RenderableObject
+from pipeline import AMBIENT
+from instancing import InstancedObject
+from scene import Scene, draw_objects
+from rasterizer import PainterRasterizer, ZBufferRasterizer, TiledRasterizer
+
+
+class Renderer:
+    """
+    Offscreen renderer. Takes a scene (a Scene, or a list of RenderableObjects and InstancedObjects,
+    + Camera) and returns the frame as an (height, width, 3) uint8 array.
+
+    mode picks the rasterizer: "zbuffer", "tiled" (tile-parallel z-buffer) or "painter".
+    The painter mode draws onto an offscreen pygame Surface, which doesn't need a display either.
+    textured turns on per-pixel texturing for the z-buffer modes, texture_filter is "bilinear" or "trilinear".
+    Throughput numbers are collected in self.rasterizer.stats.
+    Objects entirely outside the view are skipped before any per-vertex work, the number skipped
+    in the last frame is in self.culled_objects.
+    """
+    def __init__(self, width: int, height: int, mode: str = "zbuffer", scale: float = 150,
+                 background=(0, 0, 0), ambient: float = AMBIENT, workers: int | None = None,
+                 textured: bool = False, texture_filter: str = "bilinear"):
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.scale = scale
+        self.background = background
+        self.ambient = ambient
+        self.culled_objects = 0
+
+        self._surface: pygame.Surface | None = None
+        if mode == "zbuffer":
+            self.rasterizer = ZBufferRasterizer(width, height, textured=textured, texture_filter=texture_filter)
+        elif mode == "tiled":
+            self.rasterizer = TiledRasterizer(width, height, workers=workers, textured=textured,
+                                              texture_filter=texture_filter)
+        elif mode == "painter":
+            self.rasterizer = PainterRasterizer()
+            self._surface = pygame.Surface((width, height))
+        else:
+            raise ValueError(f"Unknown render mode: {mode}")
+
+    def render(self, objects: Scene | list[RenderableObject | InstancedObject], cam: Camera) -> NDArray[np.uint8]:
+        """Render every object as seen from cam and return the (height, width, 3) frame."""
+        size = (self.width, self.height)
+        with Profiler.scope("render"):
+            if self._surface is not None:
+                self.rasterizer.begin_frame(self._surface, self.background)
+            else:
+                self.rasterizer.begin_frame(None, self.background, size=size)
+
+            if isinstance(objects, Scene):
+                with Profiler.scope("scene_update"):
+                    objects.update()
+                objects = objects.renderables()
+            self.culled_objects = draw_objects(objects, cam, self.rasterizer, size, self.scale, self.ambient)
+            self.rasterizer.end_frame()
+
+            if self._surface is not None:
+                return pygame.surfarray.array3d(self._surface).swapaxes(0, 1).copy()
+            return self.rasterizer.color.copy()
+
+    def close(self):
+        if isinstance(self.rasterizer, TiledRasterizer):
+            self.rasterizer.close()
+
+
+def orbit_camera(cam: Camera, angle: float, radius: float, height: float = 0.0):
+    """Place cam on a circle around the origin at the given angle, looking at the y axis."""
+    cam.position = np.array([radius * np.cos(angle), height, radius * np.sin(angle)])
+    # forward = (cos(yaw), 0, sin(yaw)) has to point back at the origin
+    cam.yaw = angle + np.pi
+    cam.pitch = 0
+    cam.update_vectors()
+
+
+def save_frame(frame: np.ndarray, path: str):
+    """Write a frame to disk, .npy is written raw, anything else goes through pygame.image.save."""
+    if path.endswith(".npy"):
+        np.save(path, frame)
+    else:
+        pygame.image.save(pygame.surfarray.make_surface(frame.swapaxes(0, 1)), path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render frames of a camera orbit around OBJ models without a window.")
+    parser.add_argument("models", nargs="+", help="OBJ files to render")
+    parser.add_argument("--texture", action="append", default=[], help="texture (.bytes) for the model at the same position")
+    parser.add_argument("--frames", type=int, default=60, help="number of frames to render")
+    parser.add_argument("--size", default="1280x720", help="resolution as WIDTHxHEIGHT")
+    parser.add_argument("--mode", default="zbuffer", choices=["zbuffer", "tiled", "painter"])
+    parser.add_argument("--workers", type=int, default=None, help="worker count for the tiled mode")
+    parser.add_argument("--textured", action="store_true", help="texture per pixel instead of one color per face")
+    parser.add_argument("--filter", default="bilinear", choices=["bilinear", "trilinear"], help="texture filter for --textured")
+    parser.add_argument("--radius", type=float, default=3.0, help="distance of the camera from the origin")
+    parser.add_argument("--height", type=float, default=0.0, help="height of the camera")
+    parser.add_argument("--out", default=None, help="directory to write frames to, nothing is written when omitted")
+    parser.add_argument("--format", default="png", choices=["png", "npy"])
+    parser.add_argument("--trace", default=None, help="write a trace of all frames to this file (*.speedscope.json "
+                                                      "for speedscope, anything else is Chrome Trace Event JSON)")
+    parser.add_argument("--profile", action="store_true", help="print the profiler report with frame time percentiles")
+    parser.add_argument("--optimize", action="store_true", help="weld, deduplicate and reorder the meshes at load and print what it did")
+    args = parser.parse_args(argv)
+
+    width, height = (int(x) for x in args.size.lower().split("x"))
+    objects = []
+    for i, path in enumerate(args.models):
+        texture = args.texture[i] if i < len(args.texture) else None
+        objects.append(RenderableObject.load_new_obj(path, texture_filepath=texture, texture_storage="uint8",
+                                                      optimize=args.optimize))
+    triangles = sum(len(obj.faces) for obj in objects)
+
+    cam = Camera(position=[0, 0, 0], forward=[0, 0, 1], up=[0, 1, 0], fov=np.radians(60), aspect=width / height)
+    renderer = Renderer(width, height, mode=args.mode, workers=args.workers, textured=args.textured,
+                        texture_filter=args.filter)
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+
+    Profiler.set_enabled(args.profile or args.trace is not None)
+    if args.trace is not None:
+        Profiler.start_trace()
+    render_time = 0.0
+    for i in range(args.frames):
+        orbit_camera(cam, 2 * np.pi * i / max(args.frames, 1), args.radius, args.height)
+        start = time.perf_counter()
+        frame = renderer.render(objects, cam)
+        render_time += time.perf_counter() - start
+        if args.out is not None:
+            save_frame(frame, os.path.join(args.out, f"frame_{i:04d}.{args.format}"))
+        Profiler.end_frame()
+    renderer.close()
+
+    fps = args.frames / render_time if render_time > 0 else float("inf")
+    label = args.mode + (f", textured {args.filter}" if args.textured else "")
+    print(f"{args.frames} frames at {width}x{height} ({label}) in {render_time:.3f}s: "
+          f"{fps:.2f} fps, {fps * triangles / 1e6:.3f}M triangles/s")
+    print(f"rasterizer: {renderer.rasterizer.stats.summary()}")
+    if args.profile:
+        Profiler.profile_accumulate_report(intervals=args.frames)
+    if args.trace is not None:
+        count = Profiler.save_trace(args.trace)
+        print(f"wrote {count} trace events to {args.trace}")
+
+
+if __name__ == "__main__":
+    main()
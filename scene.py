@@ -0,0 +1,180 @@
+# scene.py
+# Scene graph: nodes with a local Transform, an optional renderable and children. World matrices
+# are cached per node and only recomputed for the subtrees whose transforms changed, so a static
+# scene costs a walk over the nodes and no matrix math per frame.
+# Also home of the one draw path every renderable goes through (draw_objects).
+
+import warnings
+import numpy as np
+from numpy.typing import NDArray
+from Camera import Camera
+from profiler import Profiler
+from transform import Transform
+from renderable_object import RenderableObject
+from instancing import InstancedObject, instance_batches, instanced_frame_faces
+from pipeline import object_frame_faces, objects_in_frustum, screen_frustum, AMBIENT
+
+
+class Node:
+    """
+    A node in the scene graph. transform is relative to the parent, world_matrix is
+    parent.world_matrix @ transform, cached and refreshed by Scene.update().
+
+    A RenderableObject attached to a node gets its own Transform that Scene.update() keeps equal
+    to the node's world matrix, so one RenderableObject belongs in one node only (draw copies with
+    an InstancedObject). Without a transform given, the node starts out with a copy of the
+    object's, so it stays where it was. Attaching an object with a placed transform to an existing
+    node (node.renderable = obj) replaces that placement with the node's and warns. InstancedObjects keep their own world space matrices, the node's transform
+    doesn't apply to them.
+    Hiding a node (visible = False) hides its whole subtree.
+    """
+    def __init__(self, name: str = "Node", transform: Transform | None = None,
+                 renderable: RenderableObject | InstancedObject | None = None, visible: bool = True):
+        self.name = name
+        self.visible = visible
+        self.parent: Node | None = None
+        self.children: list[Node] = []
+
+        self._world = np.eye(4)
+        self._local_version = None  # transform.version the world matrix was computed with
+        if transform is None:
+            # The node takes over where the object was placed
+            transform = renderable.transform.copy() if isinstance(renderable, RenderableObject) else Transform()
+        self.transform = transform
+        self._attach(renderable)
+
+    @property
+    def transform(self) -> Transform:
+        return self._transform
+
+    @transform.setter
+    def transform(self, value: Transform):
+        self._transform = value
+        self._local_version = None
+
+    @property
+    def renderable(self) -> RenderableObject | InstancedObject | None:
+        return self._renderable
+
+    @renderable.setter
+    def renderable(self, value):
+        if isinstance(value, RenderableObject) and not np.allclose(value.transform.get_matrix(), np.eye(4)):
+            warnings.warn(f"{value.name}'s transform is replaced by the world matrix of node {self.name}, "
+                          "move the node instead", stacklevel=2)
+        self._attach(value)
+
+    def _attach(self, value):
+        self._renderable = value
+        if isinstance(value, RenderableObject):
+            # Never write into a Transform someone else holds on to
+            value.transform = Transform()
+            self._local_version = None
+
+    @property
+    def world_matrix(self) -> NDArray[np.float64]:
+        """(4, 4) local to world matrix, as of the last Scene.update()."""
+        return self._world
+
+    def add(self, child: "Node") -> "Node":
+        """Attach child (moving it away from its old parent) and return it."""
+        if child.parent is not None:
+            child.parent.remove(child)
+        child.parent = self
+        child._local_version = None
+        self.children.append(child)
+        return child
+
+    def remove(self, child: "Node"):
+        self.children.remove(child)
+        child.parent = None
+
+    def walk(self):
+        """This node and every node below it, depth first."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+
+class Scene:
+    """
+    A tree of Nodes under root. Call update() once per frame before reading world matrices,
+    renderables() gives what's left to draw.
+    """
+    def __init__(self):
+        self.root = Node("root")
+        # Number of nodes whose world matrix was recomputed by the last update()
+        self.updated_nodes = 0
+
+    def add(self, node: Node, parent: Node | None = None) -> Node:
+        return (parent if parent is not None else self.root).add(node)
+
+    def find(self, name: str) -> Node | None:
+        return next((node for node in self.root.walk() if node.name == name), None)
+
+    def update(self) -> int:
+        """
+        Refresh the world matrices of every node whose transform, or any parent's, changed since the
+        last update. Returns how many were recomputed.
+        """
+        updated = 0
+        # (node, whether the parent's world matrix changed during this update)
+        stack = [(child, False) for child in reversed(self.root.children)]
+        while stack:
+            node, parent_changed = stack.pop()
+            changed = parent_changed or node._local_version != node._transform.version
+            if changed:
+                local = node._transform.get_matrix()
+                node._world = local if node.parent is self.root else node.parent._world @ local
+                node._local_version = node._transform.version
+                if isinstance(node._renderable, RenderableObject):
+                    node._renderable.transform.set_matrix(node._world)
+                updated += 1
+            stack.extend((child, changed) for child in reversed(node.children))
+        self.updated_nodes = updated
+        return updated
+
+    def renderables(self) -> list[RenderableObject | InstancedObject]:
+        """Renderables of all visible nodes, in tree order."""
+        result = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if not node.visible:
+                continue
+            if node._renderable is not None:
+                result.append(node._renderable)
+            stack.extend(reversed(node.children))
+        return result
+
+
+def frame_faces(obj: RenderableObject | InstancedObject, cam: Camera, screen_size: tuple[int, int],
+                scale: float = 150, ambient: float = AMBIENT, planes: np.ndarray | None = None):
+    """FrameFaces of a renderable: one for a RenderableObject, one per batch of visible copies for an InstancedObject."""
+    if isinstance(obj, InstancedObject):
+        for copies in instance_batches(obj, planes):
+            with Profiler.scope("face_setup"):
+                frame = instanced_frame_faces(obj, copies, cam, screen_size, scale, ambient=ambient)
+            yield frame
+    else:
+        with Profiler.scope("face_setup"):
+            frame = object_frame_faces(obj, cam, screen_size, scale, ambient=ambient)
+        yield frame
+
+
+def draw_objects(objects: list[RenderableObject | InstancedObject], cam: Camera, rasterizer,
+                 screen_size: tuple[int, int], scale: float = 150, ambient: float = AMBIENT) -> int:
+    """
+    The draw path for any list of renderables: frustum cull them all at once, then set up and
+    rasterize what's left, between the rasterizer's begin_frame and end_frame.
+    Returns how many objects were culled.
+    """
+    with Profiler.scope("cull"):
+        planes = screen_frustum(cam, screen_size, scale)
+        visible = objects_in_frustum(objects, planes)
+    for obj in (obj for obj, keep in zip(objects, visible) if keep):
+        for frame in frame_faces(obj, cam, screen_size, scale, ambient, planes):
+            with Profiler.scope("rasterize"):
+                rasterizer.draw(frame)
+    return int(len(objects) - visible.sum())
@@ -1,40 +1,265 @@
 # texture.py
 
+import os
 import numpy as np
 from numpy.typing import NDArray
 
-def _create_texture_from_bytes(filepath: str) -> NDArray[np.float32]:
+# .bytes textures: 2 bytes width, 2 bytes height (little endian), then width * height RGB triplets
+HEADER_SIZE = 4
+
+
+def _read_header(filepath: str) -> tuple[int, int]:
+    """Read width and height from a .bytes texture and check the file is big enough to hold them."""
+    with open(filepath, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError(f"{filepath} is too short to be a texture, missing the width/height header")
+    width = header[0] | (header[1] << 8)
+    height = header[2] | (header[3] << 8)
+
+    expected = HEADER_SIZE + width * height * 3
+    actual = os.path.getsize(filepath)
+    if actual < expected:
+        raise ValueError(f"{filepath} says it is {width}x{height} which needs {expected} bytes, but the file only has {actual}")
+    if actual > expected:
+        print(f"Warning: {filepath} has {actual - expected} bytes after the {width}x{height} image, they will be ignored.")
+    return width, height
+
+
+def _map_texture_bytes(filepath: str) -> NDArray[np.uint8]:
+    """Memory map the raw (height, width, 3) uint8 pixels of a .bytes texture, nothing is read up front."""
+    width, height = _read_header(filepath)
+    return np.memmap(filepath, dtype=np.uint8, mode='r', offset=HEADER_SIZE, shape=(height, width, 3))
+
+
+def _create_texture_from_bytes(filepath: str, storage: str = "float32") -> NDArray[np.float32] | NDArray[np.uint8]:
+    width, height = _read_header(filepath)
     with open(filepath, 'rb') as f:
         bytes_data = f.read()
+    pixels = np.frombuffer(bytes_data, dtype=np.uint8, count=width * height * 3, offset=HEADER_SIZE)
+    pixels = pixels.reshape(height, width, 3)
+    if storage == "uint8":
+        return pixels.copy()  # own the memory instead of keeping the whole file buffer alive
+    return pixels.astype(np.float32) / 255.0
 
-    width = bytes_data[0] | (bytes_data[1] << 8)
-    height = bytes_data[2] | (bytes_data[3] << 8)
 
-    image = np.zeros((height, width, 3), dtype=np.float32)
-    index = 4  # skip width and height bytes
+STORAGE_TYPES = ("float32", "uint8")
+FILTERS = ("bilinear", "trilinear")
 
-    for y in range(height):
-        for x in range(width):
-            r = bytes_data[index + 0] / 255.0
-            g = bytes_data[index + 1] / 255.0
-            b = bytes_data[index + 2] / 255.0
-            image[y, x] = [r, g, b]
-            index += 3
 
-    return image
+# uint8 images are downsampled this many output rows at a time, so a big (memory mapped) image
+# never gets a full size wider copy
+DOWNSAMPLE_ROWS = 64
+
+
+def _downsample(image: np.ndarray) -> np.ndarray:
+    """Half size image with a 2x2 box filter. Odd sizes repeat their last row/column so nothing is dropped."""
+    if image.dtype == np.uint8:
+        return _downsample_uint8(image)
+    height, width = image.shape[:2]
+    work = image.astype(np.float32)
+    if height % 2 == 1 and height > 1:
+        work = np.concatenate([work, work[-1:]], axis=0)
+    if width % 2 == 1 and width > 1:
+        work = np.concatenate([work, work[:, -1:]], axis=1)
+    if work.shape[0] > 1:
+        work = (work[0::2] + work[1::2]) * 0.5
+    if work.shape[1] > 1:
+        work = (work[:, 0::2] + work[:, 1::2]) * 0.5
+    return work
+
+
+def _downsample_uint8(image: np.ndarray) -> NDArray[np.uint8]:
+    """
+    _downsample for uint8 images: sums the 2x2 blocks in uint16, DOWNSAMPLE_ROWS output rows at a time,
+    and rounds half to even like np.round does.
+    """
+    height, width = image.shape[:2]
+    out_height = (height + 1) // 2
+    out_width = (width + 1) // 2
+    # log2 of how many texels go into one: 2x2, or 2 when a side is already 1
+    shift = (height > 1) + (width > 1)
+    result = np.empty((out_height, out_width, 3), dtype=np.uint8)
+    for start in range(0, out_height, DOWNSAMPLE_ROWS):
+        stop = min(start + DOWNSAMPLE_ROWS, out_height)
+        work = np.asarray(image[2 * start:2 * stop], dtype=np.uint16)
+        if height > 1 and work.shape[0] % 2 == 1:
+            work = np.concatenate([work, work[-1:]], axis=0)
+        if width > 1 and width % 2 == 1:
+            work = np.concatenate([work, work[:, -1:]], axis=1)
+        if height > 1:
+            work = work[0::2] + work[1::2]
+        if width > 1:
+            work = work[:, 0::2] + work[:, 1::2]
+        if shift == 0:
+            result[start:stop] = work
+            continue
+        quotient = work >> shift
+        remainder = work & ((1 << shift) - 1)
+        half = 1 << (shift - 1)
+        round_up = (remainder > half) | ((remainder == half) & (quotient & 1 == 1))
+        result[start:stop] = quotient + round_up
+    return result
+
+
+def build_mip_pyramid(image: np.ndarray) -> list[np.ndarray]:
+    """All mip levels of image, from the image itself (level 0) down to 1x1. Levels keep the dtype of image."""
+    levels = [image]
+    while levels[-1].shape[0] > 1 or levels[-1].shape[1] > 1:
+        levels.append(_downsample(levels[-1]))
+    return levels
 
 
 class Texture:
-    def __init__(self, filepath: str):
-        self.image: NDArray[np.float32]  # shape: (width, height, 3)
-        self.image = np.array(_create_texture_from_bytes(filepath), dtype=np.float32)
+    """
+    An RGB image loaded from a .bytes texture.
+
+    storage picks how the pixels are kept in memory:
+        "float32": normalized 0-1 floats (the default)
+        "uint8": the raw 0-255 bytes, a quarter of the memory. Normalized to 0-1 only when sampled as float.
+    With mmap=True the pixels stay in the file as a read-only uint8 memory map (implies uint8 storage),
+    so the image isn't even read up front.
+
+    With mipmaps=True the mip pyramid for sample_lod is built right away (for a memory mapped image
+    that reads the whole file once, a few rows at a time), with False it's built the first time it's
+    needed. The default builds it right away, except for memory mapped images.
+    The pyramid adds about a third to the memory of the image.
+    """
+    def __init__(self, filepath: str, mmap: bool = False, storage: str = "float32", mipmaps: bool | None = None):
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown texture storage: {storage}, expected one of {STORAGE_TYPES}")
+        self.image: NDArray[np.float32] | NDArray[np.uint8]  # shape: (height, width, 3)
+        if mmap:
+            self.image = _map_texture_bytes(filepath)
+        else:
+            self.image = _create_texture_from_bytes(filepath, storage)
         self.width: int = self.image.shape[1]
         self.height: int = self.image.shape[0]
+        self._mip_levels: list[np.ndarray] | None = None
+        if mipmaps is None:
+            mipmaps = not mmap
+        if mipmaps:
+            self._mip_levels = build_mip_pyramid(self.image)
+
+    @property
+    def storage(self) -> str:
+        return "uint8" if self.image.dtype == np.uint8 else "float32"
+
+    @property
+    def mip_levels(self) -> list[np.ndarray]:
+        """Mip pyramid, level 0 is the image itself, each next level is half the size."""
+        if self._mip_levels is None:
+            self._mip_levels = build_mip_pyramid(self.image)
+        return self._mip_levels
     
-def sample(texture: Texture, uv: np.ndarray):
+def sample(texture: Texture, uv: np.ndarray, as_uint8: bool = False):
+    """
+    Nearest texel lookup at uv (..., 2), repeating outside 0-1.
+    Returns float32 colors in 0-1, or 0-255 uint8 colors with as_uint8=True.
+    Either way, whatever the texture storage is.
+    """
     u = uv[..., 0]  # shape (X, Y)
     v = uv[..., 1]  # shape (X, Y)
     tex_x = np.round(u * texture.width).astype(np.int32) % texture.width
     tex_y = np.round(v * texture.height).astype(np.int32) % texture.height
     sampled = texture.image[tex_y, tex_x]
-    return sampled
\ No newline at end of file
+    if sampled.dtype == np.uint8:
+        return sampled if as_uint8 else sampled.astype(np.float32) / 255.0
+    if as_uint8:
+        return np.floor(sampled * 255).astype(np.uint8)
+    return sampled
+
+
+def lod_from_footprint(texture: Texture, uv_area: np.ndarray, pixel_area: np.ndarray) -> NDArray[np.float32]:
+    """
+    Mip level for a surface that covers uv_area of the texture on pixel_area screen pixels (e.g. the
+    uv and screen area of a triangle). log2 of how many texels one pixel covers along an edge.
+    """
+    uv_area = np.abs(np.asarray(uv_area, dtype=np.float64))
+    pixel_area = np.abs(np.asarray(pixel_area, dtype=np.float64))
+    texels_per_pixel = uv_area * (texture.width * texture.height) / np.maximum(pixel_area, 1e-12)
+    lod = 0.5 * np.log2(np.maximum(texels_per_pixel, 1e-12))
+    return np.clip(lod, 0, len(texture.mip_levels) - 1).astype(np.float32)
+
+
+def _bilinear(image: np.ndarray, uv: np.ndarray) -> NDArray[np.float32]:
+    """Bilinear lookup of (K, 2) uvs in one mip level, repeating outside 0-1. Returns (K, 3) floats in 0-1."""
+    height, width = image.shape[:2]
+    # Texel centers sit at half texel offsets
+    x = uv[:, 0].astype(np.float32) * np.float32(width) - np.float32(0.5)
+    y = uv[:, 1].astype(np.float32) * np.float32(height) - np.float32(0.5)
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = (x - x0)[:, None]
+    fy = (y - y0)[:, None]
+    x0 = x0.astype(np.int64) % width
+    y0 = y0.astype(np.int64) % height
+    x1 = x0 + 1
+    x1[x1 == width] = 0
+    y1 = (y0 + 1) * width
+    y1[y1 == height * width] = 0
+    y0 *= width
+
+    # Gather from the flattened image, one index per texel instead of a (row, col) pair
+    # (np.take is a lot quicker than fancy indexing for gathering whole rows)
+    texels = image.reshape(-1, 3)
+    c00 = np.take(texels, y0 + x0, axis=0).astype(np.float32)
+    c01 = np.take(texels, y0 + x1, axis=0).astype(np.float32)
+    c10 = np.take(texels, y1 + x0, axis=0).astype(np.float32)
+    c11 = np.take(texels, y1 + x1, axis=0).astype(np.float32)
+    top = c00 + (c01 - c00) * fx
+    bottom = c10 + (c11 - c10) * fx
+    result = top + (bottom - top) * fy
+    if image.dtype == np.uint8:
+        result *= np.float32(1 / 255)
+    return result
+
+
+def sample_lod(texture: Texture, uv: np.ndarray, lod: np.ndarray | float = 0.0, filter: str = "trilinear",
+               as_uint8: bool = False):
+    """
+    Filtered lookup of a batch of uvs (..., 2) from the mip pyramid, repeating outside 0-1.
+
+    lod is the mip level per sample (same leading shape as uv) or one level for all of them.
+    "bilinear" filters within the nearest mip level, "trilinear" also blends between the two
+    levels around lod. Samples are gathered level by level so every read stays inside one level.
+    Returns float32 colors in 0-1, or 0-255 uint8 colors with as_uint8=True.
+    """
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown texture filter: {filter}, expected one of {FILTERS}")
+    uv = np.asarray(uv, dtype=np.float64)
+    shape = uv.shape[:-1]
+    uv = uv.reshape(-1, 2)
+    levels = texture.mip_levels
+    lod = np.clip(np.broadcast_to(np.asarray(lod, dtype=np.float32), shape).reshape(-1), 0, len(levels) - 1)
+
+    if filter == "bilinear":
+        base = np.round(lod).astype(np.int64)
+        blend = np.zeros(len(lod), dtype=np.float32)
+    else:
+        base = np.floor(lod).astype(np.int64)
+        blend = lod - base
+
+    if len(uv) > 0 and base.min() == base.max() and not np.any(blend > 0):
+        # Everything comes from one level (e.g. one triangle), no need to split the samples up
+        result = _bilinear(levels[int(base[0])], uv)
+        return _finish_samples(result, shape, as_uint8)
+
+    result = np.zeros((len(uv), 3), dtype=np.float32)
+    for level in np.unique(base).tolist():
+        idx = np.flatnonzero(base == level)
+        colors = _bilinear(levels[level], uv[idx])
+        # Blend in the next level where lod is between two levels
+        blended = np.flatnonzero(blend[idx] > 0)
+        if len(blended) > 0 and level + 1 < len(levels):
+            t = blend[idx[blended]][:, None]
+            colors[blended] = colors[blended] * (1 - t) + _bilinear(levels[level + 1], uv[idx[blended]]) * t
+        result[idx] = colors
+    return _finish_samples(result, shape, as_uint8)
+
+
+def _finish_samples(result: np.ndarray, shape: tuple, as_uint8: bool):
+    result = result.reshape(*shape, 3)
+    if as_uint8:
+        return np.floor(np.clip(result, 0, 1) * 255).astype(np.uint8)
+    return result
@@ -17,6 +17,9 @@ class Transform:
 
     Use copy() to create a new independent copy.
 
+    Every in-place modification bumps `version`, so anything caching data derived from
+    this Transform can tell when it needs to be recomputed.
+
     Supports matrix multiplication (@) to combine two Transforms by multiplying their full matrices.
 
     Rotation input formats accepted:
@@ -43,6 +46,7 @@ class Transform:
         self._rotation = self._parse_rotation(rotation) if rotation is not None else np.eye(4)
         self._scale = self._parse_scale(scale) if scale is not None else np.eye(4)
         self._translation = self._parse_translation(translation) if translation is not None else np.eye(4)
+        self.version = 0
 
     def get_matrix(self) -> NDArray[np.float64]:
         """Compute and return the combined 4x4 transform matrix."""
@@ -69,6 +73,7 @@ class Transform:
         """
         rot = self._parse_rotation(R)
         self._rotation = self._rotation @ rot
+        self.version += 1
 
     def scale(self, S) -> None:
         """
@@ -76,6 +81,7 @@ class Transform:
         """
         scale = self._parse_scale(S)
         self._scale = self._scale @ scale
+        self.version += 1
 
     def translate(self, T) -> None:
         """
@@ -83,6 +89,17 @@ class Transform:
         """
         trans = self._parse_translation(T)
         self._translation = self._translation @ trans
+        self.version += 1
+
+    def set_matrix(self, M) -> None:
+        """
+        In-place: replace the whole transform with a 4x4 matrix. Like __matmul__ it's kept in the
+        translation component, rotation and scale become identity.
+        """
+        self._rotation = np.eye(4)
+        self._scale = np.eye(4)
+        self._translation = np.array(M, dtype=np.float64).reshape(4, 4)
+        self.version += 1
 
     def copy(self) -> "Transform":
         """Return a deep copy of this Transform."""
@@ -160,4 +177,216 @@ class Transform:
         Ry = np.array([[cy,0,sy],[0,1,0],[-sy,0,cy]])
         Rz = np.array([[cz,-sz,0],[sz,cz,0],[0,0,1]])
         return Rz @ Ry @ Rx
-    
\ No newline at end of file
+    
+
+def euler_to_quaternion(angles) -> NDArray[np.float64]:
+    """(..., 3) Euler angles (radians, same convention as Transform: Rz @ Ry @ Rx) to (..., 4) w, x, y, z quaternions."""
+    half = np.asarray(angles, dtype=np.float64) / 2
+    cx, cy, cz = np.cos(half[..., 0]), np.cos(half[..., 1]), np.cos(half[..., 2])
+    sx, sy, sz = np.sin(half[..., 0]), np.sin(half[..., 1]), np.sin(half[..., 2])
+    # qz * qy * qx written out
+    return np.stack([cz * cy * cx + sz * sy * sx,
+                     cz * cy * sx - sz * sy * cx,
+                     cz * sy * cx + sz * cy * sx,
+                     sz * cy * cx - cz * sy * sx], axis=-1)
+
+
+def quaternion_multiply(a, b) -> NDArray[np.float64]:
+    """Hamilton product of (..., 4) w, x, y, z quaternions, rotating by a @ b means rotating by b first."""
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    return np.stack([aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw], axis=-1)
+
+
+def quaternion_to_matrix(q) -> NDArray[np.float64]:
+    """(..., 4) w, x, y, z quaternions to (..., 3, 3) rotation matrices, they don't have to be normalized."""
+    q = np.asarray(q, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=-1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=-1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=-2)
+
+
+def matrix_to_quaternion(m) -> NDArray[np.float64]:
+    """
+    (..., 3, 3) rotation matrices to (..., 4) w, x, y, z quaternions, with w >= 0.
+    Shepperd's method: every matrix uses the formula for whichever of w, x, y, z is largest,
+    so nothing gets divided by a value near 0 (e.g. 180 degree turns, where w is 0).
+    """
+    m = np.asarray(m, dtype=np.float64)
+    m00, m11, m22 = m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]
+    # 4 * w^2 - 1, 4 * x^2 - 1, ... up to the same constant, the largest picks the formula
+    diagonal = np.stack([m00 + m11 + m22, m00 - m11 - m22, m11 - m00 - m22, m22 - m00 - m11], axis=-1)
+    largest = np.argmax(diagonal, axis=-1)
+    s = np.sqrt(np.maximum(1 + np.take_along_axis(diagonal, largest[..., None], axis=-1)[..., 0], 1e-300)) * 2
+
+    wx, wy, wz = m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1]
+    xy, xz, yz = m[..., 0, 1] + m[..., 1, 0], m[..., 0, 2] + m[..., 2, 0], m[..., 1, 2] + m[..., 2, 1]
+    quarter = s / 4
+    candidates = np.stack([
+        np.stack([quarter, wx / s, wy / s, wz / s], axis=-1),
+        np.stack([wx / s, quarter, xy / s, xz / s], axis=-1),
+        np.stack([wy / s, xy / s, quarter, yz / s], axis=-1),
+        np.stack([wz / s, xz / s, yz / s, quarter], axis=-1),
+    ], axis=-2)
+    q = np.take_along_axis(candidates, largest[..., None, None], axis=-2)[..., 0, :]
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    return np.where(q[..., :1] < 0, -q, q)
+
+
+class TransformArray:
+    """
+    Many transforms stored as arrays instead of Transform objects: (K, 3) translations, (K, 4)
+    w, x, y, z rotation quaternions and (K, 3) scales. Every matrix is Translation @ Rotation @ Scale,
+    like Transform.get_matrix().
+
+    The composed (K, 4, 4) matrices are cached. The set_*/rotate/scale/translate methods take an
+    index (int, slice, index array or mask) of the elements to change and only mark those dirty,
+    get_matrices() rebuilds just the dirty ones. Every change bumps `version` like Transform does.
+
+    Example usage:
+        transforms = TransformArray.from_euler(np.random.uniform(0, np.pi, (1000, 3)), translations=positions)
+        transforms.rotate(slice(0, 10), [0, 0.1, 0])   # spin the first 10
+        matrices = transforms.get_matrices()          # (1000, 4, 4), only 10 were recomputed
+    """
+    def __init__(self, count: int = 0, translations=None, rotations=None, scales=None):
+        if count == 0:
+            for given in (translations, rotations, scales):
+                if given is not None:
+                    count = len(given)
+                    break
+        self._translations = np.zeros((count, 3))
+        self._rotations = np.zeros((count, 4))
+        self._rotations[:, 0] = 1
+        self._scales = np.ones((count, 3))
+        if translations is not None:
+            self._translations[:] = translations
+        if rotations is not None:
+            self._rotations[:] = rotations
+        if scales is not None:
+            self._scales[:] = scales
+
+        self._matrices = np.zeros((count, 4, 4))
+        self._matrices[:, 3, 3] = 1
+        self._dirty = np.ones(count, dtype=bool)
+        self.version = 0
+
+    @staticmethod
+    def from_euler(angles, translations=None, scales=None) -> "TransformArray":
+        """From (K, 3) Euler angles in radians, same convention as Transform."""
+        rotations = euler_to_quaternion(np.asarray(angles, dtype=np.float64).reshape(-1, 3))
+        return TransformArray(len(rotations), translations, rotations, scales)
+
+    @staticmethod
+    def from_transforms(transforms: list[Transform]) -> "TransformArray":
+        """
+        From Transform objects, which have to be plain translation / rotation / scale ones:
+        a shear in the scale or a full matrix from Transform @ Transform doesn't fit in the arrays.
+        """
+        return TransformArray(
+            len(transforms),
+            translations=[t._translation[:3, 3] for t in transforms],
+            rotations=matrix_to_quaternion(np.array([t._rotation[:3, :3] for t in transforms]).reshape(-1, 3, 3)),
+            scales=[np.diag(t._scale)[:3] for t in transforms],
+        )
+
+    def __len__(self):
+        return len(self._translations)
+
+    def to_transform(self, index: int) -> Transform:
+        """Element index as a Transform object."""
+        return Transform(rotation=quaternion_to_matrix(self._rotations[index]), scale=self._scales[index],
+                         translation=self._translations[index])
+
+    # Read-only views, change elements through the methods below so they get marked dirty
+    @property
+    def translations(self) -> NDArray[np.float64]:
+        view = self._translations.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def rotations(self) -> NDArray[np.float64]:
+        view = self._rotations.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def scales(self) -> NDArray[np.float64]:
+        view = self._scales.view()
+        view.flags.writeable = False
+        return view
+
+    def _changed(self, index):
+        self._dirty[index] = True
+        self.version += 1
+
+    def set_translation(self, index, T) -> None:
+        self._translations[index] = T
+        self._changed(index)
+
+    def set_rotation(self, index, q) -> None:
+        """Replace rotations with w, x, y, z quaternions."""
+        self._rotations[index] = q
+        self._changed(index)
+
+    def set_euler(self, index, angles) -> None:
+        """Replace rotations with Euler angles."""
+        self._rotations[index] = euler_to_quaternion(angles)
+        self._changed(index)
+
+    def set_scale(self, index, S) -> None:
+        self._scales[index] = S
+        self._changed(index)
+
+    def rotate(self, index, angles) -> None:
+        """In-place composition like Transform.rotate: applies the Euler angles *after* the current rotation."""
+        self._rotations[index] = quaternion_multiply(self._rotations[index], euler_to_quaternion(angles))
+        self._changed(index)
+
+    def scale(self, index, S) -> None:
+        """In-place composition like Transform.scale."""
+        self._scales[index] *= S
+        self._changed(index)
+
+    def translate(self, index, T) -> None:
+        """In-place composition like Transform.translate."""
+        self._translations[index] += T
+        self._changed(index)
+
+    def get_matrices(self) -> NDArray[np.float64]:
+        """(K, 4, 4) Translation @ Rotation @ Scale of every element, only the dirty ones are recomputed."""
+        dirty = np.flatnonzero(self._dirty)
+        if len(dirty) > 0:
+            # Rotation @ Scale scales the rotation's columns
+            self._matrices[dirty, :3, :3] = quaternion_to_matrix(self._rotations[dirty]) * self._scales[dirty, None, :]
+            self._matrices[dirty, :3, 3] = self._translations[dirty]
+            self._dirty[dirty] = False
+        return self._matrices
+
+    def inverse_matrices(self) -> NDArray[np.float64]:
+        """(K, 4, 4) inverses of every matrix, in closed form: Scale^-1 @ Rotation^T @ Translation^-1."""
+        matrices = self.get_matrices()
+        inverse = np.zeros_like(matrices)
+        # Rows of R^T scaled by 1 / s, since R @ S has the columns of R scaled by s
+        with np.errstate(divide="ignore"):
+            inverse[:, :3, :3] = quaternion_to_matrix(self._rotations).transpose(0, 2, 1) / self._scales[:, :, None]
+        inverse[:, :3, 3] = -np.einsum("kij,kj->ki", inverse[:, :3, :3], self._translations)
+        inverse[:, 3, 3] = 1
+        return inverse
+
+    def compose(self, other) -> NDArray[np.float64]:
+        """
+        (K, 4, 4) matrices of self @ other for every element: other is another TransformArray of
+        the same length, (K, 4, 4) matrices or a single (4, 4) matrix applied to all of them.
+        """
+        if isinstance(other, TransformArray):
+            other = other.get_matrices()
+        return self.get_matrices() @ np.asarray(other, dtype=np.float64)